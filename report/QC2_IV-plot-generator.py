@@ -5,68 +5,47 @@ QC2 IV Plot Generator
 Automatically generates IV plots for all QC2LONG_PART1 files in the data directory
 """
 
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
 from scipy.optimize import curve_fit
 import numpy as np
-import csv
 import math
 import statistics
 import os
-import fnmatch
 import argparse
+from contextlib import nullcontext
+from QC_io import FoilLock, atomic_open, atomic_path
+from QC2_dataset import FoilDataset, extract_foil_name, find_part1_files
+from QC2_writers import write_iv_points
+from QC_plotting import new_figure
 
-def find_part1_files(data_folder):
+# Maximum distance [V] below which consecutive I-V points are merged (the second one is dropped)
+MERGE_DISTANCE = 5
+# Number of PART1 samples scanned for the I-V plateaus
+IV_SAMPLES = 800
+
+def plateau_segments(voltage, current):
     """
-    Find all QC2LONG_PART1 files in the data folder
-    
+    Find the constant-voltage plateaus of the PART1 ramp
+
+    A plateau starts at a sample with zero current at non-zero voltage outside a
+    ramp, collects the following samples with non-zero current and ends at the
+    next zero-current sample. A ramp (Vmon rising by more than 2 V over two
+    samples) discards the plateau in progress. The plateaus do not depend on the
+    current threshold or merge distance, so they are computed once per foil and
+    select_iv_points picks the I-V points for any threshold and merge distance.
+
     Args:
-        data_folder (str): Path to the data folder
-    
+        voltage (array): Vmon [V]
+        current (array): Imon [uA]
+
     Returns:
-        list: List of part1 filenames
+        dict: Per-plateau arrays 'voltage' (mean [V]), 'current' (mean [nA]),
+              'error' (error of the mean current [nA], NaN for one sample) and 'n_samples'
     """
-    part1_files = []
-    for file in os.listdir(data_folder):
-        if fnmatch.fnmatch(file, 'QC2LONG_PART1_*.txt'):
-            # Exclude IVplot files
-            if 'IVplot' not in file:
-                part1_files.append(file)
-    return part1_files
-
-def process_iv_data(data_folder, part1_file, threshold=7):
-    """
-    Process IV data for a single part1 file
-    
-    Args:
-        data_folder (str): Path to the data folder
-        part1_file (str): Name of the part1 file to process
-        threshold (float): Threshold for current values
-    """
-    print(f'\nProcessing {part1_file}...')
-    
-    # Read the data file
-    with open(os.path.join(data_folder, part1_file)) as csv_file:
-        csv_content = csv.reader(csv_file, delimiter='\t')
-        data_list = list(csv_content)
-    del data_list[0:6]  # Delete the headers
-
-    # Initialize lists
-    voltage_list = []
-    current_list = []
-    time_list = []
-    voltage_list_to_plot = []
-    current_list_to_plot = []
-    err_current_list_to_plot = []
-    
-    # Parse data
-    for row in data_list:
-        voltage_list.append(float(row[0]))
-        current_list.append(float(row[1]))
-        time_list.append(float(row[2]))
+    # Plain floats for the sample-by-sample loop below
+    voltage_list = voltage.tolist()
+    current_list = current.tolist()
 
-    # Process data for I-V plot
+    segments = {'voltage': [], 'current': [], 'error': [], 'n_samples': []}
     start = False
     ramp_up = False
     store = False
@@ -74,7 +53,7 @@ def process_iv_data(data_folder, part1_file, threshold=7):
     voltage_list_to_average = []
     current_list_to_average = []
 
-    for j in range(800):
+    for j in range(IV_SAMPLES):
         if(voltage_list[j+2]-voltage_list[j]>2):
             ramp_up = True
             start = False
@@ -94,66 +73,147 @@ def process_iv_data(data_folder, part1_file, threshold=7):
         elif(start==True and store==True and current_list[j]==0):
             if(len(voltage_list_to_average)>0 and update_list==True):
                 update_list = False
-                try:
-                    if(statistics.mean(current_list_to_average)<threshold):
-                        voltage_list_to_plot.append(statistics.mean(voltage_list_to_average))
-                        current_list_to_plot.append(statistics.mean(current_list_to_average))
-                        err_current_list_to_plot.append(statistics.stdev(current_list_to_average)/math.sqrt(len(current_list_to_average)))
-                except ValueError:
-                    if voltage_list_to_plot:  # Only pop if list is not empty
-                        voltage_list_to_plot.pop(-1)
-                        current_list_to_plot.pop(-1)
-                else:
-                    print(f'Imon= {statistics.mean(current_list_to_average):.2f} nA. Current higher than threshold, point not added.')
+                n = len(current_list_to_average)
+                segments['voltage'].append(statistics.mean(voltage_list_to_average))
+                segments['current'].append(statistics.mean(current_list_to_average))
+                segments['error'].append(statistics.stdev(current_list_to_average)/math.sqrt(n) if n > 1 else math.nan)
+                segments['n_samples'].append(n)
                 voltage_list_to_average = []
                 current_list_to_average = []
 
-    # Remove points with close voltage values
-    list_idx = []
-    for i in range(0, len(voltage_list_to_plot)-1):
-        if abs(voltage_list_to_plot[i] - voltage_list_to_plot[i+1]) < 5:
-            list_idx.append(i+1)
-
-    for idx in sorted(list_idx, reverse=True):
-        del voltage_list_to_plot[idx]
-        del current_list_to_plot[idx]
-        del err_current_list_to_plot[idx]
-
-    # Create plots - exactly as in original script
-    plt.plot(time_list, voltage_list, '*')
-    plt.xlabel('Voltage (V)')
-    plt.ylabel('Current (uA)')
-    plt.close()
-    
-    plt.plot(time_list, current_list, '*')
-    plt.xlabel('Voltage (V)')
-    plt.ylabel('Current (uA)')
-    plt.close()
-    
-    plt.errorbar(x=voltage_list_to_plot, y=current_list_to_plot, yerr=err_current_list_to_plot, fmt='*')
-    plt.xlabel('Voltage (V)')
-    plt.ylabel('Current (nA)')
-    plt.savefig(os.path.join(data_folder, part1_file.replace('.txt', '_IVplot.png')))
-    plt.close()
-
-    # Save data to file
-    list_to_save = [['Voltage (V)', 'Current (nA)', 'Error_current (nA)']]
-    for v, c, e in zip(voltage_list_to_plot, current_list_to_plot, err_current_list_to_plot):
-        list_to_save.append([str(v), str(c), str(e)])
+    return {key: np.array(values, dtype=np.int64 if key == 'n_samples' else np.float64)
+            for key, values in segments.items()}
+
+def select_iv_points(segments, threshold=7, merge_distance=MERGE_DISTANCE):
+    """
+    Indices of the plateaus kept as I-V points
+
+    Plateaus of at least two samples with a mean current below the threshold are
+    kept. Of two consecutive kept points closer than merge_distance in voltage,
+    the second one is dropped (distances are taken before dropping).
+
+    Args:
+        segments (dict): Plateaus from plateau_segments
+        threshold (float): Current threshold [nA]
+        merge_distance (float): Merge distance [V]
+
+    Returns:
+        ndarray: Indices into the plateau arrays
+    """
+    kept = np.flatnonzero((segments['n_samples'] >= 2) & (segments['current'] < threshold))
+    close = np.abs(np.diff(segments['voltage'][kept])) < merge_distance
+    return kept[np.concatenate(([True], ~close))] if len(kept) else kept
+
+def process_iv_data(data_folder, part1_file, threshold=7, sidecar=False, merge_distance=MERGE_DISTANCE, lock=True):
+    """
+    Process IV data for a single part1 file
     
-    if not voltage_list_to_plot:  # If no data points
-        list_to_save = [['Voltage (V)', 'Current (nA)', 'Error_current (nA)']]
+    Args:
+        data_folder (str): Path to the data folder
+        part1_file (str): Name of the part1 file to process
+        threshold (float): Threshold for current values
+        sidecar (bool): Also write the I-V points as a binary .npy file
+        merge_distance (float): Merge distance [V] of consecutive I-V points
+        lock (bool): Take the foil lock around the writes, False if the caller already holds it
+    """
+    print(f'\nProcessing {part1_file}...')
     
+    # Read the data file
+    voltage, current, time = FoilDataset(data_folder, part1_file[:-4]).part1
+    segments = plateau_segments(voltage, current)
+    for mean_current in segments['current'][segments['current'] >= threshold]:
+        print(f'Imon= {mean_current:.2f} nA. Current higher than threshold, point not added.')
+    points = select_iv_points(segments, threshold, merge_distance)
+    voltage_list_to_plot = segments['voltage'][points].tolist()
+    current_list_to_plot = segments['current'][points].tolist()
+    err_current_list_to_plot = segments['error'][points].tolist()
+
+    # Create I-V plot
+    fig, ax = new_figure(6.4, 4.8)
+    ax.errorbar(x=voltage_list_to_plot, y=current_list_to_plot, yerr=err_current_list_to_plot, fmt='*')
+    ax.set_xlabel('Voltage (V)')
+    ax.set_ylabel('Current (nA)')
+
     data_filename = part1_file.replace('.txt', '_IVplot.txt')
-    np.savetxt(os.path.join(data_folder, data_filename), list_to_save, delimiter='\t', fmt='%s')
+    with FoilLock(data_folder, extract_foil_name(part1_file)) if lock else nullcontext():
+        with atomic_path(os.path.join(data_folder, part1_file.replace('.txt', '_IVplot.png'))) as tmp_path:
+            fig.savefig(tmp_path)
+
+        # Save data to file
+        write_iv_points(os.path.join(data_folder, data_filename), voltage_list_to_plot, current_list_to_plot,
+                        err_current_list_to_plot, sidecar=sidecar)
     print(f'Created {data_filename}')
 
+def sweep_iv_points(data_folder, part1_files, thresholds, merge_distances):
+    """
+    Compare the I-V points of every foil for several thresholds and merge distances
+
+    Each PART1 file is read and its plateaus computed once; every combination
+    is then a selection on the plateau arrays. The number of points per foil
+    and combination is printed and written to QC2_IV_sweep.txt, and each foil
+    gets an overlay plot of all combinations (<part1 file>_IVsweep.png). The
+    _IVplot files are not changed.
+
+    Args:
+        data_folder (str): Path to the data folder
+        part1_files (list): Names of the part1 files
+        thresholds (list): Current thresholds [nA]
+        merge_distances (list): Merge distances [V]
+    """
+    combinations = [(threshold, distance) for threshold in thresholds for distance in merge_distances]
+    columns = [f'{threshold:g} nA/{distance:g} V' for threshold, distance in combinations]
+    rows = []
+    for part1_file in part1_files:
+        foil_name = extract_foil_name(part1_file)
+        try:
+            voltage, current, time = FoilDataset(data_folder, part1_file[:-4]).part1
+            segments = plateau_segments(voltage, current)
+        except (OSError, ValueError, IndexError) as e:
+            print(f'Error processing {part1_file}: {e}')
+            continue
+        selections = [select_iv_points(segments, threshold, distance) for threshold, distance in combinations]
+        rows.append([foil_name] + [str(len(points)) for points in selections])
+
+        fig, ax = new_figure(6.4, 4.8)
+        # Shift the combinations slightly apart in voltage, so points kept by several of them stay visible
+        span = np.ptp(segments['voltage']) if len(segments['voltage']) else 0.0
+        for k, (label, points) in enumerate(zip(columns, selections)):
+            shift = (k - (len(combinations) - 1)/2) * 0.004 * span
+            ax.errorbar(x=segments['voltage'][points] + shift, y=segments['current'][points],
+                        yerr=segments['error'][points], fmt='*osd^v<>'[k % 8], markersize=4, alpha=0.7,
+                        label=f'{label} ({len(points)})')
+        ax.set_xlabel('Voltage (V)')
+        ax.set_ylabel('Current (nA)')
+        ax.set_title(foil_name, fontsize=10)
+        ax.legend(fontsize=7)
+        with atomic_path(os.path.join(data_folder, part1_file.replace('.txt', '_IVsweep.png'))) as tmp_path:
+            fig.savefig(tmp_path)
+
+    header = ['Foil'] + columns
+    widths = [max(len(row[k]) for row in [header] + rows) for k in range(len(header))]
+    print('\nI-V points per threshold / merge distance')
+    for row in [header] + rows:
+        print('  '.join(value.rjust(width) if k else value.ljust(width) for k, (value, width) in enumerate(zip(row, widths))))
+    table_path = os.path.join(data_folder, 'QC2_IV_sweep.txt')
+    with atomic_open(table_path) as f:
+        for row in [header] + rows:
+            f.write('\t'.join(row) + '\n')
+    print(f'Created {os.path.basename(table_path)}')
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Generate IV plots for QC2 testing')
     parser.add_argument('data_folder', help='Path to the data folder')
     parser.add_argument('--threshold', type=float, default=7,
                       help='Threshold (nA) for current values (default: 7)')
+    parser.add_argument('--merge-distance', type=float, default=MERGE_DISTANCE,
+                      help=f'Merge consecutive I-V points closer than this voltage (V) (default: {MERGE_DISTANCE})')
+    parser.add_argument('--sidecar', action='store_true',
+                      help='Also write the I-V points as a binary .npy file')
+    parser.add_argument('--sweep-thresholds', type=float, nargs='+', metavar='NA',
+                      help='Compare the I-V points for these thresholds (nA) instead of writing the IVplot files')
+    parser.add_argument('--sweep-merge-distances', type=float, nargs='+', metavar='V',
+                      help='Compare the I-V points for these merge distances (V) instead of writing the IVplot files')
     
     args = parser.parse_args()
     
@@ -166,9 +226,14 @@ def main():
     
     print(f'Found {len(part1_files)} QC2LONG_PART1 files')
     
+    if args.sweep_thresholds or args.sweep_merge_distances:
+        sweep_iv_points(args.data_folder, part1_files, args.sweep_thresholds or [args.threshold],
+                        args.sweep_merge_distances or [args.merge_distance])
+        return
+    
     # Process each file
     for part1_file in part1_files:
-        process_iv_data(args.data_folder, part1_file, args.threshold)
+        process_iv_data(args.data_folder, part1_file, args.threshold, args.sidecar, args.merge_distance)
 
 if __name__ == '__main__':
     main()
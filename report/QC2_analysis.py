@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+QC2 Analysis
+Vectorized analysis of the QC2 current and voltage series: spark (discharge)
+and HV trip detection, and leakage current statistics per HV step
+"""
+import numpy as np
+
+# Default detection parameters
+SPARK_WINDOW = 30         # Samples in the trailing baseline window
+SPARK_NSIGMA = 5.0        # Spike threshold in baseline standard deviations
+SPARK_MIN_DELTA = 0.01    # Minimum current excess over the baseline [uA]
+RAMP_TOLERANCE = 2.0      # Voltage change [V] between samples above which the HV is ramping
+TRIP_FRACTION = 0.5       # A trip is a drop below this fraction of the baseline voltage
+TRIP_MIN_VOLTAGE = 50.0   # Trips are only searched for above this baseline voltage [V]
+TRIP_SAMPLES = 3          # A trip drops the voltage within this many samples (slower drops are ramp-downs)
+EVENT_BIN = 3600.0        # Width [s] of the time windows the events are counted in
+STEP_MIN_SAMPLES = 10     # HV steps with fewer samples (ramps, glitches) are dropped
+STEP_MIN_VOLTAGE = 10.0   # HV steps below this mean voltage [V] are HV-off periods and dropped
+LEAKAGE_THRESHOLD = 0.007 # Imon [uA] above which a sample counts as leaking (7 nA, as the I-V threshold)
+
+def trailing_mean_std(x, window):
+    """
+    Mean and standard deviation of the window samples preceding each sample
+
+    Computed from cumulative sums, so the cost is O(n) whatever the window size.
+    The first window samples have no complete baseline and get NaN.
+
+    Args:
+        x (array): Input series
+        window (int): Number of preceding samples
+
+    Returns:
+        tuple: (mean, std) arrays of the same length as x
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    mean = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    if n <= window:
+        return mean, std
+    # Subtract the overall mean to limit cancellation in the running sums
+    offset = x.mean()
+    c1 = np.concatenate(([0.0], np.cumsum(x - offset)))
+    c2 = np.concatenate(([0.0], np.cumsum((x - offset)**2)))
+    s1 = c1[window:n] - c1[:n-window]
+    s2 = c2[window:n] - c2[:n-window]
+    mean[window:] = s1/window + offset
+    std[window:] = np.sqrt(np.maximum(s2/window - (s1/window)**2, 0.0))
+    return mean, std
+
+def rising_edges(mask):
+    """
+    Indices where a boolean mask switches from False to True
+
+    Args:
+        mask (array): Boolean array
+
+    Returns:
+        array: Start indices of the True runs
+    """
+    mask = np.asarray(mask, dtype=bool)
+    return np.flatnonzero(mask & ~np.concatenate(([False], mask[:-1])))
+
+def detect_sparks(voltage, current, window=SPARK_WINDOW, nsigma=SPARK_NSIGMA,
+                  min_delta=SPARK_MIN_DELTA, ramp_tolerance=RAMP_TOLERANCE):
+    """
+    Find current spikes (discharges) at stable HV
+
+    A sample is a spike if its current exceeds the trailing baseline by more than
+    nsigma standard deviations and by more than min_delta. Consecutive spike
+    samples form one event. Samples taken while the voltage is ramping are ignored,
+    since the charging current would look like a spike.
+
+    Args:
+        voltage (array): Vmon [V]
+        current (array): Imon [uA]
+        window (int): Number of samples of the trailing baseline
+        nsigma (float): Threshold in baseline standard deviations
+        min_delta (float): Minimum excess over the baseline [uA]
+        ramp_tolerance (float): Voltage step [V] above which the HV counts as ramping
+
+    Returns:
+        array: Indices of the first sample of each spark
+    """
+    voltage = np.asarray(voltage, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    if len(current) <= window:
+        return np.array([], dtype=np.intp)
+    mean, std = trailing_mean_std(current, window)
+    excess = current - mean
+    with np.errstate(invalid='ignore'):
+        spike = (excess > nsigma*std) & (excess > min_delta)
+    ramping = np.abs(np.diff(voltage, prepend=voltage[0])) > ramp_tolerance
+    return rising_edges(spike & ~ramping)
+
+def detect_trips(voltage, window=SPARK_WINDOW, trip_fraction=TRIP_FRACTION, min_voltage=TRIP_MIN_VOLTAGE,
+                 trip_samples=TRIP_SAMPLES):
+    """
+    Find HV trips, i.e. sudden drops of the voltage from a stable level
+
+    Args:
+        voltage (array): Vmon [V]
+        window (int): Number of samples of the trailing baseline
+        trip_fraction (float): Fraction of the baseline voltage below which the HV has tripped
+        min_voltage (float): Minimum baseline voltage [V] (the HV must have been on)
+        trip_samples (int): Maximum number of samples of the drop, to tell trips from ramp-downs
+
+    Returns:
+        array: Indices of the first sample of each trip
+    """
+    voltage = np.asarray(voltage, dtype=np.float64)
+    if len(voltage) <= window:
+        return np.array([], dtype=np.intp)
+    baseline, _ = trailing_mean_std(voltage, window)
+    with np.errstate(invalid='ignore'):
+        tripped = (baseline > min_voltage) & (voltage < trip_fraction*baseline)
+    edges = rising_edges(tripped)
+    drop = voltage[np.maximum(edges - trip_samples, 0)] - voltage[edges]
+    return edges[drop > (1.0 - trip_fraction)*baseline[edges]]
+
+def count_per_window(time, event_idx, bin_width=EVENT_BIN):
+    """
+    Count events in consecutive time windows
+
+    Args:
+        time (array): Time of each sample [s]
+        event_idx (array): Sample indices of the events
+        bin_width (float): Width of the time windows [s]
+
+    Returns:
+        tuple: (window start times, counts)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    if len(time) == 0:
+        return np.array([]), np.array([], dtype=np.intp)
+    t0 = time[0]
+    n_bins = max(1, int(np.ceil((time[-1] - t0) / bin_width)))
+    bins = np.minimum(((time[event_idx] - t0) // bin_width).astype(np.intp), n_bins - 1)
+    return t0 + bin_width*np.arange(n_bins), np.bincount(bins, minlength=n_bins)
+
+def analyse_discharges(time, voltage, current, bin_width=EVENT_BIN, **kwargs):
+    """
+    Spark and trip analysis of one current/voltage series
+
+    Args:
+        time (array): Time [s]
+        voltage (array): Vmon [V]
+        current (array): Imon [uA]
+        bin_width (float): Width of the time windows the events are counted in [s]
+        **kwargs: Passed on to detect_sparks (window, nsigma, min_delta, ramp_tolerance)
+
+    Returns:
+        dict: n_sparks, n_trips, spark_idx, trip_idx, window_start, sparks_per_window,
+              max_sparks_per_window and bin_width
+    """
+    spark_idx = detect_sparks(voltage, current, **kwargs)
+    trip_idx = detect_trips(voltage, window=kwargs.get('window', SPARK_WINDOW))
+    window_start, sparks_per_window = count_per_window(time, spark_idx, bin_width)
+    return {
+        'n_sparks': len(spark_idx),
+        'n_trips': len(trip_idx),
+        'spark_idx': spark_idx,
+        'trip_idx': trip_idx,
+        'window_start': window_start,
+        'sparks_per_window': sparks_per_window,
+        'max_sparks_per_window': int(sparks_per_window.max()) if len(sparks_per_window) else 0,
+        'bin_width': bin_width,
+    }
+
+def segment_reduce(ufunc, x, starts, ends):
+    """
+    Reduce x over the index ranges [starts[k], ends[k]) with a NumPy ufunc
+
+    Args:
+        ufunc (np.ufunc): Reduction, e.g. np.add or np.maximum
+        x (array): Input series
+        starts (array): First index of each range
+        ends (array): End index (exclusive) of each range, ends[k] > starts[k]
+
+    Returns:
+        array: One reduced value per range
+    """
+    # reduceat over the interleaved (start, end) indices reduces [start, end) at even
+    # positions; a padding element makes end == len(x) a valid index
+    padded = np.append(x, x[-1:])
+    bounds = np.ravel(np.column_stack((starts, ends)))
+    return ufunc.reduceat(padded, bounds)[::2]
+
+def hv_steps(voltage, ramp_tolerance=RAMP_TOLERANCE, min_samples=STEP_MIN_SAMPLES):
+    """
+    Find the constant-voltage steps of a voltage series
+
+    The series is first cut wherever Vmon changes by more than ramp_tolerance between
+    two samples (np.diff boundaries). Segments shorter than min_samples are ramps or
+    single noisy samples; consecutive long segments whose mean voltages agree within
+    ramp_tolerance are merged into one step, together with the short segments
+    between them.
+
+    Args:
+        voltage (array): Vmon [V]
+        ramp_tolerance (float): Voltage change [V] separating two steps
+        min_samples (int): Minimum number of samples of a step
+
+    Returns:
+        tuple: (first sample index, end index (exclusive)) arrays of the steps
+    """
+    voltage = np.asarray(voltage, dtype=np.float64)
+    empty = np.array([], dtype=np.intp)
+    if len(voltage) == 0:
+        return empty, empty
+    starts = np.concatenate(([0], np.flatnonzero(np.abs(np.diff(voltage)) > ramp_tolerance) + 1))
+    ends = np.append(starts[1:], len(voltage))
+    long = (ends - starts) >= min_samples
+    if not long.any():
+        return empty, empty
+    starts, ends = starts[long], ends[long]
+    mean_voltage = segment_reduce(np.add, voltage, starts, ends) / (ends - starts)
+    first = np.flatnonzero(np.concatenate(([True], np.abs(np.diff(mean_voltage)) > ramp_tolerance)))
+    last = np.append(first[1:], len(starts)) - 1
+    return starts[first], ends[last]
+
+def hv_step_statistics(time, voltage, current, threshold=LEAKAGE_THRESHOLD, ramp_tolerance=RAMP_TOLERANCE,
+                       min_samples=STEP_MIN_SAMPLES, min_voltage=STEP_MIN_VOLTAGE):
+    """
+    Leakage current statistics of each constant-voltage step
+
+    All statistics are segment reductions (np.ufunc.reduceat) over the whole series,
+    so the cost is linear in the number of samples. The standard deviation is
+    computed in two passes (around each step's own mean) to stay exact for long
+    steps with a small spread.
+
+    Args:
+        time (array): Time [s]
+        voltage (array): Vmon [V]
+        current (array): Imon [uA]
+        threshold (float): Imon [uA] above which a sample counts as leaking
+        ramp_tolerance (float): Voltage change [V] separating two steps
+        min_samples (int): Minimum number of samples of a step
+        min_voltage (float): Minimum mean voltage [V] of a step (lower steps are HV-off periods)
+
+    Returns:
+        dict: Arrays with one entry per HV step: start (time of the first sample [s]),
+              duration [s], n_samples, voltage (mean Vmon [V]), mean, stdev and max
+              (of Imon [uA]) and time_above (time [s] with Imon above threshold)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    voltage = np.asarray(voltage, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    keys = ('start', 'duration', 'n_samples', 'voltage', 'mean', 'stdev', 'max', 'time_above')
+    starts, ends = hv_steps(voltage, ramp_tolerance, min_samples)
+    if len(starts) == 0:
+        return {key: np.array([]) for key in keys}
+
+    n_samples = ends - starts
+    mean_voltage = segment_reduce(np.add, voltage, starts, ends) / n_samples
+    keep = mean_voltage >= min_voltage
+    starts, ends, n_samples, mean_voltage = starts[keep], ends[keep], n_samples[keep], mean_voltage[keep]
+    if len(starts) == 0:
+        return {key: np.array([]) for key in keys}
+
+    # Each sample lasts until the next one; the last sample gets no duration
+    dt = np.diff(time, append=time[-1])
+    mean = segment_reduce(np.add, current, starts, ends) / n_samples
+    # Deviations from the mean of the step each sample belongs to (samples between steps get 0)
+    step_id = np.searchsorted(starts, np.arange(len(current)), side='right') - 1
+    in_step = (step_id >= 0) & (np.arange(len(current)) < ends[np.maximum(step_id, 0)])
+    deviation = np.where(in_step, current - mean[np.maximum(step_id, 0)], 0.0)
+    squares = segment_reduce(np.add, deviation**2, starts, ends)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stdev = np.where(n_samples > 1, np.sqrt(squares / (n_samples - 1)), 0.0)
+
+    return {
+        'start': time[starts],
+        'duration': segment_reduce(np.add, dt, starts, ends),
+        'n_samples': n_samples,
+        'voltage': mean_voltage,
+        'mean': mean,
+        'stdev': stdev,
+        'max': segment_reduce(np.maximum, current, starts, ends),
+        'time_above': segment_reduce(np.add, np.where(current > threshold, dt, 0.0), starts, ends),
+    }
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC2 Campaign Driver
+Discovers all QC2 data directories under a campaign root, enqueues one job per
+foil into a persistent SQLite queue and runs the IV plot and report steps on a
+pool of worker processes.
+
+The queue file lives next to the data (by default <root>/.qc2_campaign.sqlite),
+so several hosts sharing the filesystem can run this script on the same root at
+the same time. Jobs are claimed with a lease: if a worker crashes, its job is
+picked up again once the lease has expired (running jobs renew their lease from
+a heartbeat thread), and re-running the script simply resumes whatever is left
+in the queue.
+"""
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import importlib.util
+import multiprocessing
+from datetime import datetime
+from QC_io import FoilLock
+from QC2_dataset import find_part1_files, extract_foil_name
+
+QUEUE_FILENAME = '.qc2_campaign.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_folder TEXT NOT NULL,
+    foil_name TEXT NOT NULL,
+    part1_file TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    started REAL,
+    finished REAL,
+    message TEXT,
+    UNIQUE (data_folder, part1_file)
+)
+"""
+
+def find_data_directories(campaign_root):
+    """
+    Find all QC2 data directories below the campaign root
+
+    Args:
+        campaign_root (str): Path to the campaign root directory
+
+    Returns:
+        list: Sorted list of directories containing QC2LONG_PART1 files
+    """
+    data_folders = []
+    for dirpath, dirnames, filenames in os.walk(campaign_root):
+        # Never descend into generated output folders
+        dirnames[:] = [d for d in dirnames if d not in ('plots', 'pdf_reports') and not d.startswith('.')]
+        for file in filenames:
+            if file.startswith('QC2LONG_PART1_') and file.endswith('.txt') and 'IVplot' not in file:
+                data_folders.append(os.path.abspath(dirpath))
+                break
+    return sorted(data_folders)
+
+def connect_queue(queue_path):
+    """
+    Open (and create if needed) the campaign queue database
+
+    Args:
+        queue_path (str): Path to the SQLite queue file
+
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode
+    """
+    # Autocommit mode so that transactions are only opened explicitly with BEGIN IMMEDIATE.
+    # The default rollback journal is kept on purpose: WAL mode does not work on network filesystems.
+    conn = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    conn.execute(SCHEMA)
+    return conn
+
+def enqueue_campaign(conn, campaign_root):
+    """
+    Enqueue one job per foil for every data directory under the campaign root
+
+    Already known foils are left untouched, so this can be run again at any time
+    (and from several hosts) without duplicating jobs.
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        campaign_root (str): Path to the campaign root directory
+
+    Returns:
+        tuple: (number of data directories, number of newly added jobs)
+    """
+    data_folders = find_data_directories(campaign_root)
+    added = 0
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for data_folder in data_folders:
+            for part1_file in sorted(find_part1_files(data_folder)):
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO jobs (data_folder, foil_name, part1_file) VALUES (?, ?, ?)',
+                    (data_folder, extract_foil_name(part1_file), part1_file))
+                added += cursor.rowcount
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return len(data_folders), added
+
+def reset_jobs(conn, which):
+    """
+    Put jobs back into the pending state, e.g. to reprocess a season after an analysis change
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        which (str): 'failed' to retry failed jobs only, 'all' to reprocess everything
+
+    Returns:
+        int: Number of jobs reset
+    """
+    query = "UPDATE jobs SET status='pending', attempts=0, worker=NULL, lease_expires=NULL, message=NULL"
+    if which == 'failed':
+        query += " WHERE status='failed'"
+    return conn.execute(query).rowcount
+
+def claim_job(conn, worker_id, lease, max_attempts):
+    """
+    Atomically claim the next pending job (or a job whose lease has expired)
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        worker_id (str): Identifier of the claiming worker (host:pid)
+        lease (float): Lease duration in seconds
+        max_attempts (int): Jobs that already failed this many times are not claimed again
+
+    Returns:
+        tuple or None: (id, data_folder, foil_name, part1_file) or None if the queue is empty
+    """
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Jobs whose worker died and which have used up their attempts are given up
+        conn.execute(
+            "UPDATE jobs SET status='failed', message='lease expired too often' "
+            "WHERE status='running' AND lease_expires < ? AND attempts >= ?", (now, max_attempts))
+        row = conn.execute(
+            "SELECT id, data_folder, foil_name, part1_file FROM jobs "
+            "WHERE status='pending' OR (status='running' AND lease_expires < ?) "
+            "ORDER BY id LIMIT 1", (now,)).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status='running', attempts=attempts+1, worker=?, lease_expires=?, started=? "
+                "WHERE id=?", (worker_id, now + lease, now, row[0]))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return row
+
+def finish_job(conn, job_id, worker_id, ok, message, max_attempts):
+    """
+    Record the outcome of a job
+
+    Failed jobs go back to pending until they have been attempted max_attempts times.
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+        job_id (int): Job id
+        worker_id (str): Identifier of the worker that ran the job
+        ok (bool): True if the job succeeded
+        message (str): Short message stored with the job
+        max_attempts (int): Maximum number of attempts per job
+    """
+    if ok:
+        status_sql = "'done'"
+    else:
+        status_sql = "CASE WHEN attempts >= %d THEN 'failed' ELSE 'pending' END" % max_attempts
+    # Only the current lease holder may finish the job; a late worker whose lease
+    # expired and whose job was reclaimed must not overwrite the new owner's state
+    conn.execute(
+        'UPDATE jobs SET status=%s, finished=?, message=?, lease_expires=NULL '
+        'WHERE id=? AND worker=?' % status_sql, (time.time(), message, job_id, worker_id))
+
+def renew_lease(queue_path, job_id, worker_id, lease, stop):
+    """
+    Heartbeat of a running job: extend its lease every lease/3 seconds until stop is set
+
+    Runs in a thread next to the job, with its own queue connection, so a job may
+    take longer than the lease while a dead worker's job is still retried after one
+    lease without heartbeat.
+
+    Args:
+        queue_path (str): Path to the SQLite queue file
+        job_id (int): Job id
+        worker_id (str): Identifier of the worker running the job
+        lease (float): Lease duration in seconds
+        stop (threading.Event): Set when the job has finished
+    """
+    conn = connect_queue(queue_path)
+    try:
+        while not stop.wait(lease / 3):
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires=? WHERE id=? AND worker=? AND status='running'",
+                (time.time() + lease, job_id, worker_id))
+            if cursor.rowcount == 0:
+                print(f'[{worker_id}] Lost the lease of job {job_id}')
+                break
+    except sqlite3.Error as e:
+        print(f'[{worker_id}] Could not renew the lease of job {job_id}: {e}')
+    finally:
+        conn.close()
+
+def load_iv_generator():
+    """
+    Load QC2_IV-plot-generator.py as a module (its file name is not importable directly)
+
+    Returns:
+        module: The IV plot generator module
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'QC2_IV-plot-generator.py')
+    spec = importlib.util.spec_from_file_location('QC2_IV_plot_generator', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_foil_job(data_folder, foil_name, part1_file, steps, threshold, datasets=None):
+    """
+    Run the requested processing steps for a single foil
+
+    The whole job runs under the foil lock, so the report is built from the I-V
+    points written by the same job and no other worker or operator can rewrite the
+    foil's outputs in between. The steps are told not to take the lock themselves
+    (the lock is not reentrant).
+
+    Args:
+        data_folder (str): Path to the data folder
+        foil_name (str): Name of the foil
+        part1_file (str): Name of the foil's QC2LONG_PART1 file
+        steps (list): Steps to run ('iv' and/or 'report')
+        threshold (float): Threshold (nA) for the IV plot generation
+        datasets (dict): Datasets of the directory from QC2_report.prepare_directory,
+            prepared for this job only if None
+
+    Returns:
+        tuple: (ok, message)
+    """
+    import QC2_report
+    from QC2_plot_cache import PlotCache
+
+    with FoilLock(data_folder, foil_name):
+        if 'iv' in steps:
+            load_iv_generator().process_iv_data(data_folder, part1_file, threshold, lock=False)
+        if 'report' in steps:
+            plot_cache = PlotCache(os.path.join(data_folder, 'plots', '.cache'))
+            if not QC2_report.process_foil(data_folder, foil_name, plot_cache=plot_cache, datasets=datasets,
+                                           part1_file=part1_file, lock=False):
+                return False, 'missing input files'
+    return True, 'ok'
+
+def worker_loop(queue_path, steps, threshold, lease, max_attempts):
+    """
+    Claim and run jobs until the queue is empty
+
+    Args:
+        queue_path (str): Path to the SQLite queue file
+        steps (list): Steps to run for each foil
+        threshold (float): Threshold (nA) for the IV plot generation
+        lease (float): Lease duration in seconds, renewed while a job runs
+        max_attempts (int): Maximum number of attempts per job
+    """
+    import QC2_report
+
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    conn = connect_queue(queue_path)
+    # Jobs are claimed in queue order, i.e. directory by directory: the monitor file
+    # and the Part 2 windows of a directory are prepared once and reused for its foils
+    directory, datasets = None, None
+    while True:
+        job = claim_job(conn, worker_id, lease, max_attempts)
+        if job is None:
+            break
+        job_id, data_folder, foil_name, part1_file = job
+        print(f'[{worker_id}] {os.path.basename(data_folder)}: {foil_name}')
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=renew_lease, args=(queue_path, job_id, worker_id, lease, stop), daemon=True)
+        heartbeat.start()
+        try:
+            if 'report' in steps and (data_folder != directory or part1_file not in datasets):
+                directory, datasets = None, None
+                datasets = QC2_report.prepare_directory(data_folder)
+                directory = data_folder
+            ok, message = run_foil_job(data_folder, foil_name, part1_file, steps, threshold, datasets)
+        except Exception as e:
+            ok, message = False, f'{type(e).__name__}: {e}'
+        finally:
+            stop.set()
+            heartbeat.join()
+        if not ok:
+            print(f'[{worker_id}] Failed {foil_name}: {message}')
+        finish_job(conn, job_id, worker_id, ok, message, max_attempts)
+    conn.close()
+
+def print_status(conn):
+    """
+    Print a summary of the queue state
+
+    Args:
+        conn (sqlite3.Connection): Queue connection
+    """
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    print('Queue status: ' + ', '.join(f'{status}={counts.get(status, 0)}'
+                                        for status in ('pending', 'running', 'done', 'failed')))
+    for data_folder, foil_name, message in conn.execute(
+            "SELECT data_folder, foil_name, message FROM jobs WHERE status='failed' ORDER BY id"):
+        print(f'  FAILED {data_folder}: {foil_name} ({message})')
+
+def main():
+    parser = argparse.ArgumentParser(description='Process all QC2 data directories of a campaign through a local work queue')
+    parser.add_argument('campaign_root', help='Root directory containing the per-day QC2 data directories')
+    parser.add_argument('--queue', help=f'Path to the queue file (default: <campaign_root>/{QUEUE_FILENAME})')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                      help='Number of worker processes on this host (default: number of CPUs)')
+    parser.add_argument('--steps', nargs='+', choices=['iv', 'report'], default=['iv', 'report'],
+                      help='Processing steps to run for each foil (default: iv report)')
+    parser.add_argument('--threshold', type=float, default=7,
+                      help='Threshold (nA) for current values in the IV plots (default: 7)')
+    parser.add_argument('--lease', type=float, default=300,
+                      help='Seconds without heartbeat after which a job held by a dead worker is retried (default: 300)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                      help='Number of attempts before a job is marked as failed (default: 3)')
+    parser.add_argument('--reset', choices=['failed', 'all'],
+                      help="Requeue failed jobs, or all jobs to reprocess the campaign")
+    parser.add_argument('--no-discover', action='store_true',
+                      help='Do not scan the campaign root, only work on jobs already in the queue')
+    parser.add_argument('--status', action='store_true', help='Only print the queue status')
+    parser.add_argument('--merged', nargs='?', const='', metavar='PDF',
+                      help='After processing, write all foils of the campaign into one PDF '
+                           '(default: <campaign_root>/pdf_reports/QC2MERGED_<name>_<date>.pdf)')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.campaign_root):
+        print(f'Error: Path {args.campaign_root} does not exist')
+        sys.exit(1)
+
+    queue_path = args.queue or os.path.join(args.campaign_root, QUEUE_FILENAME)
+    conn = connect_queue(queue_path)
+
+    if args.status:
+        print_status(conn)
+        return
+
+    if not args.no_discover:
+        n_folders, added = enqueue_campaign(conn, args.campaign_root)
+        print(f'Found {n_folders} QC2 data directories, {added} new foil jobs queued')
+
+    if args.reset:
+        print(f'Reset {reset_jobs(conn, args.reset)} jobs to pending')
+    conn.close()
+
+    # Make the sibling scripts importable from the worker processes
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.time()
+    workers = []
+    for _ in range(max(1, args.workers)):
+        process = multiprocessing.Process(target=worker_loop,
+                                          args=(queue_path, args.steps, args.threshold, args.lease, args.max_attempts))
+        process.start()
+        workers.append(process)
+    for process in workers:
+        process.join()
+    print(f'\nWorkers finished after {time.time() - start:.1f} s')
+
+    conn = connect_queue(queue_path)
+    print_status(conn)
+    conn.close()
+
+    if args.merged is not None:
+        from QC2_merged_report import write_merged_report
+        merged_path = args.merged
+        if not merged_path:
+            name = os.path.basename(os.path.normpath(args.campaign_root))
+            os.makedirs(os.path.join(args.campaign_root, 'pdf_reports'), exist_ok=True)
+            merged_path = os.path.join(args.campaign_root, 'pdf_reports',
+                                       f'QC2MERGED_{name}_{datetime.now().strftime("%Y%m%d_%H-%M")}.pdf')
+        n_tests = write_merged_report(merged_path, find_data_directories(args.campaign_root))
+        print(f'Created {merged_path} with {n_tests} foil tests')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+QC2 Dataset
+Shared data model for the QC2 scripts: file discovery and the FoilDataset class
+holding a foil's header and its data as compact, lazily loaded NumPy arrays
+"""
+import os
+from datetime import datetime
+import numpy as np
+from QC_parsers import load_file
+
+def find_part1_files(data_folder):
+    """
+    Find all QC2LONG_PART1 files in the data folder
+
+    Args:
+        data_folder (str): Path to the data folder
+
+    Returns:
+        list: List of part1 filenames
+    """
+    part1_files = []
+    for file in os.listdir(data_folder):
+        if file.startswith('QC2LONG_PART1_') and file.endswith('.txt'):
+            # Exclude IVplot files
+            if 'IVplot' not in file:
+                part1_files.append(file)
+    return part1_files
+
+def extract_foil_name(filename):
+    """
+    Extract foil name from QC2LONG_PART1 filename
+
+    Args:
+        filename (str): QC2LONG_PART1 filename
+
+    Returns:
+        str: Foil name
+    """
+    # Remove QC2LONG_PART1_ prefix and _date_time.txt suffix
+    parts = filename.split('_')
+    return '_'.join(parts[2:-2])
+
+def find_qc2_files(data_folder, foil_name):
+    """
+    Find QC2 related files for a given foil name in the specified folder
+
+    Args:
+        data_folder (str): Path to the data folder
+        foil_name (str): Name of the foil
+
+    Returns:
+        tuple: (part1_file, megger_file, all_channels_file), without .txt extension
+    """
+    part1_file = ''
+    megger_file = ''
+    all_channels_file = ''
+
+    # List all files in the data folder
+    files = os.listdir(data_folder)
+
+    # Find part1 file
+    for file in files:
+        if file.startswith(f'QC2LONG_PART1_{foil_name}_') and file.endswith('.txt'):
+            if 'IVplot' not in file:
+                part1_file = file[:-4]  # Remove .txt extension
+                break
+
+    # Find megger file
+    for file in files:
+        if file.startswith(f'QC2FAST_{foil_name}_') and file.endswith('.txt'):
+            megger_file = file[:-4]  # Remove .txt extension
+            break
+
+    # Find all channels file
+    for file in files:
+        if file.startswith('QC2_all_channels_monitor_') and file.endswith('.txt'):
+            all_channels_file = file[:-4]  # Remove .txt extension
+            break
+
+    return part1_file, megger_file, all_channels_file
+
+def find_all_foils(data_folder):
+    """
+    Find all unique foil names in the data folder from QC2LONG_PART1 files
+
+    Args:
+        data_folder (str): Path to the data folder
+
+    Returns:
+        list: List of unique foil names
+    """
+    foil_names = []
+    for file in find_part1_files(data_folder):
+        foil_name = extract_foil_name(file)
+        if foil_name not in foil_names:
+            foil_names.append(foil_name)
+    return foil_names
+
+def parse_file_timestamp(stamp):
+    """
+    Parse the YYYYMMDD_HH-MM time stamp used in the QC2 file names
+
+    Args:
+        stamp (str): Time stamp, e.g. 20241204_15-30
+
+    Returns:
+        datetime: Parsed time stamp, or None if it does not match the format
+    """
+    try:
+        return datetime.strptime(stamp, '%Y%m%d_%H-%M')
+    except ValueError:
+        return None
+
+class MonitorIndex:
+    """
+    All-channels monitor data with a sorted time index
+
+    The file is read once and shared by all foils of a directory. Voltages and
+    currents are stored channel-major so that a channel's slice is contiguous,
+    and time windows are looked up by binary search on the sorted time column.
+    If the file is not in time order, rows holds the file row of each sample.
+    """
+    __slots__ = ('path', 'time', 'voltage', 'current', 'rows')
+
+    N_CHANNELS = 8
+
+    def __init__(self, path, long_dtype=np.float32):
+        """
+        Args:
+            path (str): Path to the QC2_all_channels_monitor file
+            long_dtype: NumPy dtype of the voltage and current arrays
+        """
+        self.path = path
+        columns = load_file(path, 'qc2_monitor', np.float64)
+        time = columns[0]
+        voltage = np.array(columns[1:1+self.N_CHANNELS], dtype=long_dtype)
+        current = np.array(columns[1+self.N_CHANNELS:], dtype=long_dtype)
+        rows = None
+        if not np.all(time[1:] >= time[:-1]):
+            rows = np.argsort(time, kind='stable')
+            time, voltage, current = time[rows], voltage[:, rows], current[:, rows]
+        self.time = time
+        self.voltage = voltage
+        self.current = current
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.time)
+
+    def window(self, t_start=None, t_end=None):
+        """
+        Index range of the samples with t_start <= time <= t_end
+
+        Args:
+            t_start (float): Start of the window in seconds, None for the beginning of the file
+            t_end (float): End of the window in seconds, None for the end of the file
+
+        Returns:
+            slice: Slice selecting the window
+        """
+        lo = 0 if t_start is None else int(np.searchsorted(self.time, t_start, side='left'))
+        hi = len(self.time) if t_end is None else int(np.searchsorted(self.time, t_end, side='right'))
+        return slice(lo, max(lo, hi))
+
+    def file_rows(self, t_start=None, t_end=None):
+        """
+        Data rows of the monitor file holding the samples of a time window, in time order
+
+        Args:
+            t_start (float): Start of the window in seconds
+            t_end (float): End of the window in seconds
+
+        Returns:
+            slice or array: Slice of the data rows, or their indices if the file is not in time order
+        """
+        window = self.window(t_start, t_end)
+        return window if self.rows is None else self.rows[window]
+
+    def channel(self, CH_number, t_start=None, t_end=None):
+        """
+        Voltage, current and time of one channel within a time window (views, no copies)
+
+        Args:
+            CH_number (int): HV channel number
+            t_start (float): Start of the window in seconds
+            t_end (float): End of the window in seconds
+
+        Returns:
+            tuple: (voltage [V], current [uA], time [s])
+        """
+        window = self.window(t_start, t_end)
+        return self.voltage[CH_number, window], self.current[CH_number, window], self.time[window]
+
+class FoilDataset:
+    """
+    Header and data of a single foil's QC2 files
+
+    The arrays are only read from disk on first access. Part 1, IV and megger data
+    use dtype, the voltage and current of the long-term (Part 2) series use long_dtype
+    (e.g. float32) since that series can hold millions of samples. Time columns are
+    always float64.
+
+    The Part 2 series is taken from a MonitorIndex, which can be shared between
+    the foils of a directory, and restricted to part2_window = (t_start, t_end)
+    in seconds since the start of the monitor file. Windows derived from the time
+    stamps (see assign_part2_windows) are only completed when the Part 2 series
+    is first read, since they depend on the foil's Part 1 data.
+
+    Array attributes are tuples of 1-D arrays:
+        part1:  (voltage [V], current [uA], time [s])
+        iv:     (voltage [V], current [nA], error [nA])
+        part2:  (voltage [V], current [uA], time [s]) for the foil's channel and window
+        megger: (time [min], impedance [GOhm], sparks)
+        notes:  array of note lines
+    """
+    __slots__ = ('data_folder', 'part1_file', 'megger_file', 'all_channels_file', 'dtype', 'long_dtype',
+                 'monitor', 'part2_window', 'part2_span',
+                 '_header', '_part1', '_iv', '_part2', '_megger', '_megger_header', '_notes')
+
+    HEADER_LINES = 5
+
+    def __init__(self, data_folder, part1_file, megger_file='', all_channels_file='',
+                 dtype=np.float64, long_dtype=np.float32, monitor=None, part2_window=None):
+        """
+        Args:
+            data_folder (str): Path to the data folder
+            part1_file (str): QC2LONG_PART1 file name without .txt extension
+            megger_file (str): QC2FAST file name without .txt extension
+            all_channels_file (str): QC2_all_channels_monitor file name without .txt extension
+            dtype: NumPy dtype of the Part 1, IV and megger arrays
+            long_dtype: NumPy dtype of the Part 2 voltage and current arrays
+            monitor (MonitorIndex): Shared monitor data, read from all_channels_file if None
+            part2_window (tuple): (t_start, t_end) in seconds, None for the whole monitor file
+        """
+        self.data_folder = data_folder
+        self.part1_file = part1_file
+        self.megger_file = megger_file
+        self.all_channels_file = all_channels_file
+        self.dtype = dtype
+        self.long_dtype = long_dtype
+        self.monitor = monitor
+        self.part2_window = part2_window
+        self.part2_span = None
+        self._header = None
+        self._part1 = None
+        self._iv = None
+        self._part2 = None
+        self._megger = None
+        self._megger_header = None
+        self._notes = None
+
+    @classmethod
+    def from_foil_name(cls, data_folder, foil_name, **kwargs):
+        """
+        Create the dataset of a foil by looking up its files in the data folder
+
+        Args:
+            data_folder (str): Path to the data folder
+            foil_name (str): Name of the foil
+            **kwargs: Passed on to FoilDataset (dtype, long_dtype, monitor, part2_window)
+
+        Returns:
+            FoilDataset: Dataset, or None if any of the required files is missing
+        """
+        part1_file, megger_file, all_channels_file = find_qc2_files(data_folder, foil_name)
+        if not part1_file or not megger_file or not all_channels_file:
+            return None
+        return cls(data_folder, part1_file, megger_file, all_channels_file, **kwargs)
+
+    @classmethod
+    def from_part1_file(cls, data_folder, part1_file, **kwargs):
+        """
+        Create the dataset of one PART1 file, e.g. a retest of a foil with several PART1 files
+
+        Args:
+            data_folder (str): Path to the data folder
+            part1_file (str): QC2LONG_PART1 file name, with or without .txt extension
+            **kwargs: Passed on to FoilDataset (dtype, long_dtype, monitor, part2_window)
+
+        Returns:
+            FoilDataset: Dataset, or None if the megger or monitor file is missing
+        """
+        part1_file = part1_file[:-4] if part1_file.endswith('.txt') else part1_file
+        _, megger_file, all_channels_file = find_qc2_files(data_folder, extract_foil_name(part1_file + '.txt'))
+        if not megger_file or not all_channels_file:
+            return None
+        return cls(data_folder, part1_file, megger_file, all_channels_file, **kwargs)
+
+    def _path(self, filename):
+        return os.path.join(self.data_folder, filename + '.txt')
+
+    @property
+    def foil_name(self):
+        return extract_foil_name(self.part1_file + '.txt')
+
+    @property
+    def notes_file(self):
+        return 'QC2NOTES_' + self.part1_file[14:len(self.part1_file)-15]
+
+    @property
+    def header(self):
+        """Description lines of the PART1 file as [key, value] rows"""
+        if self._header is None:
+            header = []
+            with open(self._path(self.part1_file)) as f:
+                for _ in range(self.HEADER_LINES):
+                    header.append(f.readline().rstrip('\r\n').split('\t'))
+            self._header = header
+        return self._header
+
+    @property
+    def part1_timestamp(self):
+        return parse_file_timestamp(self.part1_file[-14:])
+
+    @property
+    def monitor_timestamp(self):
+        return parse_file_timestamp(self.all_channels_file[25:39])
+
+    @property
+    def channel(self):
+        return int(self.header[0][1][2])  # The channel number is only one digit
+
+    @property
+    def part1(self):
+        if self._part1 is None:
+            self._part1 = load_file(self._path(self.part1_file), 'qc2_part1', self.dtype)
+        return self._part1
+
+    @property
+    def iv(self):
+        if self._iv is None:
+            self._iv = load_file(self._path(self.part1_file + '_IVplot'), 'qc2_iv', self.dtype)
+        return self._iv
+
+    def _load_monitor(self):
+        if self.monitor is None:
+            self.monitor = MonitorIndex(self._path(self.all_channels_file), self.long_dtype)
+        if self.part2_window is None and self.part2_span is not None:
+            self.part2_window = self._derived_part2_window()
+            self.part2_span = None
+
+    def _derived_part2_window(self):
+        # Part 2 starts when Part 1 ends: the Part 1 start plus the duration of its data
+        part1_start, t_end = self.part2_span
+        part1_time = self.part1[2]
+        t_start = part1_start + (float(part1_time.max()) if len(part1_time) else 0.0)
+        window = self.monitor.window(t_start, t_end)
+        if window.stop == window.start:
+            print(f'Warning: no monitor data in the Part 2 window of foil {self.foil_name}, '
+                  'using the whole monitor file')
+            return None
+        return (t_start, t_end)
+
+    @property
+    def part2(self):
+        if self._part2 is None:
+            self._load_monitor()
+            t_start, t_end = self.part2_window or (None, None)
+            self._part2 = self.monitor.channel(self.channel, t_start, t_end)
+        return self._part2
+
+    @property
+    def part2_rows(self):
+        """Data rows of the monitor file holding the Part 2 series (see MonitorIndex.file_rows)"""
+        self._load_monitor()
+        return self.monitor.file_rows(*(self.part2_window or (None, None)))
+
+    @property
+    def megger_header(self):
+        if self._megger_header is None:
+            with open(self._path(self.megger_file)) as f:
+                self._megger_header = f.readline().rstrip('\r\n').split('\t')
+        return self._megger_header
+
+    @property
+    def megger(self):
+        if self._megger is None:
+            self._megger = load_file(self._path(self.megger_file), 'qc2_megger', self.dtype)
+        return self._megger
+
+    @property
+    def notes(self):
+        if self._notes is None:
+            with open(self._path(self.notes_file)) as f:
+                lines = f.read().splitlines()[1:]  # Skip the header line
+            self._notes = np.array([line.split('\t')[0] for line in lines], dtype=str)
+        return self._notes
+
+    def megger_rows(self):
+        """
+        Megger table as strings, in the format written by QC2_megger_generator.py
+
+        Returns:
+            list: Header row followed by [time, impedance, sparks] rows
+        """
+        rows = [self.megger_header]
+        for time, impedance, sparks in zip(*self.megger):
+            # Spark counts are integers, parsed as float
+            rows.append([f'{time:g}', str(float(impedance)), str(round(float(sparks)))])
+        return rows
+
+    def load(self):
+        """
+        Read all files of the foil now instead of on first access
+
+        Returns:
+            FoilDataset: self
+        """
+        for name in ('header', 'part1', 'iv', 'part2', 'megger', 'megger_header', 'notes'):
+            getattr(self, name)
+        return self
+
+def assign_part2_windows(datasets):
+    """
+    Derive each foil's Part 2 time window from the PART1 time stamps
+
+    A foil's Part 2 starts when its Part 1 ends (PART1 time stamp plus the duration
+    of the Part 1 data) and lasts until the next foil's Part 1 starts on the same
+    channel, or until the end of the monitor file. Only the PART1 file names and
+    headers are read here: each foil's span between the sorted start times is
+    stored as part2_span, and the window is completed from the foil's own Part 1
+    data when its Part 2 series is first read. A window without any monitor
+    samples is dropped then (the foil gets the whole monitor file). Foils with an
+    explicit part2_window or with time stamps that cannot be parsed are left untouched.
+
+    Args:
+        datasets (list): FoilDataset objects of one data directory
+    """
+    by_channel = {}
+    for dataset in datasets:
+        if dataset.part2_window is not None:
+            continue
+        part1_start, monitor_start = dataset.part1_timestamp, dataset.monitor_timestamp
+        if part1_start is None or monitor_start is None:
+            continue
+        offset = (part1_start - monitor_start).total_seconds()
+        by_channel.setdefault(dataset.channel, []).append((offset, dataset))
+
+    for foils in by_channel.values():
+        foils.sort(key=lambda item: item[0])
+        for k, (offset, dataset) in enumerate(foils):
+            t_end = foils[k+1][0] if k+1 < len(foils) else None
+            dataset.part2_span = (offset, t_end)
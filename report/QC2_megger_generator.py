@@ -7,43 +7,10 @@ Creates megger files for each QC2LONG_PART1 file in the data directory
 
 import os
 import csv
-import fnmatch
 import argparse
 from datetime import datetime
-
-def find_part1_files(data_folder):
-    """
-    Find all QC2LONG_PART1 files in the data folder
-    
-    Args:
-        data_folder (str): Path to the data folder
-    
-    Returns:
-        list: List of part1 filenames
-    """
-    part1_files = []
-    for file in os.listdir(data_folder):
-        if fnmatch.fnmatch(file, 'QC2LONG_PART1_*.txt'):
-            # Exclude IVplot files
-            if 'IVplot' not in file:
-                part1_files.append(file)
-    return part1_files
-
-def extract_foil_name(filename):
-    """
-    Extract foil name from QC2LONG_PART1 filename
-    
-    Args:
-        filename (str): QC2LONG_PART1 filename
-        
-    Returns:
-        str: Foil name
-    """
-    # Remove QC2LONG_PART1_ prefix and _date_time.txt suffix
-    parts = filename.split('_')
-    # Join the parts that make up the foil name (excluding prefix and date/time)
-    foil_name = '_'.join(parts[2:-2])
-    return foil_name
+from QC_io import FoilLock, atomic_open
+from QC2_dataset import extract_foil_name, find_part1_files
 
 def get_valid_float_input(prompt):
     """
@@ -129,7 +96,7 @@ def create_megger_file(data_folder, foil_name, megger_date, data):
         rows.append([str(row[0]), str(row[1]), str(int(row[2]))])  # Convert sparks to integer
     
     # Write using csv writer to ensure consistent formatting
-    with open(megger_filepath, 'w', newline='') as f:
+    with FoilLock(data_folder, foil_name), atomic_open(megger_filepath, 'w', newline='') as f:
         writer = csv.writer(f, delimiter='\t')
         writer.writerows(rows)
     
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC2 Merged Report
+Writes the QC2 results of all foils of one or more data directories (e.g. a whole
+campaign) into a single PDF with a table of contents and a summary page
+
+Every PART1 file is one entry, so foils retested during a campaign appear once
+per test. A foil page holds the sections of the single-foil report
+(QC2_report.report_sections and report_plots) in the same order.
+
+The document is streamed: every page is a matplotlib figure drawn with vector
+plots, written to the PDF with PdfPages and released before the next foil is
+read. Long series are min/max decimated, and the foils of one directory share
+one monitor index that is dropped when the next directory starts, so memory use
+does not grow with the number of foils.
+"""
+
+import os
+import math
+import argparse
+from datetime import datetime
+from matplotlib.backends.backend_pdf import PdfPages
+from QC_io import atomic_path
+from QC_plotting import new_figure
+from QC2_dataset import extract_foil_name, find_part1_files, find_qc2_files
+from QC2_report import REPORT_PLOT_LAYOUT, prepare_directory, analyse_foil, report_plots, report_sections
+
+PAGE_SIZE = (20, 28)    # Inches; the plots keep the sizes and fonts of the single-foil reports
+TOC_ROWS = 45           # Table of contents lines per page
+SUMMARY_ROWS = 40       # Summary table rows per page
+MAX_TABLE_ROWS = 10     # Data rows of a table on a foil page (e.g. HV steps)
+MAX_PLOT_POINTS = 4000  # Points per plotted series after decimation
+
+# Foil page layout, in figure coordinates
+LINE_HEIGHT = 0.012             # Header and notes lines
+SECTION_HEIGHT = 0.02           # Section title
+TABLE_ROW_SCALE = 1.8           # Table row height relative to the default (10 pt font)
+TABLE_ROW_HEIGHT = 1.2*10/72*TABLE_ROW_SCALE/PAGE_SIZE[1]
+PLOT_HEIGHT = 0.15
+PLOT_LABEL_HEIGHT = 0.03        # Below the plots, for the axis labels
+# Scale of QC2_report.REPORT_PLOT_LAYOUT, whose plots span 0.815 of the width
+PLOT_LEFT, PLOT_WIDTH = 0.03, 1.16
+PLOT_PADDING = 0.05             # Left and right of the axes of a plot, for the tick and axis labels
+
+SUMMARY_COLUMNS = ['Foil', 'Test', 'Directory', 'CH', 'Min. impedance (GOhm)', 'I-V points',
+                   'Max. I-V current (nA)', 'Part 2 max. Imon (nA)', 'Sparks', 'HV trips', 'Page']
+
+def campaign_entries(data_folders):
+    """
+    Tests with a complete file set in the given directories, in document order
+
+    Every PART1 file is one test, so a retested foil has one entry per test.
+
+    Args:
+        data_folders (list): Paths to the data folders
+
+    Returns:
+        list: (data_folder, part1_file) pairs, part1_file with .txt extension
+    """
+    entries = []
+    for data_folder in data_folders:
+        for part1_file in sorted(find_part1_files(data_folder)):
+            _, megger_file, all_channels_file = find_qc2_files(data_folder, extract_foil_name(part1_file))
+            if megger_file and all_channels_file:
+                entries.append((data_folder, part1_file))
+    return entries
+
+def entry_label(part1_file):
+    """
+    Foil name and test time stamp of a PART1 file, e.g. 'ME0-G12-KR-B08-0000 20241204_10-00'
+    """
+    part1_file = part1_file[:-4] if part1_file.endswith('.txt') else part1_file
+    return f'{extract_foil_name(part1_file + ".txt")} {part1_file[-14:]}'
+
+def new_page():
+    """
+    Create an empty page figure
+
+    Returns:
+        Figure: Figure of PAGE_SIZE on an Agg canvas
+    """
+    fig, _ = new_figure(*PAGE_SIZE, subplot=False)
+    return fig
+
+def add_table(fig, rect, rows, fontsize=16, row_scale=2.0, auto_width=False):
+    """
+    Draw a table on a page
+
+    Args:
+        fig (Figure): Page
+        rect (list): [left, bottom, width, height] of the table in figure coordinates
+        rows (list): Header row followed by the data rows, as strings
+        fontsize (float): Font size
+        row_scale (float): Row height relative to the font size
+        auto_width (bool): Fit the column widths to their contents instead of the width of rect
+    """
+    ax = fig.add_axes(rect)
+    ax.axis('off')
+    if len(rows) < 2:
+        ax.text(0, 1, 'No data', fontsize=fontsize, va='top')
+        return
+    table = ax.table(cellText=rows[1:], colLabels=rows[0], loc='upper center', cellLoc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(fontsize)
+    if auto_width:
+        table.auto_set_column_width(range(len(rows[0])))
+    table.scale(1, row_scale)
+
+def add_footer(fig, page, title):
+    fig.text(0.05, 0.01, title, fontsize=14, color='gray')
+    fig.text(0.95, 0.01, str(page), fontsize=14, ha='right')
+
+def toc_pages(entries, first_foil_page, summary_page, title):
+    """
+    Table of contents pages
+
+    Args:
+        entries (list): (data_folder, part1_file) pairs
+        first_foil_page (int): Page number of the first foil
+        summary_page (int): Page number of the summary
+        title (str): Document title
+
+    Yields:
+        Figure: One figure per page
+    """
+    lines = [(f'{entry_label(part1_file)}   ({os.path.basename(data_folder)})', first_foil_page + k)
+             for k, (data_folder, part1_file) in enumerate(entries)]
+    lines.append(('Summary', summary_page))
+    n_pages = math.ceil(len(lines) / TOC_ROWS)
+    for page in range(n_pages):
+        fig = new_page()
+        fig.text(0.05, 0.96, title, fontsize=40, weight='bold')
+        fig.text(0.05, 0.935, f'Created {datetime.now().strftime("%Y-%m-%d %H:%M")}, {len(entries)} tests',
+                 fontsize=20)
+        fig.text(0.05, 0.9, 'Contents', fontsize=30, weight='bold')
+        for k, (label, number) in enumerate(lines[page*TOC_ROWS:(page+1)*TOC_ROWS]):
+            y = 0.87 - k*0.018
+            fig.text(0.07, y, label, fontsize=20)
+            fig.text(0.93, y, str(number), fontsize=20, ha='right')
+        add_footer(fig, page + 1, title)
+        yield fig
+
+def foil_page(foil, analysis, page, title):
+    """
+    Page with the QC2 results of one foil test, laid out top to bottom in the
+    section order of the single-foil report
+
+    Args:
+        foil (FoilDataset): Loaded foil data
+        analysis (dict): Result of QC2_report.analyse_foil
+        page (int): Page number
+        title (str): Document title
+
+    Returns:
+        Figure: The page
+    """
+    fig = new_page()
+    fig.text(0.05, 0.965, f'GE21 QC2 Report: {entry_label(foil.part1_file)}', fontsize=36, weight='bold')
+    y = 0.94
+    for row in foil.header:
+        fig.text(0.05, y, ' '.join(row), fontsize=18, weight='bold')
+        y -= LINE_HEIGHT
+
+    plots = report_plots(foil, MAX_PLOT_POINTS)
+    for section_title, kind, content in report_sections(foil, analysis):
+        y -= SECTION_HEIGHT
+        fig.text(0.05, y, section_title, fontsize=24, weight='bold')
+        y -= LINE_HEIGHT
+        if kind == 'table':
+            rows = content
+            if len(rows) > MAX_TABLE_ROWS + 1:
+                rows = rows[:MAX_TABLE_ROWS + 1] + [['...'] * len(rows[0])]
+            height = len(rows) * TABLE_ROW_HEIGHT
+            add_table(fig, [0.05, y - height, 0.9, height], rows, fontsize=13, row_scale=TABLE_ROW_SCALE)
+            y -= height
+        elif kind == 'plots':
+            # The hep label is drawn above the axes
+            y -= LINE_HEIGHT
+            for name in content:
+                offset, width = REPORT_PLOT_LAYOUT[name]
+                draw, args, _, _ = plots[name]
+                draw(fig.add_axes([PLOT_LEFT + offset*PLOT_WIDTH + PLOT_PADDING, y - PLOT_HEIGHT,
+                                   width*PLOT_WIDTH - 2*PLOT_PADDING, PLOT_HEIGHT]), *args)
+            y -= PLOT_HEIGHT + PLOT_LABEL_HEIGHT
+        else:
+            n_lines = max(0, int((y - 0.03) / LINE_HEIGHT))
+            lines = content
+            if len(lines) > n_lines:
+                lines = lines[:n_lines - 1] + ['...'] if n_lines else []
+            for note in lines:
+                fig.text(0.05, y, note, fontsize=16)
+                y -= LINE_HEIGHT
+    add_footer(fig, page, title)
+    return fig
+
+def error_page(data_folder, part1_file, error, page, title):
+    fig = new_page()
+    fig.text(0.05, 0.965, f'GE21 QC2 Report: {entry_label(part1_file)}', fontsize=36, weight='bold')
+    fig.text(0.05, 0.93, f'Could not be processed ({data_folder}):', fontsize=20)
+    fig.text(0.05, 0.91, str(error), fontsize=20, color='red')
+    add_footer(fig, page, title)
+    return fig
+
+def summary_row(data_folder, foil, analysis, page):
+    """
+    Summary table row of a foil (only strings, so the foil data can be released)
+    """
+    impedance = foil.megger[1]
+    IV_current = foil.iv[1]
+    current_part2 = foil.part2[1]
+    discharges = analysis['discharges'].values()
+    return [foil.foil_name, foil.part1_file[-14:], os.path.basename(data_folder), str(foil.channel),
+            f'{impedance.min():g}' if len(impedance) else '-',
+            str(len(IV_current)),
+            f'{IV_current.max():.2f}' if len(IV_current) else '-',
+            f'{current_part2.max()*1000:.2f}' if len(current_part2) else '-',
+            str(sum(result['n_sparks'] for result in discharges)),
+            str(sum(result['n_trips'] for result in discharges)),
+            str(page)]
+
+def summary_pages(rows, first_page, title):
+    """
+    Summary table pages
+
+    Yields:
+        Figure: One figure per page
+    """
+    n_pages = max(1, math.ceil(len(rows) / SUMMARY_ROWS))
+    for page in range(n_pages):
+        fig = new_page()
+        fig.text(0.05, 0.96, 'Summary', fontsize=36, weight='bold')
+        chunk = rows[page*SUMMARY_ROWS:(page+1)*SUMMARY_ROWS]
+        add_table(fig, [0.03, 0.05, 0.94, 0.88], [SUMMARY_COLUMNS] + chunk, fontsize=13, auto_width=True)
+        add_footer(fig, first_page + page, title)
+        yield fig
+
+def write_merged_report(output_path, data_folders, part2_window=None, title=None):
+    """
+    Write the merged PDF of all foils in the given data folders
+
+    Args:
+        output_path (str): Path of the PDF to write
+        data_folders (list): Paths to the data folders, in document order
+        part2_window (tuple): Explicit Part 2 (t_start, t_end) in seconds, derived per foil if None
+        title (str): Document title (default: derived from the output file name)
+
+    Returns:
+        int: Number of tests in the document
+    """
+    title = title or os.path.splitext(os.path.basename(output_path))[0]
+    entries = campaign_entries(data_folders)
+    n_toc_pages = math.ceil((len(entries) + 1) / TOC_ROWS)
+    first_foil_page = n_toc_pages + 1
+    summary_page = first_foil_page + len(entries)
+
+    rows = []
+    with atomic_path(output_path) as tmp_path:
+        with PdfPages(tmp_path, metadata={'Title': title}) as pdf:
+            for fig in toc_pages(entries, first_foil_page, summary_page, title):
+                pdf.savefig(fig)
+
+            page = first_foil_page
+            for data_folder in data_folders:
+                part1_files = [part1_file for folder, part1_file in entries if folder == data_folder]
+                if not part1_files:
+                    continue
+                try:
+                    datasets = prepare_directory(data_folder, part2_window)
+                except Exception as e:
+                    datasets = {}
+                    print(f'Error reading {data_folder}: {e}')
+                for part1_file in part1_files:
+                    try:
+                        foil = datasets.pop(part1_file)
+                        foil.load()
+                        analysis = analyse_foil(foil)
+                        pdf.savefig(foil_page(foil, analysis, page, title))
+                        rows.append(summary_row(data_folder, foil, analysis, page))
+                        print(f'Added {entry_label(part1_file)} (page {page})')
+                    except Exception as e:
+                        print(f'Error processing {part1_file}: {e}')
+                        pdf.savefig(error_page(data_folder, part1_file, e, page, title))
+                        rows.append([extract_foil_name(part1_file), part1_file[-18:-4], os.path.basename(data_folder)]
+                                    + ['-'] * 7 + [str(page)])
+                    page += 1
+                del datasets
+
+            for fig in summary_pages(rows, summary_page, title):
+                pdf.savefig(fig)
+    return len(entries)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the QC2 results of several foils into one PDF')
+    parser.add_argument('data_folders', nargs='*', help='Paths to the data folders')
+    parser.add_argument('--campaign', help='Include all QC2 data directories below this campaign root')
+    parser.add_argument('-o', '--output',
+                      help='Output PDF (default: pdf_reports/QC2MERGED_<name>_<date>.pdf in the first '
+                           'data folder or the campaign root)')
+    parser.add_argument('--part2-window', type=float, nargs=2, metavar=('START', 'END'),
+                      help='Part 2 window in hours since the start of the monitor file, used for all foils')
+
+    args = parser.parse_args()
+
+    data_folders = [os.path.abspath(folder) for folder in args.data_folders]
+    if args.campaign:
+        from QC2_campaign import find_data_directories
+        data_folders += [folder for folder in find_data_directories(args.campaign) if folder not in data_folders]
+    if not data_folders:
+        parser.error('give at least one data folder or --campaign')
+
+    output_path = args.output
+    if output_path is None:
+        base = args.campaign or data_folders[0]
+        name = os.path.basename(os.path.normpath(base))
+        os.makedirs(os.path.join(base, 'pdf_reports'), exist_ok=True)
+        output_path = os.path.join(base, 'pdf_reports',
+                                   f'QC2MERGED_{name}_{datetime.now().strftime("%Y%m%d_%H-%M")}.pdf')
+
+    part2_window = None
+    if args.part2_window:
+        part2_window = (args.part2_window[0]*3600.0, args.part2_window[1]*3600.0)
+
+    n_tests = write_merged_report(output_path, data_folders, part2_window)
+    print(f'Created {output_path} with {n_tests} foil tests')
+
+if __name__ == '__main__':
+    main()
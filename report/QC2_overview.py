@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC2 Overview
+Whole-stand view of a QC2 data directory: Vmon and Imon of all HV channels of the
+all-channels monitor file in one multi-panel figure, with summary statistics
+per channel
+
+The monitor file is read once (or the index already loaded by QC2_report.py is
+reused), every series is min/max decimated before plotting, and the statistics
+are whole-array reductions, so the overview renders in about a second even for
+long tests. Outputs: plots/QC2OVERVIEW_<monitor time stamp>.png and
+QC2OVERVIEW_<monitor time stamp>.txt in the data folder.
+"""
+
+import os
+import argparse
+import numpy as np
+from QC_io import atomic_path
+from QC_plotting import decimate_indices, new_figure
+from QC2_analysis import LEAKAGE_THRESHOLD, STEP_MIN_VOLTAGE, analyse_discharges
+from QC2_dataset import FoilDataset, MonitorIndex, find_all_foils, find_qc2_files
+from QC2_writers import write_sections
+
+FIGURE_SIZE = (20, 24)  # Inches: 4 x 2 channel panels above the statistics table
+MAX_PLOT_POINTS = 2000  # Points per plotted series after decimation
+PLOT_DPI = 60
+
+OVERVIEW_COLUMNS = ['CH', 'Foils', 'Samples', 'HV on (h)', 'Max. Vmon (V)', 'Mean Imon (nA)',
+                    'Max. Imon (nA)', f'Above {LEAKAGE_THRESHOLD*1000:g} nA (h)', 'Sparks', 'HV trips']
+
+def find_monitor_file(data_folder):
+    """
+    Name of the all-channels monitor file of a data folder
+
+    Args:
+        data_folder (str): Path to the data folder
+
+    Returns:
+        str: File name without .txt extension (the first one if there are several), None if missing
+    """
+    monitor_files = sorted(file for file in os.listdir(data_folder)
+                           if file.startswith('QC2_all_channels_monitor_') and file.endswith('.txt'))
+    return monitor_files[0][:-4] if monitor_files else None
+
+def channel_foils(data_folder):
+    """
+    Foils tested on each HV channel, from the PART1 headers
+
+    Args:
+        data_folder (str): Path to the data folder
+
+    Returns:
+        dict: Channel number -> list of foil names
+    """
+    foils = {}
+    for foil_name in find_all_foils(data_folder):
+        part1_file = find_qc2_files(data_folder, foil_name)[0]
+        try:
+            channel = FoilDataset(data_folder, part1_file).channel
+        except (OSError, IndexError, ValueError):
+            continue
+        foils.setdefault(channel, []).append(foil_name)
+    return foils
+
+def channel_statistics(monitor, channel):
+    """
+    Summary statistics of one channel over the whole monitor file
+
+    Imon statistics and the time above LEAKAGE_THRESHOLD only count samples with
+    the HV on (Vmon above STEP_MIN_VOLTAGE).
+
+    Args:
+        monitor (MonitorIndex): Monitor data
+        channel (int): HV channel number
+
+    Returns:
+        dict: n_samples, hv_on [s], max_voltage [V], mean_current and max_current [uA]
+              (NaN without HV), time_above [s], n_sparks, n_trips
+    """
+    voltage, current, time = monitor.channel(channel)
+    durations = np.diff(time, append=time[-1]) if len(time) else time
+    on = voltage > STEP_MIN_VOLTAGE
+    discharges = analyse_discharges(time, voltage, current)
+    return {
+        'n_samples': len(time),
+        'hv_on': float(durations[on].sum()),
+        'max_voltage': float(voltage.max()) if len(voltage) else np.nan,
+        'mean_current': float(current[on].mean(dtype=np.float64)) if on.any() else np.nan,
+        'max_current': float(current[on].max()) if on.any() else np.nan,
+        'time_above': float(durations[on & (current > LEAKAGE_THRESHOLD)].sum()),
+        'n_sparks': discharges['n_sparks'],
+        'n_trips': discharges['n_trips'],
+    }
+
+def overview_rows(statistics, foils):
+    """
+    Rows of the per-channel statistics table (OVERVIEW_COLUMNS)
+
+    Args:
+        statistics (list): channel_statistics of each channel
+        foils (dict): Channel number -> list of foil names
+
+    Returns:
+        list: Rows of strings
+    """
+    rows = []
+    for channel, stats in enumerate(statistics):
+        rows.append([f'CH{channel}', ', '.join(foils.get(channel, [])) or '-', str(stats['n_samples']),
+                     f"{stats['hv_on']/3600:.2f}", f"{stats['max_voltage']:.1f}",
+                     f"{stats['mean_current']*1000:.2f}", f"{stats['max_current']*1000:.2f}",
+                     f"{stats['time_above']/3600:.2f}", str(stats['n_sparks']), str(stats['n_trips'])])
+    return rows
+
+def draw_channel(axc, monitor, channel, title):
+    """
+    Draw the decimated Imon and Vmon of one channel against time on an axes and its twin
+
+    Args:
+        axc (Axes): Axes of the current, the voltage gets a twin axes
+        monitor (MonitorIndex): Monitor data
+        channel (int): HV channel number
+        title (str): Panel title
+    """
+    voltage, current, time = monitor.channel(channel)
+    time_hr = (time - monitor.time[0]) / 3600 if len(time) else time
+    current_idx = decimate_indices(current, MAX_PLOT_POINTS)
+    voltage_idx = decimate_indices(voltage, MAX_PLOT_POINTS)
+    axc.set_title(title, fontsize=18, loc='left')
+    axc.plot(time_hr[current_idx], current[current_idx]*1000, '-', color='blue', linewidth=0.8)
+    axc.set_ylabel('Current [nA]', fontsize=16, color='blue')
+    axc.set_xlabel('Time [h]', fontsize=16)
+    axc.tick_params(axis='both', direction='in', labelsize=14)
+    axc.tick_params(axis='y', colors='blue')
+    axv = axc.twinx()
+    axv.plot(time_hr[voltage_idx], voltage[voltage_idx], '-', color='r', linewidth=0.8)
+    axv.set_ylabel('Voltage [V]', fontsize=16, color='red')
+    axv.tick_params(axis='y', direction='in', labelsize=14, colors='red')
+
+def write_overview(data_folder, monitor=None, foils=None, output_folder=None):
+    """
+    Render the overview figure and write the statistics of all channels
+
+    Args:
+        data_folder (str): Path to the data folder the inputs are read from
+        monitor (MonitorIndex): Monitor data already loaded, read from data_folder if None
+        foils (dict): Channel number -> list of foil names, read from the PART1 headers if None
+        output_folder (str): Folder the outputs are written to (default: data_folder)
+
+    Returns:
+        tuple: (path to the PNG figure, path to the statistics file, table rows)
+
+    Raises:
+        FileNotFoundError: If the data folder has no all-channels monitor file
+    """
+    output_folder = output_folder or data_folder
+    if monitor is None:
+        monitor_file = find_monitor_file(data_folder)
+        if monitor_file is None:
+            raise FileNotFoundError(f'No QC2_all_channels_monitor file in {data_folder}')
+        monitor = MonitorIndex(os.path.join(data_folder, monitor_file + '.txt'))
+    if foils is None:
+        foils = channel_foils(data_folder)
+    time_stamp = os.path.basename(monitor.path)[25:-4]
+
+    statistics = [channel_statistics(monitor, channel) for channel in range(MonitorIndex.N_CHANNELS)]
+    rows = overview_rows(statistics, foils)
+
+    fig, _ = new_figure(*FIGURE_SIZE, subplot=False)
+    fig.suptitle(f'QC2 overview {time_stamp}: {os.path.basename(os.path.normpath(output_folder))}',
+                 fontsize=24, x=0.05, ha='left')
+    grid = fig.add_gridspec(5, 2, height_ratios=[1, 1, 1, 1, 0.9], left=0.06, right=0.94,
+                            top=0.95, bottom=0.02, hspace=0.45, wspace=0.3)
+    for channel in range(MonitorIndex.N_CHANNELS):
+        names = ', '.join(foils.get(channel, []))
+        draw_channel(fig.add_subplot(grid[channel // 2, channel % 2]), monitor, channel,
+                     f'CH{channel}' + (f': {names}' if names else ''))
+    ax = fig.add_subplot(grid[4, :])
+    ax.axis('off')
+    table = ax.table(cellText=rows, colLabels=OVERVIEW_COLUMNS, loc='upper center', cellLoc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(14)
+    table.auto_set_column_width(range(len(OVERVIEW_COLUMNS)))
+    table.scale(1, 1.8)
+
+    os.makedirs(os.path.join(output_folder, 'plots'), exist_ok=True)
+    png_path = os.path.join(output_folder, 'plots', f'QC2OVERVIEW_{time_stamp}.png')
+    with atomic_path(png_path) as tmp_path:
+        fig.savefig(tmp_path, dpi=PLOT_DPI)
+    txt_path = os.path.join(output_folder, f'QC2OVERVIEW_{time_stamp}.txt')
+    write_sections(txt_path, [f'Monitor file:\t{os.path.basename(monitor.path)}'],
+                   [('Channel statistics', OVERVIEW_COLUMNS, rows)])
+    return png_path, txt_path, rows
+
+def print_table(rows):
+    """
+    Print the statistics table with aligned columns
+    """
+    table = [OVERVIEW_COLUMNS] + rows
+    widths = [max(len(row[k]) for row in table) for k in range(len(OVERVIEW_COLUMNS))]
+    for row in table:
+        print('  '.join(value.ljust(width) if k < 2 else value.rjust(width)
+                        for k, (value, width) in enumerate(zip(row, widths))))
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the all-channels overview of a QC2 data folder')
+    parser.add_argument('data_folder', help='Path to the data folder')
+
+    args = parser.parse_args()
+    try:
+        png_path, txt_path, rows = write_overview(args.data_folder)
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}')
+        return
+    print_table(rows)
+    print(f'Created {png_path}')
+    print(f'Created {txt_path}')
+
+if __name__ == '__main__':
+    main()
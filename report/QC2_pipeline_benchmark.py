@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC2 Pipeline Benchmark
+Times QC2_report.py on a synthetic data directory, serial against pipelined
+
+A directory with the input files of n foils (PART1, IVplot, QC2FAST, QC2NOTES)
+and one all-channels monitor file is written, then all reports are created
+with the serial loop (--serial) and with the read/render/write pipeline, and
+the best wall time of each mode is printed. The plot cache is disabled, so
+every run renders all plots. With --keep the directory is kept for other tests.
+"""
+
+import io
+import os
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import numpy as np
+from QC2_writers import write_iv_points
+from QC2_dataset import find_all_foils
+from QC2_report import prepare_foils, process_foil_dataset, process_foils_pipelined
+
+MONITOR_START = datetime(2024, 12, 4, 9, 30)
+# Seconds between two monitor samples
+MONITOR_STEP = 10.0
+# Voltage steps and samples per step of the synthetic Part 1
+PART1_STEPS = 12
+PART1_STEP_ROWS = 80
+
+def write_synthetic_directory(folder, n_foils, monitor_rows, rng):
+    """
+    Write the QC2 input files of n_foils foils tested one after another
+
+    Args:
+        folder (str): Data folder, created if needed
+        n_foils (int): Number of foils, spread over the 8 channels
+        monitor_rows (int): Number of samples of the all-channels monitor file
+        rng (np.random.Generator): Random number generator
+    """
+    os.makedirs(folder, exist_ok=True)
+    spacing = monitor_rows * MONITOR_STEP / (n_foils + 1)
+    for k in range(n_foils):
+        foil = f'ME0-SYNTH-{k:04d}'
+        start = MONITOR_START + timedelta(seconds=round((k + 0.5) * spacing / 60) * 60)
+        part1_file = f'QC2LONG_PART1_{foil}_{start:%Y%m%d_%H-%M}'
+        with open(os.path.join(folder, part1_file + '.txt'), 'w') as f:
+            f.write(f'Channel:\tCH{k % 8}\nFoil:\t{foil}\nOperator:\tQC\nDate:\t{start:%Y%m%d}\nRH:\t30\n'
+                    'Voltage (V)\tCurrent (uA)\tTime (s)\n')
+            t = 0.0
+            for step in range(PART1_STEPS):
+                voltage = (step + 1) * 50.0 + rng.normal(0, 0.2, PART1_STEP_ROWS)
+                current = 0.001 * (1 + step * 0.3) + np.abs(rng.normal(0, 0.0003, PART1_STEP_ROWS))
+                current[:8] = 0.0
+                for v, c in zip(voltage, current):
+                    f.write(f'{v:.2f}\t{c:.5f}\t{t:.1f}\n')
+                    t += 1.0
+        steps = (np.arange(PART1_STEPS) + 1) * 50.0
+        write_iv_points(os.path.join(folder, part1_file + '_IVplot.txt'), steps, 1 + steps * 0.006,
+                        np.full(PART1_STEPS, 0.3))
+        with open(os.path.join(folder, f'QC2FAST_{foil}_{start:%Y%m%d}.txt'), 'w') as f:
+            f.write('Time (minutes)\tImpedance (GOhm)\tSparks\n')
+            for minutes in (0.5, 1, 2, 3, 4, 5):
+                f.write(f'{minutes}\t35.0\t0\n')
+        with open(os.path.join(folder, f'QC2NOTES_{foil}.txt'), 'w') as f:
+            f.write('Notes\nSynthetic foil\n')
+
+    t = np.arange(monitor_rows) * MONITOR_STEP
+    voltage = 500.0 + rng.normal(0, 0.5, (monitor_rows, 8))
+    current = 0.002 + np.abs(rng.normal(0, 0.0003, (monitor_rows, 8)))
+    with open(os.path.join(folder, f'QC2_all_channels_monitor_{MONITOR_START:%Y%m%d_%H-%M}.txt'), 'w') as f:
+        f.write('HV monitor\nTime\t' + '\t'.join(f'V{c}' for c in range(8)) + '\t' +
+                '\t'.join(f'I{c}' for c in range(8)) + '\n')
+        np.savetxt(f, np.column_stack([t, voltage, current]), delimiter='\t',
+                   fmt=['%.1f'] + ['%.2f']*8 + ['%.5f']*8)
+
+def run_serial(folder, foil_names):
+    for foil in prepare_foils(folder, foil_names):
+        process_foil_dataset(folder, foil)
+
+def run_pipelined(folder, foil_names):
+    process_foils_pipelined(folder, foil_names)
+
+def best_time(run, folder, repeat):
+    """
+    Best wall time of repeat runs, with the report output discarded
+
+    Returns:
+        float: Time in seconds
+    """
+    foil_names = find_all_foils(folder)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            run(folder, foil_names)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark(folder, repeat):
+    """
+    Print the serial and pipelined wall times of a data folder
+
+    Args:
+        folder (str): Data folder with the QC2 input files
+        repeat (int): Runs per mode, the best time is reported
+    """
+    n_foils = len(find_all_foils(folder))
+    serial = best_time(run_serial, folder, repeat)
+    pipelined = best_time(run_pipelined, folder, repeat)
+    print(f'{n_foils} foils, {os.cpu_count()} CPUs')
+    print(f'  serial    {serial:7.2f} s  ({serial/n_foils*1000:.0f} ms/foil)')
+    print(f'  pipelined {pipelined:7.2f} s  ({pipelined/n_foils*1000:.0f} ms/foil)')
+    print(f'  speedup   {serial/pipelined:7.2f}x')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the QC2 report pipeline against the serial loop')
+    parser.add_argument('--foils', type=int, default=8, help='Number of synthetic foils (default: 8)')
+    parser.add_argument('--monitor-rows', type=int, default=100000,
+                        help='Samples of the all-channels monitor file (default: 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per mode (default: 3)')
+    parser.add_argument('--keep', metavar='DIR', help='Write the synthetic directory to DIR and keep it')
+
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    if args.keep:
+        write_synthetic_directory(args.keep, args.foils, args.monitor_rows, rng)
+        benchmark(args.keep, args.repeat)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_synthetic_directory(tmp_dir, args.foils, args.monitor_rows, rng)
+        benchmark(tmp_dir, args.repeat)
+
+if __name__ == '__main__':
+    main()
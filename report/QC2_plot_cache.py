@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+QC2 Plot Cache
+Content-hash keyed cache of rendered plot images with size-bounded LRU eviction
+"""
+import os
+import shutil
+import hashlib
+import numpy as np
+from QC_io import atomic_path
+
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Length, type and CRC of the IEND chunk closing every PNG file
+PNG_END = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+def is_complete_png(path):
+    """
+    Check that a file starts with the PNG signature and ends with the IEND chunk
+
+    Args:
+        path (str): Path to the image
+
+    Returns:
+        bool: False for truncated or overwritten images
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            return False
+        f.seek(0, os.SEEK_END)
+        if f.tell() < len(PNG_SIGNATURE) + len(PNG_END):
+            return False
+        f.seek(-len(PNG_END), os.SEEK_END)
+        return f.read() == PNG_END
+
+class PlotCache:
+    """
+    Directory of rendered PNG images keyed by a hash of the plotted data
+
+    The key covers the plot name, the input arrays (dtype, shape and content) and
+    the plotting parameters (threshold, style version, ...), so a cached image is
+    only reused when it would be rendered identically. Cache hits refresh the file's
+    modification time, and the least recently used images are removed once the
+    directory grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir (str): Directory holding the cached images
+            max_bytes (int): Maximum total size of the cache directory
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # Apply a possibly smaller size limit right away
+        self.evict()
+
+    @staticmethod
+    def key(name, arrays, **params):
+        """
+        Compute the cache key of a plot
+
+        Args:
+            name (str): Name of the plot type, e.g. 'VI-t'
+            arrays (list): Arrays plotted
+            **params: Plotting parameters that change the image
+
+        Returns:
+            str: Hex digest identifying the image
+        """
+        digest = hashlib.sha256()
+        digest.update(name.encode())
+        digest.update(repr(sorted(params.items())).encode())
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(f'{array.dtype.str}{array.shape}'.encode())
+            digest.update(array.data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.png')
+
+    def fetch(self, key, destination):
+        """
+        Copy a cached image to its destination
+
+        Args:
+            key (str): Cache key
+            destination (str): Path the image should be copied to
+
+        A cached image that is not a complete PNG file is removed and reported as
+        a miss, so that it is rendered again.
+
+        Returns:
+            bool: True on a cache hit, False if the image has to be rendered
+        """
+        path = self._path(key)
+        try:
+            if not is_complete_png(path):
+                print(f'Warning: removing corrupt cached image {path}')
+                os.remove(path)
+                return False
+            with atomic_path(destination) as tmp_path:
+                shutil.copyfile(path, tmp_path)
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, source):
+        """
+        Add a rendered image to the cache and evict old entries if needed
+
+        Args:
+            key (str): Cache key
+            source (str): Path to the rendered image
+        """
+        # Copy to a temporary file first so that readers never see a partial image
+        with atomic_path(self._path(key)) as tmp_path:
+            shutil.copyfile(source, tmp_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used images until the cache fits into max_bytes
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                # Skip the temporary files of images being stored
+                if not entry.name.endswith('.png') or entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def render_cached(plot_cache, name, arrays, params, path, render):
+    """
+    Produce a plot image, reusing a cached image if the data has not changed
+
+    Args:
+        plot_cache (PlotCache): Cache to use, or None to always render
+        name (str): Name of the plot type
+        arrays (list): Arrays plotted
+        params (dict): Plotting parameters that change the image
+        path (str): Output path of the image
+        render (callable): Function rendering the image to path
+
+    Returns:
+        bool: True if the cached image was used
+    """
+    if plot_cache is None:
+        render()
+        return False
+    key = plot_cache.key(name, arrays, **params)
+    if plot_cache.fetch(key, path):
+        return True
+    render()
+    plot_cache.store(key, path)
+    return False
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC2 Preflight
+Validates the input files of a QC2 data directory before the reports are generated
+
+Every foil's file set (PART1, QC2FAST megger file, QC2NOTES, IVplot and the
+all-channels monitor file), the PART1 header and the column count and numeric
+content of every data row are checked in one streaming pass, without plotting.
+All problems are collected into one report and the script exits with a non-zero
+status if any error was found, so that long runs only start on clean inputs.
+"""
+
+import os
+import re
+import sys
+import argparse
+import warnings
+from itertools import islice
+import numpy as np
+from QC2_dataset import FoilDataset, MonitorIndex, find_all_foils, parse_file_timestamp
+
+CHUNK_LINES = 65536
+MAX_LINE_ERRORS = 5  # Bad rows reported per file, the rest are only counted
+
+CHANNEL_PATTERN = re.compile(r'CH[0-%d]' % (MonitorIndex.N_CHANNELS - 1))
+
+class PreflightReport:
+    """
+    Errors and warnings found in a data directory, grouped by foil (or by file for
+    the files shared by all foils)
+    """
+
+    def __init__(self):
+        self.problems = {}
+        self.n_errors = 0
+        self.n_warnings = 0
+
+    def error(self, subject, message):
+        self.problems.setdefault(subject, []).append(('ERROR', message))
+        self.n_errors += 1
+
+    def warning(self, subject, message):
+        self.problems.setdefault(subject, []).append(('WARNING', message))
+        self.n_warnings += 1
+
+    def print(self, n_foils):
+        """
+        Print the consolidated report
+
+        Args:
+            n_foils (int): Number of foils checked
+        """
+        for subject, problems in self.problems.items():
+            print(f'\n{subject}')
+            for level, message in problems:
+                print(f'  {level}: {message}')
+        print(f'\nChecked {n_foils} foils: {self.n_errors} errors, {self.n_warnings} warnings')
+
+def bad_rows(lines, n_columns):
+    """
+    Find the rows of a chunk that do not hold exactly n_columns numbers
+
+    Args:
+        lines (list): Lines of the chunk
+        n_columns (int): Expected number of tab separated columns
+
+    Returns:
+        list: (index in the chunk, reason) of the bad rows
+    """
+    bad = []
+    for k, line in enumerate(lines):
+        fields = line.rstrip('\r\n').split('\t')
+        if len(fields) != n_columns:
+            bad.append((k, f'{len(fields)} columns instead of {n_columns}'))
+            continue
+        for field in fields:
+            try:
+                float(field)
+            except ValueError:
+                bad.append((k, f'non-numeric value {field!r}'))
+                break
+    return bad
+
+def check_table(path, skiprows, n_columns):
+    """
+    Check that every data row of a tab separated file holds n_columns numbers
+
+    The file is read in chunks of CHUNK_LINES lines. Each chunk is parsed with
+    np.loadtxt, and only chunks that fail are checked line by line to locate
+    the bad rows, so clean files are validated at parsing speed.
+
+    Args:
+        path (str): Path to the file
+        skiprows (int): Number of header lines
+        n_columns (int): Expected number of columns
+
+    Returns:
+        tuple: (number of data rows, list of (line number, reason) of the bad rows)
+    """
+    n_rows = 0
+    problems = []
+    with open(path) as f:
+        for _ in range(skiprows):
+            f.readline()
+        first_line = skiprows + 1
+        while True:
+            chunk = list(islice(f, CHUNK_LINES))
+            if not chunk:
+                break
+            # Blank lines are skipped when the data is loaded, so they are not checked either
+            numbers = [first_line + k for k, line in enumerate(chunk) if line.strip()]
+            lines = [chunk[number - first_line] for number in numbers]
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', UserWarning)
+                    table = np.loadtxt(lines, delimiter='\t', dtype=np.float64, ndmin=2)
+                if table.size and table.shape[1] != n_columns:
+                    raise ValueError
+            except ValueError:
+                problems.extend((numbers[k], reason) for k, reason in bad_rows(lines, n_columns))
+            n_rows += len(lines)
+            first_line += len(chunk)
+    return n_rows, problems
+
+def report_table(report, subject, path, skiprows, n_columns, required=True):
+    """
+    Check a data file with check_table and add its problems to the report
+
+    Args:
+        report (PreflightReport): Report to add to
+        subject (str): Foil or file the problems belong to
+        path (str): Path to the file
+        skiprows (int): Number of header lines
+        n_columns (int): Expected number of columns
+        required (bool): Whether an empty file is an error
+
+    Returns:
+        int: Number of data rows
+    """
+    name = os.path.basename(path)
+    try:
+        n_rows, problems = check_table(path, skiprows, n_columns)
+    except (OSError, UnicodeDecodeError) as e:
+        report.error(subject, f'{name}: cannot be read ({e})')
+        return 0
+    for line_number, reason in problems[:MAX_LINE_ERRORS]:
+        report.error(subject, f'{name} line {line_number}: {reason}')
+    if len(problems) > MAX_LINE_ERRORS:
+        report.error(subject, f'{name}: {len(problems) - MAX_LINE_ERRORS} more bad rows')
+    if n_rows == 0 and required:
+        report.error(subject, f'{name}: no data rows')
+    return n_rows
+
+def check_header(report, foil):
+    """
+    Check the structure of the header of a PART1 file: the description lines as
+    tab separated [key, value] rows followed by the column names line, and the
+    channel CH0 to CH7 in the value of the first line
+
+    Args:
+        report (PreflightReport): Report to add to
+        foil (FoilDataset): Dataset of the foil
+    """
+    subject = foil.foil_name
+    name = foil.part1_file + '.txt'
+    try:
+        header = foil.header
+        with open(os.path.join(foil.data_folder, name)) as f:
+            for _ in range(foil.HEADER_LINES):
+                f.readline()
+            column_line = f.readline().strip()
+    except (OSError, UnicodeDecodeError) as e:
+        report.error(subject, f'{name}: cannot be read ({e})')
+        return
+    for k, row in enumerate(header):
+        if len(row) < 2:
+            report.error(subject, f'{name} line {k+1}: expected at least 2 tab separated fields, found {chr(9).join(row)!r}')
+    if not column_line:
+        report.error(subject, f'{name} line {foil.HEADER_LINES+1}: column names line missing')
+    channel = header[0][1].strip() if len(header[0]) > 1 else ''
+    # The report reads the channel number from the third character of the value
+    if not CHANNEL_PATTERN.match(channel):
+        report.error(subject, f'{name}: channel {channel!r} is not CH0 to CH{MonitorIndex.N_CHANNELS - 1}')
+    if foil.part1_timestamp is None:
+        report.warning(subject, f'{name}: no YYYYMMDD_HH-MM time stamp in the file name, '
+                                'the whole monitor file will be used as Part 2')
+
+def check_foil(report, data_folder, foil_name, files):
+    """
+    Check the file set, header and data files of one foil
+
+    Args:
+        report (PreflightReport): Report to add to
+        data_folder (str): Path to the data folder
+        foil_name (str): Name of the foil
+        files (list): Names of the files in the data folder
+    """
+    part1_files = [file for file in files
+                   if file.startswith(f'QC2LONG_PART1_{foil_name}_') and file.endswith('.txt') and 'IVplot' not in file]
+    if len(part1_files) > 1:
+        report.warning(foil_name, f'{len(part1_files)} PART1 files ({", ".join(sorted(part1_files))}), '
+                                  'only one of them is used')
+
+    foil = FoilDataset.from_foil_name(data_folder, foil_name)
+    if foil is None:
+        # Report which of the required files are missing
+        if not any(file.startswith(f'QC2FAST_{foil_name}_') and file.endswith('.txt') for file in files):
+            report.error(foil_name, 'no QC2FAST (megger) file, run QC2_megger_generator.py')
+        # A missing monitor file is reported once for the directory
+        return
+
+    check_header(report, foil)
+    report_table(report, foil_name, os.path.join(data_folder, foil.part1_file + '.txt'), 6, 3)
+    report_table(report, foil_name, os.path.join(data_folder, foil.megger_file + '.txt'), 1, 3)
+
+    if not os.path.exists(os.path.join(data_folder, foil.notes_file + '.txt')):
+        report.error(foil_name, f'{foil.notes_file}.txt is missing')
+
+    iv_path = os.path.join(data_folder, foil.part1_file + '_IVplot.txt')
+    if not os.path.exists(iv_path):
+        report.error(foil_name, 'no IVplot file, run QC2_IV-plot-generator.py')
+    else:
+        report_table(report, foil_name, iv_path, 1, 3, required=False)
+
+def check_directory(data_folder):
+    """
+    Check all foils of a data directory
+
+    Args:
+        data_folder (str): Path to the data folder
+
+    Returns:
+        tuple: (PreflightReport, number of foils)
+    """
+    report = PreflightReport()
+    if not os.path.isdir(data_folder):
+        report.error(data_folder, 'not a directory')
+        return report, 0
+
+    files = os.listdir(data_folder)
+    foil_names = find_all_foils(data_folder)
+    if not foil_names:
+        report.error(data_folder, 'no QC2LONG_PART1 files')
+
+    # Files shared by all foils
+    monitor_files = sorted(file for file in files
+                           if file.startswith('QC2_all_channels_monitor_') and file.endswith('.txt'))
+    if not monitor_files:
+        report.error(data_folder, 'no QC2_all_channels_monitor file')
+    else:
+        if len(monitor_files) > 1:
+            report.warning(data_folder, f'{len(monitor_files)} all-channels monitor files, '
+                                        f'only {monitor_files[0]} is used')
+        monitor_file = monitor_files[0]
+        if parse_file_timestamp(monitor_file[25:39]) is None:
+            report.warning(monitor_file, 'no YYYYMMDD_HH-MM time stamp in the file name, '
+                                         'the whole file will be used as Part 2 of every foil')
+        report_table(report, monitor_file, os.path.join(data_folder, monitor_file), 2,
+                     1 + 2*MonitorIndex.N_CHANNELS)
+
+    # Megger files without a PART1 file
+    for file in sorted(files):
+        if file.startswith('QC2FAST_') and file.endswith('.txt'):
+            foil_name = '_'.join(file[:-4].split('_')[1:-1])
+            if foil_name not in foil_names:
+                report.warning(data_folder, f'{file} has no QC2LONG_PART1 file')
+
+    for foil_name in foil_names:
+        check_foil(report, data_folder, foil_name, files)
+    return report, len(foil_names)
+
+def preflight(data_folder):
+    """
+    Check a data directory and print the consolidated report
+
+    Args:
+        data_folder (str): Path to the data folder
+
+    Returns:
+        int: Exit status, 1 if any error was found
+    """
+    print(f'Preflight check of {data_folder}')
+    report, n_foils = check_directory(data_folder)
+    report.print(n_foils)
+    return 1 if report.n_errors else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the input files of a QC2 data directory')
+    parser.add_argument('data_folder', help='Path to the data folder')
+
+    args = parser.parse_args()
+    sys.exit(preflight(args.data_folder))
+
+if __name__ == '__main__':
+    main()
@@ -4,214 +4,338 @@ QC2 Report Generator
 Automatically generates QC2 reports for all foils in the data directory
 """
 import os
-import csv
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
+import matplotlib.ticker
 import mplhep as hep
-from fpdf import FPDF
 from datetime import datetime
 from fpdf.enums import XPos, YPos
 import argparse
-import fnmatch
+import sys
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from QC_plotting import decimate_indices, new_figure
+from QC_io import FoilLock, atomic_path
+from QC_resources import new_report_pdf
+from QC_staging import add_staging_arguments, staging_from_args
+from QC2_writers import write_part2, write_sections
+from QC2_preflight import preflight
+from QC2_analysis import analyse_discharges, hv_step_statistics
+from QC2_plot_cache import PlotCache, render_cached
+from QC2_overview import write_overview
+from QC2_dataset import FoilDataset, MonitorIndex, assign_part2_windows, find_all_foils, find_part1_files, find_qc2_files
 
-def find_qc2_files(data_folder, foil_name):
+# Current threshold [nA] drawn in the I-V plot
+IV_THRESHOLD = 7
+# Increase whenever the look of the report plots changes, so cached images are re-rendered
+PLOT_STYLE_VERSION = 1
+# Position and width of the report plots in the PDF, as fractions of the page width
+REPORT_PLOT_LAYOUT = {'VI-t': (0, 0.4), 'I-V': (0.45, 0.365), 'VI-t-long': (0, 0.4)}
+# Name prefixes of the files read by the report (the QC2LONG_PART2 and QC2RESULTS files are outputs)
+INPUT_PREFIXES = ('QC2LONG_PART1_', 'QC2FAST_', 'QC2NOTES_', 'QC2_all_channels_monitor_')
+
+def is_report_input(filename):
+    """
+    Whether a file of the data folder is read by the report (used to select the files to stage)
     """
-    Find QC2 related files for a given foil name in the specified folder
+    return filename.startswith(INPUT_PREFIXES) and filename.endswith('.txt')
+
+def prepare_foils(data_folder, foil_names, part2_window=None, long_dtype=np.float32):
+    """
+    Create the datasets of the given foils, sharing one all-channels monitor index
+    
+    The monitor file is read once for all foils and each foil's Part 2 series is
+    restricted to its own test window (see QC2_dataset.assign_part2_windows).
     
     Args:
         data_folder (str): Path to the data folder
-        foil_name (str): Name of the foil
+        foil_names (list): Names of the foils
+        part2_window (tuple): Explicit (t_start, t_end) in seconds used for all foils instead
+            of the windows derived from the PART1 time stamps
+        long_dtype: NumPy dtype of the long-term (Part 2) voltage and current
     
     Returns:
-        tuple: (part1_file, megger_file, all_channels_file)
+        list: FoilDataset objects of the foils whose input files were all found
     """
-    part1_file = ''
-    megger_file = ''
-    all_channels_file = ''
-    
-    # List all files in the data folder
-    files = os.listdir(data_folder)
-    
-    # Find part1 file
-    for file in files:
-        if file.startswith(f'QC2LONG_PART1_{foil_name}_') and file.endswith('.txt'):
-            if 'IVplot' not in file:
-                part1_file = file[:-4]  # Remove .txt extension
-                break
-    
-    # Find megger file
-    for file in files:
-        if file.startswith(f'QC2FAST_{foil_name}_') and file.endswith('.txt'):
-            megger_file = file[:-4]  # Remove .txt extension
-            break
-    
-    # Find all channels file
-    for file in files:
-        if file.startswith('QC2_all_channels_monitor_') and file.endswith('.txt'):
-            all_channels_file = file[:-4]  # Remove .txt extension
-            break
-    
-    return part1_file, megger_file, all_channels_file
+    datasets = []
+    monitor = None
+    for foil_name in foil_names:
+        foil = FoilDataset.from_foil_name(data_folder, foil_name, long_dtype=long_dtype, part2_window=part2_window)
+        if foil is None:
+            print(f"Could not find all required files for foil {foil_name}")
+            continue
+        if monitor is None:
+            monitor = MonitorIndex(os.path.join(data_folder, foil.all_channels_file + '.txt'), long_dtype)
+        foil.monitor = monitor
+        datasets.append(foil)
+    assign_part2_windows(datasets)
+    return datasets
 
-def find_all_foils(data_folder):
+def prepare_directory(data_folder, part2_window=None, long_dtype=np.float32):
     """
-    Find all unique foil names in the data folder from QC2LONG_PART1 files
+    Create the datasets of every PART1 file of a directory, retests included,
+    sharing one all-channels monitor index
+    
+    Callers processing the foils one at a time (e.g. the campaign workers) prepare
+    a directory once and pass the result to process_foil, so the monitor file is
+    read and the Part 2 windows are derived only once per directory.
     
     Args:
         data_folder (str): Path to the data folder
+        part2_window (tuple): Explicit (t_start, t_end) in seconds used for all foils
+        long_dtype: NumPy dtype of the long-term (Part 2) voltage and current
     
     Returns:
-        list: List of unique foil names
+        dict: PART1 file name (with .txt extension) -> FoilDataset, for the files whose
+              input files were all found
     """
-    foil_names = []
-    for file in os.listdir(data_folder):
-        if file.startswith('QC2LONG_PART1_') and file.endswith('.txt'):
-            if 'IVplot' not in file:
-                # Extract foil name from filename
-                parts = file.split('_')
-                foil_name = '_'.join(parts[2:-2])  # Exclude prefix and date/time
-                if foil_name not in foil_names:
-                    foil_names.append(foil_name)
-    return foil_names
+    datasets = {}
+    monitor = None
+    for part1_file in sorted(find_part1_files(data_folder)):
+        foil = FoilDataset.from_part1_file(data_folder, part1_file, long_dtype=long_dtype, part2_window=part2_window)
+        if foil is None:
+            print(f"Could not find all required files for {part1_file}")
+            continue
+        if monitor is None:
+            monitor = MonitorIndex(os.path.join(data_folder, foil.all_channels_file + '.txt'), long_dtype)
+        foil.monitor = monitor
+        datasets[part1_file] = foil
+    assign_part2_windows(list(datasets.values()))
+    return datasets
 
-def process_foil(data_folder, foil_name):
+def draw_vi_time(axc, time_list, current_list, voltage_list, time_label):
     """
-    Process a single foil and generate its QC2 report
+    Draw current and voltage against time on an axes and its twin
     
     Args:
-        data_folder (str): Path to the data folder
-        foil_name (str): Name of the foil
+        axc (Axes): Axes of the current, the voltage gets a twin axes
+        time_list (array): Time values
+        current_list (array): Current values
+        voltage_list (array): Voltage values
+        time_label (str): Label of the time axis
     """
-    # Find all required files
-    part1_file, megger_file, all_channels_file = find_qc2_files(data_folder, foil_name)
-    
-    if not part1_file or not megger_file or not all_channels_file:
-        print(f"Could not find all required files for foil {foil_name}")
-        return
+    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", fontsize=24, ax=axc)
+    axc.set_ylabel('Current [nA]', fontsize=24, color='blue', loc='top')
+    axc.set_xlabel(time_label, fontsize=24, loc='right')
+    axc.tick_params(axis="x", direction='in', labelsize=20, length=8)
+    axc.tick_params(axis="y", direction='in', labelsize=20, colors='blue', length=8)
+    axc.plot(time_list,current_list,'s-', color='blue')
+
+    axv = axc.twinx()
+    axv.set_ylabel('Voltage [V]', fontsize=24, color='red', loc='top')
+    axv.tick_params(axis="y", direction='in', labelsize=20, length=8, colors='red')
+    axv.plot(time_list,voltage_list,'s-', color='r')
+
+def draw_iv(ax, IV_voltage, IV_current, IV_current_error, threshold):
+    """
+    Draw the I-V points with the current threshold on an axes
     
-    print(f"Processing foil {foil_name}...")
-    
-    # Create folders if they don't exist
-    if not os.path.exists(os.path.join(data_folder, 'plots')):
-        os.makedirs(os.path.join(data_folder, 'plots'))
-    if not os.path.exists(os.path.join(data_folder, 'pdf_reports')):
-        os.makedirs(os.path.join(data_folder, 'pdf_reports'))
-
-    # Read megger file
-    with open(os.path.join(data_folder, megger_file + '.txt')) as csv_file:
-        csv_content = csv.reader(csv_file, delimiter='\t')
-        megger_list = list(csv_content)
-
-    # Read part1 file
-    with open(os.path.join(data_folder, part1_file + '.txt')) as csv_file:
-        csv_content = csv.reader(csv_file, delimiter='\t')
-        data_list_part1 = list(csv_content)
-    description_list = data_list_part1[0:5]
-    CH_number = int(description_list[0][1][2])  # The channel number is only one digit
-    del data_list_part1[0:6]  # Delete the headers
-    
-    # Initialize lists
-    voltage_list_part1 = []
-    current_list_part1 = []
-    time_list_part1 = []
-
-    # Read IV plot data
-    with open(os.path.join(data_folder, part1_file + '_IVplot.txt')) as csv_file:
-        csv_content = csv.reader(csv_file, delimiter='\t')
-        data_list_IV = list(csv_content)
-    del data_list_IV[0]
-    IV_voltage = []
-    IV_current = []
-    IV_current_error = []
-
-    # Read all channels file
-    with open(os.path.join(data_folder, all_channels_file + '.txt')) as csv_file:
-        csv_content = csv.reader(csv_file, delimiter='\t')
-        data_list_allCH = list(csv_content)
-    del data_list_allCH[0:2]
-    voltage_list_part2 = []
-    current_list_part2 = []
-    time_list_part2 = []
-
-    # Read notes file
-    lenpart1 = len(part1_file)
-    with open(os.path.join(data_folder, 'QC2NOTES_' + part1_file[14:lenpart1-15] + '.txt')) as csv_file:
-        csv_content = csv.reader(csv_file, delimiter='\t')
-        notes_list = list(csv_content)
-    del notes_list[0]
-
-    # Process data
-    for i in range(len(data_list_part1)):
-        voltage_list_part1.append(float(data_list_part1[i][0]))
-        current_list_part1.append(float(data_list_part1[i][1]))
-        time_list_part1.append(float(data_list_part1[i][2]))
-    
-    for i in range(len(data_list_IV)):
-        IV_voltage.append(float(data_list_IV[i][0]))
-        IV_current.append(float(data_list_IV[i][1]))
-        IV_current_error.append(float(data_list_IV[i][2]))
-    
-    for i in range(len(data_list_allCH)):
-        voltage_list_part2.append(float(data_list_allCH[i][CH_number+1]))
-        current_list_part2.append(float(data_list_allCH[i][CH_number+9]))
-        time_list_part2.append(float(data_list_allCH[i][0])/3600.0)
-
-    # Generate plots
-    fig, axc1 = plt.subplots()
-    fig.set_figheight(9)
-    fig.set_figwidth(10)
-    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", fontsize=24)
-    axc1.set_ylabel('Current [nA]', fontsize=24, color='blue', loc='top')
-    axc1.set_xlabel('Time [s]', fontsize=24, loc='right')
-    axc1.tick_params(axis="x", direction='in', labelsize=20, length=8)
-    axc1.tick_params(axis="y", direction='in', labelsize=20, colors='blue', length=8)
-    axc1.plot(time_list_part1,current_list_part1,'s-', color='blue')
-
-    axv1 = axc1.twinx()
-    axv1.set_ylabel('Voltage [V]', fontsize=24, color='red', loc='top')
-    axv1.tick_params(axis="y", direction='in', labelsize=20, length=8, colors='red')
-    axv1.plot(time_list_part1,voltage_list_part1,'s-', color='r')
-    plt.savefig(os.path.join(data_folder, 'plots', part1_file + '-VI-t.png'), bbox_inches='tight')
-    plt.close()
-
-    fig2, ax = plt.subplots()
-    fig2.set_figheight(9)
-    fig2.set_figwidth(10)
-    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", fontsize=24)
+    Args:
+        ax (Axes): Axes to draw on
+        IV_voltage (array): Plateau voltages [V]
+        IV_current (array): Mean currents [nA]
+        IV_current_error (array): Errors of the mean currents [nA]
+        threshold (float): Current threshold [nA] drawn as a line
+    """
+    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", fontsize=24, ax=ax)
     ax.errorbar(x=IV_voltage,y=IV_current,yerr=IV_current_error,fmt='s', color='k')
     ax.set_yscale("log")
-    ax.set_yticks([1, 7, 10])
+    ax.set_yticks([1, threshold, 10])
     ax.tick_params(axis="x", direction='in', labelsize=20, length=8)
     ax.tick_params(axis="y", direction='in', labelsize=20, length=8)
     ax.get_yaxis().set_major_formatter(matplotlib.ticker.ScalarFormatter())
     ax.set_xlabel('Voltage [V]', fontsize=24, loc='right')
     ax.set_ylabel('Current [nA]', fontsize=24, loc='top')
-    ax.axhline(y=7, color='r', linestyle='-')
-    plt.savefig(os.path.join(data_folder, 'plots', part1_file + '-I-V.png'), bbox_inches='tight')
-    plt.close()
-
-    fig3, axc2 = plt.subplots()
-    fig3.set_figheight(9)
-    fig3.set_figwidth(10)
-    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", fontsize=24)
-    axc2.set_ylabel('Current [nA]', fontsize=24, color='blue', loc='top')
-    axc2.set_xlabel('Time [hr]', fontsize=24, loc='right')
-    axc2.tick_params(axis="x", direction='in', labelsize=20, length=8)
-    axc2.tick_params(axis="y", direction='in', labelsize=20, colors='blue', length=8)
-    axc2.plot(time_list_part2,current_list_part2,'s-', color='blue')
-
-    axv2 = axc2.twinx()
-    axv2.set_ylabel('Voltage [V]', fontsize=24, color='r', loc='top')
-    axv2.tick_params(axis="y", direction='in', labelsize=20, length=8, colors='red')
-    axv2.plot(time_list_part2,voltage_list_part2,'s-', color='r')
-    plt.savefig(os.path.join(data_folder, 'plots', part1_file + '-VI-t-long.png'), bbox_inches='tight')
-    plt.close()
+    ax.axhline(y=threshold, color='r', linestyle='-')
+
+def plot_figure(path, draw, args):
+    """
+    Render one report plot to a PNG image
+    
+    Args:
+        path (str): Output path of the PNG image
+        draw (function): Draw function taking the axes followed by args, e.g. draw_vi_time
+        args (tuple): Arguments of the draw function after the axes
+    """
+    fig, ax = new_figure(10, 9)
+    draw(ax, *args)
+    with atomic_path(path) as tmp_path:
+        fig.savefig(tmp_path, bbox_inches='tight')
+
+def report_plots(foil, max_points=None):
+    """
+    Plots of a foil report, shared by the PDF report and QC2_merged_report.py
+    
+    Args:
+        foil (FoilDataset): Loaded foil data
+        max_points (int): Min/max decimate the long-term series to this many points, None to plot all samples
+    
+    Returns:
+        dict: Plot name -> (draw function, arguments after the axes, plotted data and
+              parameters for the plot cache)
+    """
+    voltage_list_part2, current_list_part2, time_list_part2 = foil.part2
+    kept = decimate_indices(current_list_part2, max_points) if max_points else slice(None)
+    params = {'style': PLOT_STYLE_VERSION}
+    return {
+        'VI-t': (draw_vi_time, (foil.part1[2], foil.part1[1], foil.part1[0], 'Time [s]'), foil.part1, params),
+        'I-V': (draw_iv, (*foil.iv, IV_THRESHOLD), foil.iv, dict(params, threshold=IV_THRESHOLD)),
+        'VI-t-long': (draw_vi_time, (time_list_part2[kept]/3600.0, current_list_part2[kept], voltage_list_part2[kept],
+                                     'Time [hr]'), foil.part2, params),
+    }
+
+def render_foil_plots(data_folder, foil, plot_cache=None):
+    """
+    Generate the three report plots of a foil in the plots folder
+    
+    Args:
+        data_folder (str): Path to the data folder
+        foil (FoilDataset): Loaded foil data
+        plot_cache (PlotCache): Cache of previously rendered plots, None to always render
+    
+    Returns:
+        int: Number of plots taken from the cache
+    """
+    # Generate the plots concurrently, each on its own figure
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = []
+        for name, (draw, args, data, params) in report_plots(foil).items():
+            path = os.path.join(data_folder, 'plots', f'{foil.part1_file}-{name}.png')
+            futures.append(executor.submit(render_cached, plot_cache, name, data, params, path,
+                                           partial(plot_figure, path, draw, args)))
+        n_cached = sum(future.result() for future in futures)
+    return n_cached
+
+def analyse_foil(foil):
+    """
+    Spark and HV trip analysis of the Part 1 and Part 2 series of a foil, and leakage
+    current statistics of the Part 2 HV steps
+    
+    Args:
+        foil (FoilDataset): Loaded foil data
+    
+    Returns:
+        dict: 'discharges': series name ('Part 1', 'Part 2') -> result of QC2_analysis.analyse_discharges,
+              'part2_steps': result of QC2_analysis.hv_step_statistics for Part 2
+    """
+    voltage_list_part1, current_list_part1, time_list_part1 = foil.part1
+    voltage_list_part2, current_list_part2, time_list_part2 = foil.part2
+    return {
+        'discharges': {
+            'Part 1': analyse_discharges(time_list_part1, voltage_list_part1, current_list_part1),
+            'Part 2': analyse_discharges(time_list_part2, voltage_list_part2, current_list_part2),
+        },
+        'part2_steps': hv_step_statistics(time_list_part2, voltage_list_part2, current_list_part2),
+    }
+
+def discharge_summary_rows(analysis):
+    """
+    Summary table of the spark and trip analysis
+    
+    Args:
+        analysis (dict): Result of analyse_foil
+    
+    Returns:
+        list: Header row followed by one row per series
+    """
+    rows = [['Series', 'Sparks', 'HV trips', 'Max sparks per hour']]
+    for series, result in analysis['discharges'].items():
+        rows.append([series, str(result['n_sparks']), str(result['n_trips']), str(result['max_sparks_per_window'])])
+    return rows
+
+def hv_step_rows(analysis):
+    """
+    Table of the Part 2 leakage current per HV step
+    
+    Args:
+        analysis (dict): Result of analyse_foil
+    
+    Returns:
+        list: Header row followed by one row per HV step
+    """
+    steps = analysis['part2_steps']
+    rows = [['Vmon (V)', 'Duration (h)', 'Mean Imon (nA)', 'Stdev Imon (nA)', 'Max Imon (nA)', 'Time above thr. (h)']]
+    for k in range(len(steps['start'])):
+        rows.append([f"{steps['voltage'][k]:.1f}", f"{steps['duration'][k]/3600:.2f}",
+                     f"{steps['mean'][k]*1000:.2f}", f"{steps['stdev'][k]*1000:.2f}",
+                     f"{steps['max'][k]*1000:.2f}", f"{steps['time_above'][k]/3600:.2f}"])
+    return rows
+
+def results_sections(foil, analysis):
+    """
+    Tables of the QC2RESULTS file of a foil
+    
+    Args:
+        foil (FoilDataset): Loaded foil data
+        analysis (dict): Result of analyse_foil
+    
+    Returns:
+        list: (title, column names, rows) tuples for QC2_writers.write_sections
+    """
+    series_data = {'Part 1': foil.part1, 'Part 2': foil.part2}
+    summary = discharge_summary_rows(analysis)
+    events = []
+    per_window = []
+    for series, result in analysis['discharges'].items():
+        voltage, current, time = series_data[series]
+        for kind, indices in (('spark', result['spark_idx']), ('trip', result['trip_idx'])):
+            for idx in indices:
+                events.append([series, kind, float(time[idx]), float(voltage[idx]), float(current[idx])])
+        for start, count in zip(result['window_start'], result['sparks_per_window']):
+            per_window.append([series, float(start), int(count)])
+    events.sort(key=lambda row: (row[0], row[2]))
+    steps = analysis['part2_steps']
+    step_columns = ['start', 'duration', 'n_samples', 'voltage', 'mean', 'stdev', 'max', 'time_above']
+    step_rows = [[steps[key][k].item() for key in step_columns] for k in range(len(steps['start']))]
+    return [
+        ('Discharge analysis', summary[0], summary[1:]),
+        ('Discharge events', ['Series', 'Type', 'Time (s)', 'Voltage (V)', 'Current (uA)'], events),
+        ('Sparks per hour', ['Series', 'Window start (s)', 'Sparks'], per_window),
+        ('Part 2 HV steps', ['Start (s)', 'Duration (s)', 'Samples', 'Voltage (V)', 'Mean current (uA)',
+                             'Stdev current (uA)', 'Max current (uA)', 'Time above threshold (s)'], step_rows),
+    ]
+
+def report_sections(foil, analysis):
+    """
+    Sections of a foil report in page order, shared by the PDF report and QC2_merged_report.py
+    
+    Args:
+        foil (FoilDataset): Loaded foil data
+        analysis (dict): Result of analyse_foil
+    
+    Returns:
+        list: (title, kind, content) tuples: kind 'table' with a header row followed by the
+              data rows, 'plots' with names of report_plots, or 'notes' with the note lines
+    """
+    return [
+        ('Acceptance test I (Megger test)', 'table', foil.megger_rows()),
+        ('Acceptance test II -Part 1-', 'plots', ['VI-t', 'I-V']),
+        ('Acceptance test II -Part 2-', 'plots', ['VI-t-long']),
+        ('Leakage current per HV step (Part 2)', 'table', hv_step_rows(analysis)),
+        ('Discharge analysis', 'table', discharge_summary_rows(analysis)),
+        ('Notes', 'notes', [str(note) for note in foil.notes]),
+    ]
+
+def build_foil_report(data_folder, foil, analysis):
+    """
+    Build the PDF report of a foil in memory
+    
+    Args:
+        data_folder (str): Path to the data folder
+        foil (FoilDataset): Loaded foil data
+        analysis (dict): Result of analyse_foil
+    
+    Returns:
+        tuple: (FPDF document, pdf filename)
+    """
+    part1_file = foil.part1_file
+    description_list = foil.header
 
     # Generate PDF report
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(True, margin=1.0)
+    pdf = new_report_pdf()
     
     # Generate header
     pdf.set_font('helvetica', 'B', 22)
@@ -219,77 +343,269 @@ def process_foil(data_folder, foil_name):
     pdf.set_font('helvetica', 'B', 12)
     for k in range(len(description_list)):
         pdf.cell(40, 5, description_list[k][0] + ' ' + description_list[k][1], new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    pdf.set_font('helvetica', 'B', 16)
-    pdf.cell(300, 20, 'Acceptance test I (Megger test)')
-
-    # Generate Megger table
-    pdf.set_font('helvetica', '', 10)
-    pdf.cell(300, 15, '', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    line_height = pdf.font_size * 1.5
-    col_width = pdf.epw / 3
-
-    for row in megger_list:
-        for entry in row:
-            pdf.multi_cell(col_width, line_height, entry, border=1, new_x=XPos.RIGHT, new_y=YPos.TOP, max_line_height=pdf.font_size)
-        pdf.ln(line_height)
-
-    # Place plots
-    pdf.set_font('helvetica', 'B', 16)
-    pdf.cell(300, 20, 'Acceptance test II -Part 1-')
-    pdf.set_font('helvetica', '', 10)
-    pdf.cell(300, 15, '', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    pdf.image(os.path.join(data_folder, 'plots', part1_file + '-VI-t.png'), pdf.get_x(), pdf.get_y(), pdf.epw*0.4)
-    pdf.image(os.path.join(data_folder, 'plots', part1_file + '-I-V.png'), pdf.get_x()+pdf.epw*0.45, pdf.get_y(), pdf.epw*0.365)
-    pdf.ln(62)
-    
-    pdf.set_font('helvetica', 'B', 16)
-    pdf.cell(300, 20, 'Acceptance test II -Part 2-')
-    pdf.set_font('helvetica', '', 10)
-    pdf.cell(300, 15, '', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    pdf.image(os.path.join(data_folder, 'plots', part1_file + '-VI-t-long.png'), pdf.get_x(), pdf.get_y(), pdf.epw*0.4)
-    pdf.ln(62)
-    
-    pdf.set_font('helvetica', 'B', 16)
-    pdf.cell(300, 20, 'Notes')
-    pdf.set_font('helvetica', '', 10)
-    pdf.cell(300, 15, '', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    for row in notes_list:
-        pdf.cell(300, pdf.font_size, row[0], new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
-    # Save PDF
+    for title, kind, content in report_sections(foil, analysis):
+        pdf.set_font('helvetica', 'B', 16)
+        pdf.cell(300, 20, title)
+        pdf.set_font('helvetica', '', 10)
+        pdf.cell(300, 15, '', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        if kind == 'table':
+            line_height = pdf.font_size * 1.5
+            col_width = pdf.epw / len(content[0])
+            for row in content:
+                for entry in row:
+                    pdf.multi_cell(col_width, line_height, entry, border=1, new_x=XPos.RIGHT, new_y=YPos.TOP, max_line_height=pdf.font_size)
+                pdf.ln(line_height)
+        elif kind == 'plots':
+            x, y = pdf.get_x(), pdf.get_y()
+            for name in content:
+                offset, width = REPORT_PLOT_LAYOUT[name]
+                pdf.image(os.path.join(data_folder, 'plots', f'{part1_file}-{name}.png'), x + pdf.epw*offset, y, pdf.epw*width)
+            pdf.ln(62)
+        else:
+            for note in content:
+                pdf.cell(300, pdf.font_size, note, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
     pdf_filename = f'QC2REPORT_{part1_file[14:44]}_{datetime.now().strftime("%Y%m%d_%H-%M")}.pdf'
-    pdf.output(os.path.join(data_folder, 'pdf_reports', pdf_filename))
+    return pdf, pdf_filename
+
+def write_foil_outputs(data_folder, foil, pdf, pdf_filename, analysis, sidecar=False):
+    """
+    Write the PDF report, the QC2 long Part 2 txt file and the results file of a foil
+    
+    Args:
+        data_folder (str): Path to the data folder
+        foil (FoilDataset): Loaded foil data
+        pdf (FPDF): Report built by build_foil_report
+        pdf_filename (str): Name of the PDF report
+        analysis (dict): Result of analyse_foil
+        sidecar (bool): Also write the Part 2 data as a binary .npy sidecar
+    """
+    part1_file = foil.part1_file
+    all_channels_file = foil.all_channels_file
+    description_list = foil.header
+
+    # Save PDF
+    with atomic_path(os.path.join(data_folder, 'pdf_reports', pdf_filename)) as tmp_path:
+        pdf.output(tmp_path)
     print(f'Created report: {pdf_filename}')
 
     # Generate individual txt files for QC2 long Part 2
-    QC2_part2_list_to_save = []
-    for i in range(len(description_list)-1):
-        temp_header = []
-        temp_header.append(description_list[i][0])
-        temp_header.append(description_list[i][1])
-        temp_header.append('\t')
-        QC2_part2_list_to_save.append(temp_header)
-    
-    time_stamp_part2 = all_channels_file[25:39]
-    QC2_part2_list_to_save.append(['Time_stamp:', time_stamp_part2, '\t'])
-    QC2_part2_list_to_save.append(['Voltage (V)', 'Current (uA)', 'Time (s)'])
-    
-    for i in range(len(data_list_allCH)):
-        temp_list = []
-        temp_list.append(data_list_allCH[i][CH_number+1])
-        temp_list.append(data_list_allCH[i][CH_number+9])
-        temp_list.append(data_list_allCH[i][0])
-        QC2_part2_list_to_save.append(temp_list)
-    
     part2_filename = f'QC2LONG_PART2{part1_file[13:44]}{all_channels_file[24:39]}.txt'
-    np.savetxt(os.path.join(data_folder, part2_filename), QC2_part2_list_to_save, delimiter='\t', fmt='%s')
+    part2_rows = foil.part2_rows  # Loads the monitor file if needed
+    write_part2(os.path.join(data_folder, part2_filename), description_list, all_channels_file[25:39],
+                foil.monitor.path, foil.channel, part2_rows, foil.part2, sidecar=sidecar)
+
+    # Analysis results
+    results_filename = f'QC2RESULTS_{part1_file[14:]}.txt'
+    write_sections(os.path.join(data_folder, results_filename),
+                   [f'{row[0]}\t{row[1]}' for row in description_list], results_sections(foil, analysis))
+
+def make_output_folders(data_folder):
+    """
+    Create the plots and pdf_reports folders if they don't exist
+    
+    Args:
+        data_folder (str): Path to the data folder
+    """
+    # exist_ok: another process may create them at the same time
+    os.makedirs(os.path.join(data_folder, 'plots'), exist_ok=True)
+    os.makedirs(os.path.join(data_folder, 'pdf_reports'), exist_ok=True)
+
+def process_foil(data_folder, foil_name, part2_window=None, sidecar=False, plot_cache=None, datasets=None,
+                 part1_file=None, lock=True):
+    """
+    Process a single foil and generate its QC2 report
+    
+    Args:
+        data_folder (str): Path to the data folder
+        foil_name (str): Name of the foil
+        part2_window (tuple): Explicit Part 2 (t_start, t_end) in seconds, derived if None
+            (only used if datasets is None)
+        sidecar (bool): Also write the Part 2 data as a binary .npy sidecar
+        plot_cache (PlotCache): Cache of previously rendered plots, None to always render
+        datasets (dict): Datasets of the directory from prepare_directory, prepared here if None
+        part1_file (str): QC2LONG_PART1 file to report, e.g. a retest of the foil
+            (default: the foil's first PART1 file)
+        lock (bool): Take the foil lock, False if the caller already holds it
+    
+    Returns:
+        bool: True if the report was created, False if input files are missing
+    """
+    # The other foils of the directory are needed to derive the Part 2 window
+    if datasets is None:
+        datasets = prepare_directory(data_folder, part2_window)
+    if part1_file is None:
+        part1_file = find_qc2_files(data_folder, foil_name)[0]
+    foil = datasets.get(part1_file if part1_file.endswith('.txt') else part1_file + '.txt')
+    if foil is None:
+        return False
+    process_foil_dataset(data_folder, foil, sidecar, plot_cache, lock)
+    return True
+
+def process_foil_dataset(data_folder, foil, sidecar=False, plot_cache=None, lock=True):
+    """
+    Load, render and write the report of a prepared foil dataset
+    
+    Args:
+        data_folder (str): Path to the data folder
+        foil (FoilDataset): Foil dataset from prepare_foils
+        sidecar (bool): Also write the Part 2 data as a binary .npy sidecar
+        plot_cache (PlotCache): Cache of previously rendered plots, None to always render
+        lock (bool): Take the foil lock around the outputs, False if the caller already holds it
+    """
+    foil.load()
+    print(f"Processing foil {foil.foil_name}...")
+    make_output_folders(data_folder)
+    with FoilLock(data_folder, foil.foil_name) if lock else nullcontext():
+        render_foil_plots(data_folder, foil, plot_cache)
+        analysis = analyse_foil(foil)
+        pdf, pdf_filename = build_foil_report(data_folder, foil, analysis)
+        write_foil_outputs(data_folder, foil, pdf, pdf_filename, analysis, sidecar)
+
+def render_overview(data_folder, monitor, foils, input_folder=None):
+    """
+    Render the all-channels overview from the monitor index already loaded for the foils
+
+    Args:
+        data_folder (str): Path to the data folder the overview is written to
+        monitor (MonitorIndex): Monitor data shared by the foils, None if nothing was loaded
+        foils (dict): Channel number -> names of the processed foils
+        input_folder (str): Folder the input files are read from (default: data_folder)
+    """
+    if monitor is None:
+        print('No monitor data loaded, overview skipped')
+        return
+    try:
+        png_path, _, _ = write_overview(input_folder or data_folder, monitor, foils, output_folder=data_folder)
+    except Exception as e:
+        print(f"Error creating the overview: {e}")
+        return
+    print(f"Created overview {png_path}")
+
+def process_foils_pipelined(data_folder, foil_names, prefetch=2, write_backlog=2, part2_window=None, sidecar=False,
+                            plot_cache=None, input_folder=None, overview=False):
+    """
+    Process several foils with overlapping read, render and write stages
+    
+    A prefetch thread reads and parses the next foils while the main thread renders
+    the current one, and a writer thread flushes the PDF reports and Part 2 txt files.
+    The bounded queues keep at most prefetch parsed foils and write_backlog finished
+    reports in memory.
+    
+    Args:
+        data_folder (str): Path to the data folder
+        foil_names (list): Names of the foils to process
+        prefetch (int): Maximum number of parsed foils waiting to be rendered
+        write_backlog (int): Maximum number of reports waiting to be written
+        part2_window (tuple): Explicit Part 2 (t_start, t_end) in seconds, derived if None
+        sidecar (bool): Also write the Part 2 data as binary .npy sidecars
+        plot_cache (PlotCache): Cache of previously rendered plots, None to always render
+        input_folder (str): Folder the input files are read from, e.g. a staged copy (default: data_folder)
+        overview (bool): Also render the all-channels overview from the shared monitor
+            index, while the writer thread flushes the last reports
+    
+    Returns:
+        int: Number of reports created
+    """
+    loaded = queue.Queue(maxsize=max(1, prefetch))
+    to_write = queue.Queue(maxsize=max(1, write_backlog))
+    written = []
+    monitor = None
+    foils = {}
+
+    def reader():
+        try:
+            datasets = prepare_foils(input_folder or data_folder, foil_names, part2_window)
+        except Exception as e:
+            print(f"Error reading the monitor file: {e}")
+            datasets = []
+        for foil in datasets:
+            try:
+                foil.load()
+            except Exception as e:
+                print(f"Error reading files of foil {foil.foil_name}: {e}")
+                continue
+            loaded.put(foil)
+        loaded.put(None)
+
+    def writer():
+        while True:
+            item = to_write.get()
+            if item is None:
+                break
+            foil, pdf, pdf_filename, analysis, lock = item
+            try:
+                write_foil_outputs(data_folder, foil, pdf, pdf_filename, analysis, sidecar)
+                written.append(foil.foil_name)
+            except Exception as e:
+                print(f"Error writing outputs of foil {foil.foil_name}: {e}")
+            finally:
+                lock.release()
+
+    make_output_folders(data_folder)
+    # Daemon threads so that an error in the main thread never leaves the script hanging
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    try:
+        while True:
+            foil = loaded.get()
+            if foil is None:
+                break
+            foil_name = foil.foil_name
+            print(f"Processing foil {foil_name}...")
+            monitor = foil.monitor
+            foils.setdefault(foil.channel, []).append(foil_name)
+            # Held until the writer thread has written the foil's outputs
+            lock = FoilLock(data_folder, foil_name).acquire()
+            try:
+                render_foil_plots(data_folder, foil, plot_cache)
+                analysis = analyse_foil(foil)
+                pdf, pdf_filename = build_foil_report(data_folder, foil, analysis)
+            except Exception as e:
+                print(f"Error processing foil {foil_name}: {e}")
+                lock.release()
+                continue
+            to_write.put((foil, pdf, pdf_filename, analysis, lock))
+        if overview:
+            render_overview(data_folder, monitor, foils, input_folder)
+    finally:
+        to_write.put(None)
+        writer_thread.join()
+
+    return len(written)
 
 def main():
     parser = argparse.ArgumentParser(description='Generate QC2 reports for all foils in the data folder')
     parser.add_argument('data_folder', help='Path to the data folder')
+    parser.add_argument('--serial', action='store_true',
+                      help='Process the foils one after another without the read/render/write pipeline')
+    parser.add_argument('--prefetch', type=int, default=2,
+                      help='Number of foils read ahead while rendering (default: 2)')
+    parser.add_argument('--part2-window', type=float, nargs=2, metavar=('START', 'END'),
+                      help='Part 2 window in hours since the start of the monitor file, used for all foils '
+                           '(default: derived per foil from the PART1 time stamps)')
+    parser.add_argument('--sidecar', action='store_true',
+                      help='Also write the QC2LONG_PART2 data as a binary .npy file')
+    parser.add_argument('--plot-cache', help='Directory of the plot cache (default: <data_folder>/plots/.cache)')
+    parser.add_argument('--plot-cache-size', type=float, default=500,
+                      help='Maximum size of the plot cache in MB (default: 500)')
+    parser.add_argument('--no-plot-cache', action='store_true',
+                      help='Always re-render all plots')
+    parser.add_argument('--preflight', action='store_true',
+                      help='Check all input files first and stop without creating any report if errors are found')
+    parser.add_argument('--overview', action='store_true',
+                      help='Also render the overview of all channels (Vmon/Imon and statistics) from the same monitor data')
+    add_staging_arguments(parser, default=False)
     
     args = parser.parse_args()
     
+    if args.preflight and preflight(args.data_folder) != 0:
+        sys.exit(1)
+    
     # Find all foils
     foil_names = find_all_foils(args.data_folder)
     
@@ -300,8 +616,34 @@ def main():
     print(f'Found {len(foil_names)} foils to process')
     
     # Process each foil
-    for foil_name in foil_names:
-        process_foil(args.data_folder, foil_name)
+    plot_cache = None
+    if not args.no_plot_cache:
+        plot_cache = PlotCache(args.plot_cache or os.path.join(args.data_folder, 'plots', '.cache'),
+                               int(args.plot_cache_size*1024*1024))
+    
+    part2_window = None
+    if args.part2_window:
+        part2_window = (args.part2_window[0]*3600.0, args.part2_window[1]*3600.0)
+    
+    start = time.perf_counter()
+    # Inputs are read from the staged copy, outputs are written to the data folder
+    input_folder = staging_from_args(args).stage_directory(args.data_folder, is_report_input)
+    if args.serial:
+        datasets = prepare_foils(input_folder, foil_names, part2_window)
+        for foil in datasets:
+            process_foil_dataset(args.data_folder, foil, args.sidecar, plot_cache)
+        n_reports = len(datasets)
+        if args.overview and datasets:
+            foils = {}
+            for foil in datasets:
+                foils.setdefault(foil.channel, []).append(foil.foil_name)
+            render_overview(args.data_folder, datasets[0].monitor, foils, input_folder)
+    else:
+        n_reports = process_foils_pipelined(args.data_folder, foil_names, prefetch=args.prefetch,
+                                            part2_window=part2_window, sidecar=args.sidecar,
+                                            plot_cache=plot_cache, input_folder=input_folder,
+                                            overview=args.overview)
+    print(f'Created {n_reports} reports in {time.perf_counter() - start:.1f} s')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
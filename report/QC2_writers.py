@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+QC2 Writers
+Streaming writers for the tab separated QC2 output files (IVplot, QC2LONG_PART2)
+
+All files are written through QC_io.atomic_open, so they appear complete or not at all.
+"""
+import os
+from itertools import islice
+import numpy as np
+from QC_io import atomic_open, atomic_path
+
+CHUNK_ROWS = 65536
+
+def sidecar_path(path):
+    """
+    Path of the binary sidecar belonging to a text output file
+
+    Args:
+        path (str): Path to the .txt output file
+
+    Returns:
+        str: Same path with a .npy extension
+    """
+    return os.path.splitext(path)[0] + '.npy'
+
+def write_columns(path, header_lines, columns, names=None, sidecar=False, chunk_rows=CHUNK_ROWS):
+    """
+    Stream typed column arrays to a tab separated text file
+
+    The rows are formatted chunk by chunk, so memory use does not depend on the
+    number of rows. Every value is printed as the shortest representation of its
+    own dtype (as str() does for a Python float), so pass float64 columns to
+    keep all digits.
+
+    Args:
+        path (str): Path to the output .txt file
+        header_lines (list): Lines written before the data, without newline
+        columns (list): 1-D arrays of equal length, one per column
+        names (list): Column names of the binary sidecar (default: col0, col1, ...)
+        sidecar (bool): Also write the data to a .npy sidecar next to the text file
+        chunk_rows (int): Number of rows formatted at once
+    """
+    columns = [np.asarray(column) for column in columns]
+    n_rows = len(columns[0]) if columns else 0
+
+    with atomic_open(path) as f:
+        for line in header_lines:
+            f.write(line + '\n')
+        for lo in range(0, n_rows, chunk_rows):
+            hi = min(lo + chunk_rows, n_rows)
+            formatted = [column[lo:hi].astype(str) for column in columns]
+            f.write('\n'.join(map('\t'.join, zip(*formatted))) + '\n')
+
+    if sidecar:
+        write_sidecar(path, columns, names, chunk_rows)
+
+def write_sidecar(path, columns, names=None, chunk_rows=CHUNK_ROWS):
+    """
+    Write column arrays to the binary .npy sidecar of a text output file
+
+    Args:
+        path (str): Path to the .txt output file
+        columns (list): 1-D arrays of equal length, one per column
+        names (list): Column names (default: col0, col1, ...)
+        chunk_rows (int): Number of rows copied at once
+    """
+    columns = [np.asarray(column) for column in columns]
+    n_rows = len(columns[0]) if columns else 0
+    names = names or [f'col{k}' for k in range(len(columns))]
+    dtype = np.dtype([(name, column.dtype) for name, column in zip(names, columns)])
+    with atomic_path(sidecar_path(path)) as tmp_path:
+        binary = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(n_rows,))
+        for lo in range(0, n_rows, chunk_rows):
+            hi = min(lo + chunk_rows, n_rows)
+            for name, column in zip(names, columns):
+                binary[name][lo:hi] = column[lo:hi]
+        binary.flush()
+        del binary
+
+def text_rows(path, skiprows, rows, usecols):
+    """
+    Fields of selected data rows of a tab separated file, as written in the file
+
+    Blank lines are not counted as data rows, as in QC_parsers.
+
+    Args:
+        path (str): Path to the file
+        skiprows (int): Number of header lines to skip
+        rows (slice or array): Data rows to return, in output order (e.g. MonitorIndex.file_rows)
+        usecols (tuple): Indices of the fields to return
+
+    Yields:
+        list: Fields (str) of one row
+    """
+    with open(path, newline='') as f:
+        for _ in range(skiprows):
+            f.readline()
+        data = (line.rstrip('\r\n').split('\t') for line in f if line.strip())
+        if isinstance(rows, slice):
+            for fields in islice(data, rows.start, rows.stop):
+                yield [fields[k] for k in usecols]
+            return
+        # Rows out of file order: only the selected rows are kept in memory
+        rows = np.asarray(rows)
+        position = np.full(int(rows.max()) + 1 if len(rows) else 0, -1)
+        position[rows] = np.arange(len(rows))
+        selected = [None] * len(rows)
+        for row, fields in enumerate(islice(data, len(position))):
+            if position[row] >= 0:
+                selected[position[row]] = [fields[k] for k in usecols]
+        yield from selected
+
+def write_iv_points(path, voltage, current, error, sidecar=False):
+    """
+    Write the I-V points of a foil (the _IVplot.txt file)
+
+    Args:
+        path (str): Path to the output .txt file
+        voltage (array): Plateau voltages [V]
+        current (array): Mean currents [nA]
+        error (array): Errors of the mean currents [nA]
+        sidecar (bool): Also write a .npy sidecar
+    """
+    write_columns(path, ['Voltage (V)\tCurrent (nA)\tError_current (nA)'],
+                  [np.asarray(voltage, dtype=np.float64), np.asarray(current, dtype=np.float64),
+                   np.asarray(error, dtype=np.float64)],
+                  names=['voltage', 'current', 'error'], sidecar=sidecar)
+
+def write_part2(path, description_list, time_stamp, monitor_path, channel, rows, columns=None,
+                sidecar=False, chunk_rows=CHUNK_ROWS):
+    """
+    Write the long-term (Part 2) data of a foil (the QC2LONG_PART2 file)
+
+    The values are copied as text from the monitor file, so the file holds
+    exactly the digits the monitor wrote (the parsed arrays may be float32).
+
+    Args:
+        path (str): Path to the output .txt file
+        description_list (list): Description lines of the PART1 file as [key, value] rows
+        time_stamp (str): Time stamp of the all-channels monitor file
+        monitor_path (str): Path to the QC2_all_channels_monitor file
+        channel (int): HV channel number
+        rows (slice or array): Data rows of the monitor file to copy (see MonitorIndex.file_rows)
+        columns (tuple): Parsed (voltage, current, time) of the same rows, for the sidecar
+        sidecar (bool): Also write a .npy sidecar of columns
+        chunk_rows (int): Number of rows written at once
+    """
+    header_lines = []
+    for i in range(len(description_list)-1):
+        header_lines.append(f'{description_list[i][0]}\t{description_list[i][1]}\t\t')
+    header_lines.append(f'Time_stamp:\t{time_stamp}\t\t')
+    header_lines.append('Voltage (V)\tCurrent (uA)\tTime (s)')
+
+    # Monitor columns: time, 8 voltages, 8 currents
+    fields = text_rows(monitor_path, 2, rows, (channel+1, channel+9, 0))
+    with atomic_open(path) as f:
+        for line in header_lines:
+            f.write(line + '\n')
+        while True:
+            chunk = list(islice(fields, chunk_rows))
+            if not chunk:
+                break
+            f.write('\n'.join(map('\t'.join, chunk)) + '\n')
+
+    if sidecar:
+        write_sidecar(path, columns, ['voltage', 'current', 'time'], chunk_rows)
+
+def write_sections(path, header_lines, sections):
+    """
+    Write a results file made of titled, tab separated tables
+
+    Args:
+        path (str): Path to the output .txt file
+        header_lines (list): Lines written at the top of the file, without newline
+        sections (list): (title, column names, rows) tuples, rows being lists of values
+    """
+    with atomic_open(path) as f:
+        for line in header_lines:
+            f.write(line + '\n')
+        for title, columns, rows in sections:
+            f.write(f'\n[{title}]\n')
+            f.write('\t'.join(columns) + '\n')
+            for row in rows:
+                f.write('\t'.join(str(value) for value in row) + '\n')
@@ -1,101 +1,289 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib.style
 from scipy.optimize import curve_fit
 import matplotlib.font_manager as font_manager
 import mplhep as hep
-from fpdf import FPDF
 import argparse
 import os
+from fpdf.enums import XPos, YPos
+from concurrent.futures import ThreadPoolExecutor
+from QC_plotting import new_figure
+from QC_io import atomic_path
+from QC_resources import new_report_pdf
+from QC_parsers import load_file
+from QC_bootstrap import CONFIDENCE_LEVEL, add_bootstrap_arguments, interval, residual_resamples
+from QC_staging import add_staging_arguments, data_root, staging_from_args
 '''
 python3 QC34_report.py -mt M2 -mn 0003 -d3 20230908 -d4 20230908
 '''
 
-plt.style.use(hep.style.CMS)
+matplotlib.style.use(hep.style.CMS)
 
 def func(x, m, t):
     return m*np.exp(-t*x)
 
-def qc3_plot(mt, mn, d3):
-    fig, ax = plt.subplots()
-    fig.set_figheight(9)
-    fig.set_figwidth(10)
-    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab")
-    data = pd.read_excel(r'/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data/QC3_GE21-MODULE-{}-{}_{}.xlsm'.format(mt, mn, d3), engine='openpyxl')
+# Report fonts as (family, file name), looked up by QC_resources in the font directories
+QC34_FONTS = [('FreeSans', 'FreeSans.ttf'), ('FreeSansB', 'FreeSansBold.ttf'), ('FreeSerif', 'FreeSerif.ttf')]
+
+# Start and end [s] of the QC3 time constant fit
+QC3_START = 1.0
+QC3_END = 3600.0
+# Sliding time constant windows [h] and minimum number of samples per window
+TAU_WINDOW = 0.25
+TAU_STEP = 1/60
+TAU_MIN_SAMPLES = 10
+# Windows whose spread in time is below this fraction of their mean square time
+# have no slope (the cumulative sums cannot resolve them, e.g. a single sample)
+TAU_MIN_SPREAD = 1e-8
+
+def time_index(time, t):
+    """
+    Index of the sample closest to t
+
+    Args:
+        time (array): Sorted sample times
+        t (float): Time to look up
+
+    Returns:
+        int: Index of the closest sample (the earlier one on a tie)
+    """
+    i = int(np.searchsorted(time, t))
+    if i == len(time):
+        return len(time) - 1
+    if i > 0 and t - time[i-1] <= time[i] - t:
+        return i - 1
+    return i
+
+def qc3_window(time):
+    """
+    Indices of the first and last sample of the QC3 fit (closest to QC3_START and QC3_END)
+    """
+    return time_index(time, QC3_START), time_index(time, QC3_END)
+
+def sliding_log_fits(time, values, window, step, min_samples=TAU_MIN_SAMPLES):
+    """
+    Straight line fits of log(values) against time over sliding time windows
+
+    The windows [start, start + window] start every step from the first sample.
+    The sums of the least squares fits are differences of cumulative sums, so
+    all windows together take O(n) time, whatever their length and overlap.
+    Sample times may be irregular; non-positive values are skipped.
+
+    Args:
+        time (array): Sorted sample times
+        values (array): Values, e.g. pressure
+        window (float): Window length, in the unit of time
+        step (float): Distance between window starts
+        min_samples (int): Windows with fewer samples (and windows of less than
+            2 samples or a single sample time) give NaN
+
+    Returns:
+        tuple: (window centres, slopes, numbers of samples)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(time) == 0 or time[-1] - time[0] < window:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    valid = values > 0
+    x = np.where(valid, time - time[0], 0.0)  # Relative to the first sample for precision
+    y = np.where(valid, np.log(np.where(valid, values, 1.0)), 0.0)
+    sums = np.zeros((5, len(time) + 1))
+    np.cumsum(np.stack((valid.astype(np.float64), x, y, x*x, x*y)), axis=1, out=sums[:, 1:])
+
+    starts = time[0] + step*np.arange(int((time[-1] - time[0] - window) // step) + 1)
+    lo = np.searchsorted(time, starts, side='left')
+    hi = np.searchsorted(time, starts + window, side='right')
+    n, sx, sy, sxx, sxy = sums[:, hi] - sums[:, lo]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = n*sxx - sx*sx
+        fit = (n >= max(min_samples, 2)) & (denominator > TAU_MIN_SPREAD*n*sxx)
+        slopes = np.where(fit, (n*sxy - sx*sy) / denominator, np.nan)
+    return starts + window/2, slopes, n.astype(np.int64)
+
+def windowed_means(time, values, centres, window):
+    """
+    Means of values over the windows [centre - window/2, centre + window/2] (cumulative sums)
+    """
+    sums = np.concatenate(([0.0], np.cumsum(np.asarray(values, dtype=np.float64))))
+    lo = np.searchsorted(time, centres - window/2, side='left')
+    hi = np.searchsorted(time, centres + window/2, side='right')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (sums[hi] - sums[lo]) / (hi - lo)
+
+def qc3_file(mt, mn, d3):
+    return 'QC3_GE21-MODULE-{}-{}_{}.xlsm'.format(mt, mn, d3)
+
+def qc4_file(mt, mn, d4):
+    return 'QC4_GE21-MODULE-{}-{}_{}.txt'.format(mt, mn, d4)
+
+def read_qc3(path):
+    return pd.read_excel(path, engine='openpyxl')
+
+def read_qc4(path):
+    return dict(zip(('Vmon', 'Imon'), load_file(path, 'qc4')))
+
+def qc3_tau_bootstrap(time_hr, pressure, tau, n_resamples, seed=None):
+    """
+    Bootstrap confidence interval of the QC3 time constant
+
+    The residuals of a straight line fit of log(pressure) against time are
+    resampled and all resampled fits are evaluated at once; their spread around
+    the straight line fit is applied to the time constant of the exponential fit.
+
+    Args:
+        time_hr (array): Time [h] of the fitted samples
+        pressure (array): Pressure [mbar] of the fitted samples
+        tau (float): Time constant [h] of the exponential fit
+        n_resamples (int): Number of resamples
+        seed (int): Random seed
+
+    Returns:
+        ndarray: (2,) lower and upper bound of the time constant [h]
+    """
+    positive = pressure > 0
+    rng = np.random.default_rng(seed)
+    (slope, intercept), slopes, intercepts = residual_resamples(time_hr[positive], np.log(pressure[positive]),
+                                                                n_resamples, rng)
+    return interval(tau, -1/slopes, -1/slope)
+
+def qc3_plot(mt, mn, d3, data, n_resamples=0, seed=None):
+    fig, ax = new_figure(10, 9)
+    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", ax=ax)
     time = np.array(data['Seconds'].tolist())
     time_hr = time/3600
     pressure = np.around(np.array(data['Pressure (mBar)'].tolist()), 2)
     temperature = data['Temperature (C)'].tolist()[0]
     atm = data['Atm Pressure (mBar)'].tolist()[0]
-    t0 = int(np.where(time == 1.00)[0])
-    t1 = int(np.where(time == 3600.00)[0])
+    t0, t1 = qc3_window(time)
     p0 = (26, 0.001)
     popt, pcov = curve_fit(func, time_hr[t0+5:t1], pressure[t0+5:t1])
     a, b = popt
     ymin = pressure[t1]-2.0
     ymax = pressure[t0]+2.0
-    plt.ylim([ymin, ymax])
-    plt.plot(time_hr[:t1+1], pressure[:t1+1], 'ok', markersize=2, label='GE21-MODULE-{}-{}'.format(mt, mn))
-    plt.plot(time_hr[:t1+1], func(time_hr[:t1+1], *popt), 'b-', linewidth=1.5, label=r'$P(t) = [p0]e^{-t/\tau}$')
+    ax.set_ylim([ymin, ymax])
+    ax.plot(time_hr[:t1+1], pressure[:t1+1], 'ok', markersize=2, label='GE21-MODULE-{}-{}'.format(mt, mn))
+    ax.plot(time_hr[:t1+1], func(time_hr[:t1+1], *popt), 'b-', linewidth=1.5, label=r'$P(t) = [p0]e^{-t/\tau}$')
     t = 1/b
-    plt.text(0.6, ymax-(ymax-ymin)/4-(ymax-ymin)/20, 'p0              %.2f mbar' % a, fontsize = 20, color='b')
-    plt.text(0.6, ymax-(ymax-ymin)/4-(ymax-ymin)*30/(20*14), r'$\tau$                %.2f h' % t, fontsize = 20, color='b', fontweight='bold')
-    plt.text(0, ymin+(ymax-ymin)/60+(ymax-ymin)*30/(20*13), 'GE2/1 Module Production', fontsize=20) 
-    plt.text(0, ymin+(ymax-ymin)/60+(ymax-ymin)/20, 'Gas = $CO_{2}$', fontsize=20) 
+    ax.text(0.6, ymax-(ymax-ymin)/4-(ymax-ymin)/20, 'p0              %.2f mbar' % a, fontsize = 20, color='b')
+    ax.text(0.6, ymax-(ymax-ymin)/4-(ymax-ymin)*30/(20*14), r'$\tau$                %.2f h' % t, fontsize = 20, color='b', fontweight='bold')
+    tau_interval = None
+    if n_resamples > 0:
+        tau_interval = qc3_tau_bootstrap(time_hr[t0+5:t1], pressure[t0+5:t1], t, n_resamples, seed)
+        ax.text(0.6, ymax-(ymax-ymin)/4-(ymax-ymin)*(60/(20*14)-1/20), '%d%% CI    [%.2f, %.2f] h'
+                % (round(100*CONFIDENCE_LEVEL), *tau_interval), fontsize = 20, color='b')
+    ax.text(0, ymin+(ymax-ymin)/60+(ymax-ymin)*30/(20*13), 'GE2/1 Module Production', fontsize=20) 
+    ax.text(0, ymin+(ymax-ymin)/60+(ymax-ymin)/20, 'Gas = $CO_{2}$', fontsize=20) 
     lg = font_manager.FontProperties(#weight='bold',
                                      style='normal', size=20)
-    plt.xlabel('Time [h]')
-    plt.ylabel('Pressure [mbar]')
-    legend = plt.legend(loc='upper right', prop=lg)
-    plt.savefig('./plot/QC3_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d3), dpi=50)
-    plt.clf()
-    return b
-
-def qc4_plot(mt, mn, d4):
-    fig, ax = plt.subplots()
-    fig.set_figheight(9)
-    fig.set_figwidth(10)
-    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab")
+    ax.set_xlabel('Time [h]')
+    ax.set_ylabel('Pressure [mbar]')
+    legend = ax.legend(loc='upper right', prop=lg)
+    with atomic_path('./plot/QC3_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d3)) as tmp_path:
+        fig.savefig(tmp_path, dpi=50)
+    return b, tau_interval
+
+def qc3_tau_plot(mt, mn, d3, data, tau, tau_interval=None, window=TAU_WINDOW, step=TAU_STEP):
+    """
+    Plot the time constant of sliding windows over the full QC3 series
+
+    Args:
+        mt (str): Module type
+        mn (str): Module number
+        d3 (str): QC3 test date (YYYYMMDD)
+        data (DataFrame): QC3 data
+        tau (float): Time constant [h] of the QC3 fit
+        tau_interval (array): Confidence interval [h] of tau, None if not computed
+        window (float): Window length [h]
+        step (float): Distance between windows [h]
+
+    Returns:
+        str: Path to the plot
+    """
+    time_hr = np.array(data['Seconds'].tolist())/3600
+    pressure = np.around(np.array(data['Pressure (mBar)'].tolist()), 2)
+    order = np.argsort(time_hr, kind='stable')
+    time_hr, pressure = time_hr[order], pressure[order]
+    centres, slopes, n = sliding_log_fits(time_hr, pressure, window, step)
+    with np.errstate(divide='ignore'):
+        taus = -1/slopes
+
+    fig, ax = new_figure(10, 6)
+    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", ax=ax)
+    ax.plot(centres, taus, 'b-', linewidth=1.5, label=r'$\tau$ of %g min windows' % round(window*60, 1))
+    ax.axhline(tau, color='k', linestyle='--', linewidth=1, label=r'$\tau$ of the 1 h fit')
+    if tau_interval is not None:
+        ax.axhspan(*tau_interval, color='k', alpha=0.1, linewidth=0)
+    finite = taus[np.isfinite(taus)]
+    if len(finite):
+        # Robust limits, so that windows dominated by noise do not flatten the plot
+        low, high = np.percentile(finite, [2, 98])
+        margin = 0.2*max(high - low, 0.05*abs(tau))
+        ax.set_ylim(min(low, tau) - margin, max(high, tau) + margin)
+    ax.set_xlabel('Time [h]')
+    ax.set_ylabel(r'$\tau$ [h]')
+    temperature = np.array(data['Temperature (C)'].tolist(), dtype=np.float64)[order]
+    if len(centres) and np.ptp(temperature) > 0:
+        ax2 = ax.twinx()
+        ax2.plot(centres, windowed_means(time_hr, temperature, centres, window), 'r-', linewidth=1, alpha=0.7)
+        ax2.set_ylabel('Temperature [C]', color='r')
+    ax.legend(loc='best', prop=font_manager.FontProperties(style='normal', size=16))
+    path = './plot/QC3_tau_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d3)
+    with atomic_path(path) as tmp_path:
+        fig.savefig(tmp_path, dpi=50, bbox_inches='tight')
+    return path
+
+def qc4_plot(mt, mn, d4, dt):
+    fig, ax = new_figure(10, 9)
+    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", ax=ax)
     
-    dt = pd.read_csv('/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data/QC4_GE21-MODULE-{}-{}_{}.txt'.format(mt, mn, d4), sep="\t", skiprows=[0, 1, 2, 3, 4, 5, 7])
     voltage = (np.array(dt['Vmon'])/1000).tolist()
     current = np.array(dt['Imon']).tolist()
     coeff = np.polyfit(current[:-2], voltage[:-2], 1)
     r_m = 1000*coeff[0]
     poly1d_fn = np.poly1d(coeff)
-    plt.plot(current, voltage, 'ok', label='GE21-MODULE-{}-{}'.format(mt, mn))
-    plt.plot(current, poly1d_fn(current), '-r', label='Fit')
-    plt.text(50, 4.7, 'GE2/1 Module Production', fontsize=20) #, fontproperties=font)
-    plt.text(50, 4.33, 'Gas = $CO_{2}$', fontsize=20) #, fontproperties=font)
-    plt.text(50, 3.96, '$R_{n}$ = 5.0 $M\Omega$' % r_m, fontsize=20) #, fontproperties=font)
-    plt.text(50, 3.59, '$R_{m}$ = %.3f $M\Omega$' % r_m, fontsize=20) #, fontproperties=font)
+    ax.plot(current, voltage, 'ok', label='GE21-MODULE-{}-{}'.format(mt, mn))
+    ax.plot(current, poly1d_fn(current), '-r', label='Fit')
+    ax.text(50, 4.7, 'GE2/1 Module Production', fontsize=20) #, fontproperties=font)
+    ax.text(50, 4.33, 'Gas = $CO_{2}$', fontsize=20) #, fontproperties=font)
+    ax.text(50, 3.96, '$R_{n}$ = 5.0 $M\Omega$' % r_m, fontsize=20) #, fontproperties=font)
+    ax.text(50, 3.59, '$R_{m}$ = %.3f $M\Omega$' % r_m, fontsize=20) #, fontproperties=font)
     lg = font_manager.FontProperties(#weight='bold',
                                      style='normal', size=20)
-    plt.xticks([200, 400, 600, 800, 1000])
-    plt.xlabel('Divider Current $I_{divider} \ [\mu$A]')
-    plt.ylabel('Applied Voltage V [kV]')
-    plt.legend(loc='lower right', prop=lg)
-    plt.savefig('./plot/QC4_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d4), dpi=50)
+    ax.set_xticks([200, 400, 600, 800, 1000])
+    ax.set_xlabel('Divider Current $I_{divider} \ [\mu$A]')
+    ax.set_ylabel('Applied Voltage V [kV]')
+    ax.legend(loc='lower right', prop=lg)
+    with atomic_path('./plot/QC4_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d4)) as tmp_path:
+        fig.savefig(tmp_path, dpi=50)
     return r_m
 
-def qc34_report(mt, mn, d3, d4, b, r_m):
-    data = pd.read_excel(r'/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data/QC3_GE21-MODULE-{}-{}_{}.xlsm'.format(mt, mn, d3), engine='openpyxl')
+def add_qc34_pages(pdf, mt, mn, d3, d4, data, b, r_m, tau_interval=None, tau_plot=None,
+                   tau_window=TAU_WINDOW, tau_step=TAU_STEP):
+    """
+    Draw the QC3 and QC4 results, starting on the current (empty) page of a report
+
+    Args:
+        pdf (FPDF): Report created with new_report_pdf and the QC34_FONTS
+        mt (str): Module type
+        mn (str): Module number
+        d3 (str): QC3 test date (YYYYMMDD)
+        d4 (str): QC4 test date (YYYYMMDD)
+        data (DataFrame): QC3 data
+        b (float): Inverse time constant [1/h] of the QC3 fit
+        r_m (float): Measured divider resistance [MOhm]
+        tau_interval (array): Confidence interval [h] of the time constant, None if not computed
+        tau_plot (str): Path to the sliding time constant plot, None to leave out its page
+        tau_window (float): Sliding window length [h]
+        tau_step (float): Distance between the sliding windows [h]
+    """
     pressure = np.around(np.array(data['Pressure (mBar)'].tolist()), 2)
     temperature = data['Temperature (C)'].tolist()[0]
     atm = data['Atm Pressure (mBar)'].tolist()[0]
     time = np.array(data['Seconds'].tolist())
     time_hr = time/3600
-    t0 = int(np.where(time == 1.00)[0])
-    t1 = int(np.where(time == 3600.00)[0])
+    t0, t1 = qc3_window(time)
     t = 1/b
-    dt = pd.read_csv('/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data/QC4_GE21-MODULE-{}-{}_{}.txt'.format(mt, mn, d4), sep="\t", skiprows=[0, 1, 2, 3, 4, 5, 7])
-    # Generate PDF file
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(True, margin = 1.0)
-    pdf.add_font('FreeSans', '', '/afs/cern.ch/user/s/seulgi/private/Work/GEM/QC/report_qc3qc4/font/freesans/FreeSans.ttf', uni=True)
-    pdf.add_font('FreeSansB', '', '/afs/cern.ch/user/s/seulgi/private/Work/GEM/QC/report_qc3qc4/font/freesans/FreeSansBold.ttf', uni=True)
-    pdf.add_font('FreeSerif', '', '/afs/cern.ch/user/s/seulgi/private/Work/GEM/QC/report_qc3qc4/font/freeserif/FreeSerif.ttf', uni=True)
     
     omega = str('\u03A9')
     print(omega)
@@ -129,11 +317,17 @@ def qc34_report(mt, mn, d3, d4, b, r_m):
     pdf.cell(70, 12, 'Time constant (hr)')
     pdf.set_font('FreeSans', '', 10)
     pdf.cell(30, 12, '%.2f' % t, ln=1, align='R')
+    if tau_interval is not None:
+        pdf.set_font('FreeSansB', '', 10)
+        pdf.cell(85)
+        pdf.cell(70, 12, 'Time constant {}% CI (hr)'.format(round(100*CONFIDENCE_LEVEL)))
+        pdf.set_font('FreeSans', '', 10)
+        pdf.cell(30, 12, '%.2f - %.2f' % tuple(tau_interval), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R')
     
     
-    pdf.ln(7)
+    # Keep the QC4 section at the same height with and without the CI row
     pdf.set_font('FreeSansB', '', 15)
-    pdf.cell(100, 20, '', ln=1)
+    pdf.cell(100, 15 if tau_interval is not None else 27, '', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.image('./plot/QC4_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d4), x=0, y=150, w=100)
     pdf.cell(100, 20, 'QC4 Result', ln=1)
     pdf.set_font('FreeSansB', '', 10)
@@ -161,22 +355,60 @@ def qc34_report(mt, mn, d3, d4, b, r_m):
     pdf.set_font('FreeSans', '', 10)
     pdf.cell(30, 12, '%.2f' % (100*(5.0-r_m)/5.0), ln=1, align='R')
     
-    pdf.output('./pdf/QC34_report_GE21-MODULE-{}-{}.pdf'.format(mt, mn))
+    if tau_plot is not None:
+        pdf.add_page()
+        pdf.set_font('FreeSansB', '', 15)
+        pdf.cell(100, 20, 'QC3 Time Constant Stability', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.image(tau_plot, x=10, w=150)
+        pdf.set_font('FreeSans', '', 10)
+        pdf.multi_cell(0, 6, 'Time constant of log-linear fits of the pressure over sliding {:g} min windows, '
+                             'every {:g} min, over the full QC3 series. The dashed line is the time constant '
+                             'of the 1 h fit.'.format(round(tau_window*60, 1), round(tau_step*60, 1)))
+
+def qc34_report(mt, mn, d3, d4, data, b, r_m, font_dirs=None, tau_interval=None, tau_plot=None,
+                tau_window=TAU_WINDOW, tau_step=TAU_STEP):
+    # Generate PDF file
+    pdf = new_report_pdf(QC34_FONTS, font_dirs)
+    add_qc34_pages(pdf, mt, mn, d3, d4, data, b, r_m, tau_interval, tau_plot, tau_window, tau_step)
+    with atomic_path('./pdf/QC34_report_GE21-MODULE-{}-{}.pdf'.format(mt, mn)) as tmp_path:
+        pdf.output(tmp_path)
     
 
 
 if __name__=="__main__":
-    plt.style.use(hep.style.CMS)
     parser = argparse.ArgumentParser()
     parser.add_argument("-mt", "--module_type", dest="module_type", help="module type")
     parser.add_argument("-mn", "--module_number", dest="module_number", help="module number")
     parser.add_argument("-d3", "--qc3_date", dest="qc3_date", help="qc3 test date (YYYYMMDD)")
     parser.add_argument("-d4", "--qc4_date", dest="qc4_date", help="qc4 test date (YYYYMMDD)")
+    parser.add_argument("--font-dir", dest="font_dirs", action="append", help="directory with the FreeSans/FreeSerif fonts (can be repeated)")
+    add_staging_arguments(parser, data_root_option=True)
+    parser.add_argument("--tau-window", dest="tau_window", type=float, default=TAU_WINDOW*60, help="length of the sliding time constant windows in minutes (default: %(default)g)")
+    parser.add_argument("--tau-step", dest="tau_step", type=float, default=TAU_STEP*60, help="distance between the sliding windows in minutes (default: %(default)g)")
+    add_bootstrap_arguments(parser)
     args = parser.parse_args()
     print(args.module_type, args.module_number, args.qc3_date, args.qc4_date)
 
+    # Both input files are staged in parallel and read once
+    root = data_root(args.data_root)
+    qc3_path = os.path.join(root, qc3_file(args.module_type, args.module_number, args.qc3_date))
+    qc4_path = os.path.join(root, qc4_file(args.module_type, args.module_number, args.qc4_date))
+    staged = staging_from_args(args).prefetch([qc3_path, qc4_path])
+    data = read_qc3(staged[qc3_path])
+    dt = read_qc4(staged[qc4_path])
+
     os.makedirs('./plot', exist_ok=True)
-    b = qc3_plot(args.module_type, args.module_number, args.qc3_date)
-    r_m = qc4_plot(args.module_type, args.module_number, args.qc4_date)
-    qc34_report(args.module_type, args.module_number, args.qc3_date, args.qc4_date, b, r_m)
+    tau_window, tau_step = args.tau_window/60, args.tau_step/60
+    # The QC3 and QC4 plots use independent figures and are rendered concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        qc3 = executor.submit(qc3_plot, args.module_type, args.module_number, args.qc3_date, data,
+                              args.resamples, args.seed)
+        qc4 = executor.submit(qc4_plot, args.module_type, args.module_number, args.qc4_date, dt)
+        b, tau_interval = qc3.result()
+        qc3_tau = executor.submit(qc3_tau_plot, args.module_type, args.module_number, args.qc3_date, data,
+                                  1/b, tau_interval, tau_window, tau_step)
+        r_m = qc4.result()
+        tau_plot = qc3_tau.result()
+    qc34_report(args.module_type, args.module_number, args.qc3_date, args.qc4_date, data, b, r_m, args.font_dirs,
+                tau_interval, tau_plot, tau_window, tau_step)
 
@@ -1,12 +1,14 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
 import matplotlib.font_manager as font_manager
 import mplhep as hep
-from fpdf import FPDF
 import argparse
 import os
+from QC_plotting import new_figure
+from QC_io import atomic_path
+from QC_bootstrap import CONFIDENCE_LEVEL, add_bootstrap_arguments, column_mean_resamples, interval, linear_fits, poisson_resamples
+from QC_parsers import load_file
+from QC_staging import add_staging_arguments, data_root, staging_from_args
 
 def func(x, a, b):
     return a*np.exp(b*np.array(x))
@@ -16,36 +18,77 @@ def gain(rate, current):
     e = -1.6e-19
     return current / (primary_electron * e * rate)     
 
-def qc5_eff_rate(mt, mn, d51):
+def qc5_rate_file(mt, mn, d51):
+    return 'QC5_GE21-MODULE-{}-{}_{}.txt'.format(mt, mn, d51)
+
+def qc5_current_file(mt, mn, d51):
+    return 'QC5_GE21-MODULE-{}-{}_{}_currents_OFF_ON.txt'.format(mt, mn, d51)
+
+def qc5_eff_rate(rate_columns):
     # Rate
-    dr = pd.read_csv('/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data/QC5_GE21-MODULE-{}-{}_{}.txt'.format(mt, mn, d51), sep="\t", skiprows=[1, 2])
-    imon = dr.iloc[:, 1].tolist()
-    count_off = dr.iloc[:, 5].tolist()
-    count_on = dr.iloc[:, 7].tolist()
+    imon, count_off, count_on = (column.tolist() for column in rate_columns)
     rates = []
     for i in range(len(count_on)):
         rate = (count_on[i] - count_off[i]) / 10
         rates.append(rate)
     return imon, rates
 
-def qc5_eff_gain(mt, mn, d51, rate_measurement):
+def qc5_eff_gain(current_columns, rate_measurement):
     imon, rates = rate_measurement
     # Current
-    dc = pd.read_csv('/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data/QC5_GE21-MODULE-{}-{}_{}_currents_OFF_ON.txt'.format(mt, mn, d51), sep="\t", header=None)
+    dc = current_columns
     im = np.where(np.array(imon) == 720)[0][0]
     r = rates[im]
     currents = []
     for im_ in range(len(imon)):
-        current = np.mean(np.array(dc.iloc[:, im_])) - np.mean(np.array(dc.iloc[:, im_+len(imon)]))
+        current = np.mean(dc[im_]) - np.mean(dc[im_+len(imon)])
         currents.append(current) 
     gains = [gain(r, currents[i]) for i in range(len(imon))]
     return gains
 
-def qc5_eff_plot(mt, mn, d51, rate_measurement, gain_measurement):
-    fig, ax1 = plt.subplots()
-    fig.set_figheight(9)
-    fig.set_figwidth(10)
-    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab")
+def qc5_gain_bootstrap(rate_columns, current_columns, gain_measurement, n_resamples, seed=None):
+    """
+    Bootstrap confidence intervals of the rates, gains and gain slope
+
+    The source on/off counts are resampled as Poisson counts and the repeated
+    current readings of every Imon setting are resampled independently. The
+    gains of all resamples are computed at once from the resampled rate at
+    720 uA and currents, and the exponential slope from batched straight line
+    fits of log(gain) against Imon.
+
+    Args:
+        rate_columns (tuple): Imon, counts source off, counts source on (load_file 'qc5_rate')
+        current_columns (tuple): Current readings, source on columns then source off columns
+        gain_measurement (list): Gains from qc5_eff_gain
+        n_resamples (int): Number of resamples
+        seed (int): Random seed
+
+    Returns:
+        dict: (2, n) intervals 'rate' and 'gain', the (2,) deviation 'slope' of the
+              exponential slope and the (2, n) deviation 'log_fit' of log(fitted gain)
+    """
+    rng = np.random.default_rng(seed)
+    imon, count_off, count_on = rate_columns
+    n = len(imon)
+    rates = (poisson_resamples(count_on, n_resamples, rng) - poisson_resamples(count_off, n_resamples, rng)) / 10
+    im = np.where(imon == 720)[0][0]
+    means = column_mean_resamples(np.column_stack(current_columns[:2*n]), n_resamples, rng)
+    gains = gain(rates[:, [im]], means[:, :n] - means[:, n:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_gains = np.where(gains > 0, np.log(gains), np.nan)
+    slopes, intercepts = linear_fits(imon, log_gains)
+    slope, intercept = np.polyfit(imon, np.log(gain_measurement), 1)
+    log_fits = intercepts[:, None] + slopes[:, None]*imon
+    return {
+        'rate': interval((count_on - count_off) / 10, rates),
+        'gain': interval(gain_measurement, gains),
+        'slope': interval(0.0, slopes, slope),
+        'log_fit': interval(np.zeros(n), log_fits, intercept + slope*imon),
+    }
+
+def qc5_eff_plot(mt, mn, d51, rate_measurement, gain_measurement, intervals=None):
+    fig, ax1 = new_figure(10, 9)
+    hep.cms.label(llabel="Preliminary", rlabel="CERN 904 Lab", ax=ax1)
    
     imon, rates = rate_measurement
     gains = gain_measurement
@@ -54,20 +97,53 @@ def qc5_eff_plot(mt, mn, d51, rate_measurement, gain_measurement):
     ax1.set_yscale("log")
     ax1.set_xlabel('Imon')
     ax1.set_ylabel('Effective Gain')
-    ax1.plot(imon, gains, 'ok', color='red')
-    ax1.plot(imon, func(imon, *popt), 'b-', linewidth=1.5, label=r'$P(t) = [p0]e^{-t/\tau}$')
+    fit = func(imon, *popt)
     ax2 = ax1.twinx()
     ax2.set_ylabel('Rate [Hz]')
-    ax2.plot(imon, rates, 'ok', color='blue')
-    plt.show()
-    #voltage = (np.array(dr['Vmon'])).tolist() 
+    if intervals is None:
+        ax1.plot(imon, gains, 'ok', color='red')
+        ax2.plot(imon, rates, 'ok', color='blue')
+    else:
+        # Asymmetric error bars and fit band of the bootstrap confidence intervals
+        ax1.errorbar(imon, gains, yerr=np.abs(intervals['gain'] - gains), fmt='o', color='red')
+        ax2.errorbar(imon, rates, yerr=np.abs(intervals['rate'] - rates), fmt='o', color='blue')
+        ax1.fill_between(imon, fit*np.exp(intervals['log_fit'][0]), fit*np.exp(intervals['log_fit'][1]),
+                         color='b', alpha=0.2, linewidth=0)
+        im = imon.index(720)
+        low, high = intervals['gain'][:, im]
+        slope_low, slope_high = popt[1] + intervals['slope']
+        ax1.text(0.05, 0.92, 'Gain at 720 $\\mu$A: %.4g [%.4g, %.4g]' % (gains[im], low, high),
+                 transform=ax1.transAxes, fontsize=16)
+        ax1.text(0.05, 0.86, 'Slope: %.4g [%.4g, %.4g] /$\\mu$A' % (popt[1], slope_low, slope_high),
+                 transform=ax1.transAxes, fontsize=16)
+        ax1.text(0.05, 0.80, '%d%% bootstrap CI' % round(100*CONFIDENCE_LEVEL), transform=ax1.transAxes, fontsize=16)
+        print('Gain at 720 uA: %.4g [%.4g, %.4g], slope %.5f [%.5f, %.5f] (%d%% CI)'
+              % (gains[im], low, high, popt[1], slope_low, slope_high, round(100*CONFIDENCE_LEVEL)))
+    ax1.plot(imon, fit, 'b-', linewidth=1.5, label=r'$P(t) = [p0]e^{-t/\tau}$')
+    os.makedirs('./plot', exist_ok=True)
+    path = './plot/QC5_GE21-MODULE-{}-{}_{}.png'.format(mt, mn, d51)
+    with atomic_path(path) as tmp_path:
+        fig.savefig(tmp_path, dpi=50)
+    return path, popt
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-mt", "--module_type", dest="module_type", help="module type")
     parser.add_argument("-mn", "--module_number", dest="module_number", help="module number")
     parser.add_argument("-d5", "--qc5_date", dest="qc5_date", help="qc5 test date (YYYYMMDD)")
+    add_staging_arguments(parser, data_root_option=True)
+    add_bootstrap_arguments(parser)
     args = parser.parse_args()
-    a = qc5_eff_rate(args.module_type, args.module_number, args.qc5_date)
-    b = qc5_eff_gain(args.module_type, args.module_number, args.qc5_date, a)
-    qc5_eff_plot(args.module_type, args.module_number, args.qc5_date, a, b)
+    # Both input files are staged in parallel before they are read
+    root = data_root(args.data_root)
+    rate_path = os.path.join(root, qc5_rate_file(args.module_type, args.module_number, args.qc5_date))
+    current_path = os.path.join(root, qc5_current_file(args.module_type, args.module_number, args.qc5_date))
+    staged = staging_from_args(args).prefetch([rate_path, current_path])
+    rate_columns = load_file(staged[rate_path], 'qc5_rate')
+    current_columns = load_file(staged[current_path], 'qc5_currents')
+    a = qc5_eff_rate(rate_columns)
+    b = qc5_eff_gain(current_columns, a)
+    intervals = None
+    if args.resamples > 0:
+        intervals = qc5_gain_bootstrap(rate_columns, current_columns, b, args.resamples, args.seed)
+    qc5_eff_plot(args.module_type, args.module_number, args.qc5_date, a, b, intervals)
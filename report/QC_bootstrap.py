@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+QC Bootstrap
+Vectorized bootstrap confidence intervals for the QC3 and QC5 results
+
+All resamples are drawn at once as 2-D arrays (one row per resample) and the
+statistics are evaluated with batched NumPy operations, so thousands of
+resamples take a fraction of a second. Large resampling arrays are processed
+in chunks of resamples to bound the memory use.
+
+Intervals are percentile intervals of the bootstrap deviations: the spread of a
+resampled statistic around its value on the original data is applied to the
+reported estimate. For statistics computed the same way on the resamples (means,
+rates, gains) this is the plain percentile interval; for fits it allows a cheap
+linear fit on the resamples while the report keeps its non-linear fit value.
+"""
+import numpy as np
+
+DEFAULT_RESAMPLES = 2000
+CONFIDENCE_LEVEL = 0.95
+DEFAULT_SEED = 0  # Fixed, so that regenerated reports show the same intervals
+MAX_CHUNK_ELEMENTS = 1 << 22  # Resampled values held in memory at a time
+
+def add_bootstrap_arguments(parser):
+    """
+    Add the bootstrap options to an argument parser
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+    """
+    parser.add_argument('--resamples', type=int, default=DEFAULT_RESAMPLES,
+                        help=f'number of bootstrap resamples for the confidence intervals, 0 to disable (default: {DEFAULT_RESAMPLES})')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help=f'random seed of the bootstrap (default: {DEFAULT_SEED})')
+
+def interval(estimate, replicates, reference=None, confidence=CONFIDENCE_LEVEL):
+    """
+    Confidence interval from bootstrap replicates
+
+    Args:
+        estimate (array): Reported value(s) of the statistic
+        replicates (array): Statistic on the resamples, resamples along axis 0
+        reference (array): Statistic on the original data computed like the
+            replicates (default: estimate)
+        confidence (float): Confidence level
+
+    Returns:
+        ndarray: (2, ...) lower and upper bounds; replicates that are not finite are ignored
+    """
+    estimate = np.asarray(estimate, dtype=np.float64)
+    reference = estimate if reference is None else np.asarray(reference, dtype=np.float64)
+    deviations = np.where(np.isfinite(replicates), replicates - reference, np.nan)
+    alpha = (1 - confidence) / 2
+    return estimate + np.nanquantile(deviations, [alpha, 1 - alpha], axis=0)
+
+def poisson_resamples(counts, n_resamples, rng):
+    """
+    Parametric resamples of Poisson distributed counts
+
+    Args:
+        counts (array): Measured counts
+        n_resamples (int): Number of resamples
+        rng (np.random.Generator): Random number generator
+
+    Returns:
+        ndarray: (n_resamples, len(counts)) resampled counts
+    """
+    counts = np.clip(np.asarray(counts, dtype=np.float64), 0, None)
+    return rng.poisson(counts, size=(n_resamples, len(counts))).astype(np.float64)
+
+def column_mean_resamples(table, n_resamples, rng):
+    """
+    Bootstrap means of every column of a table, each column resampled independently
+
+    Args:
+        table (array): (n_rows, n_columns) repeated measurements, one quantity per column
+        n_resamples (int): Number of resamples
+        rng (np.random.Generator): Random number generator
+
+    Returns:
+        ndarray: (n_resamples, n_columns) resampled column means
+    """
+    table = np.asarray(table, dtype=np.float64)
+    n_rows, n_columns = table.shape
+    means = np.empty((n_resamples, n_columns))
+    columns = np.arange(n_columns)
+    chunk = max(1, MAX_CHUNK_ELEMENTS // max(1, n_rows * n_columns))
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+        rows = rng.integers(0, n_rows, size=(size, n_rows, n_columns))
+        means[start:start+size] = table[rows, columns].mean(axis=1)
+    return means
+
+def linear_fits(x, y):
+    """
+    Least squares straight lines through many series at once (batched np.polyfit)
+
+    Args:
+        x (array): (n,) abscissa shared by all series
+        y (array): (n_series, n) ordinates
+
+    Returns:
+        tuple: (slopes, intercepts), one per series; NaN for series with non-finite values
+    """
+    y = np.asarray(y, dtype=np.float64)
+    slopes = np.full(len(y), np.nan)
+    intercepts = np.full(len(y), np.nan)
+    valid = np.all(np.isfinite(y), axis=1)
+    if valid.any():
+        slopes[valid], intercepts[valid] = np.polyfit(x, y[valid].T, 1)
+    return slopes, intercepts
+
+def residual_resamples(x, y, n_resamples, rng):
+    """
+    Residual bootstrap of a straight line fit with a fixed abscissa
+
+    The residuals of the fit on the original data are resampled and added back
+    to the fitted line. The fit is linear in y, so the resampled slopes and
+    intercepts are computed directly from the resampled residuals.
+
+    Args:
+        x (array): (n,) abscissa
+        y (array): (n,) ordinate
+        n_resamples (int): Number of resamples
+        rng (np.random.Generator): Random number generator
+
+    Returns:
+        tuple: (slope, intercept) of the original fit and (n_resamples,) arrays of
+               resampled slopes and intercepts
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    slope, intercept = np.polyfit(x, y, 1)
+    residuals = y - (slope*x + intercept)
+    xc = x - x.mean()
+    weights = xc / np.dot(xc, xc)
+    slopes = np.empty(n_resamples)
+    intercepts = np.empty(n_resamples)
+    chunk = max(1, MAX_CHUNK_ELEMENTS // max(1, len(x)))
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+        resampled = residuals[rng.integers(0, len(x), size=(size, len(x)))]
+        delta_slope = resampled @ weights
+        slopes[start:start+size] = slope + delta_slope
+        intercepts[start:start+size] = intercept + resampled.mean(axis=1) - delta_slope*x.mean()
+    return (slope, intercept), slopes, intercepts
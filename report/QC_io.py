@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+QC IO
+Safe output helpers for data directories shared by several operators or workers
+
+Outputs are written to a hidden temporary file next to their destination and
+renamed into place once complete, so a reader never sees a half-written file and
+two concurrent writers never interleave: the last complete file wins. Runs that
+produce the outputs of the same foil are serialized with advisory locks.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, outputs are then only written atomically
+    fcntl = None
+
+LOCK_DIR = '.locks'
+
+# The process umask, applied to the temporary files (mkstemp always creates them with mode 0600)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+@contextmanager
+def atomic_path(path):
+    """
+    Temporary path that replaces path when the block completes
+
+    The temporary file is created in the destination directory (a rename is only
+    atomic within one filesystem) and keeps the extension of path, so writers that
+    pick the format from the file name (savefig, open_memmap) work unchanged. If the
+    block raises, the temporary file is removed and path is left untouched.
+
+    Args:
+        path (str): Destination path
+
+    Yields:
+        str: Path of the temporary file to write to
+    """
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=f'.{stem}.', suffix=ext)
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+@contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    """
+    Open a file for writing through atomic_path
+
+    Args:
+        path (str): Destination path
+        mode (str): File mode ('w' or 'wb')
+        **kwargs: Passed on to open (e.g. newline)
+
+    Yields:
+        file: File object writing to the temporary file
+    """
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+
+class FoilLock:
+    """
+    Advisory lock serializing the runs that write the outputs of one foil
+
+    The lock is an flock on <data_folder>/.locks/<foil_name>.lock and is released
+    automatically if the process dies. It can be acquired in one thread and
+    released in another. On filesystems without lock support (and on Windows)
+    a warning is printed and the run continues unlocked.
+
+    The lock is not reentrant: every acquire opens a new file and waits for all
+    other holders, including the same process. A step that already holds the
+    lock of a foil must call the nested steps unlocked (as run_foil_job in
+    QC2_campaign.py does with lock=False), otherwise it waits for itself.
+    Acquiring a FoilLock object twice raises a RuntimeError.
+    """
+
+    def __init__(self, data_folder, foil_name):
+        """
+        Args:
+            data_folder (str): Path to the data folder
+            foil_name (str): Name of the foil
+        """
+        self.path = os.path.join(data_folder, LOCK_DIR, foil_name + '.lock')
+        self.foil_name = foil_name
+        self._file = None
+
+    def acquire(self):
+        """
+        Wait until no other process works on the foil and take the lock
+
+        Returns:
+            FoilLock: self
+        """
+        if self._file is not None:
+            raise RuntimeError(f'Lock of foil {self.foil_name} is already held (FoilLock is not reentrant)')
+        if fcntl is None:
+            return self
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a')
+        try:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print(f'Waiting for another process working on foil {self.foil_name}...')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        except OSError as e:
+            print(f'Warning: cannot lock {self.path} ({e}), continuing without lock')
+            self._file.close()
+            self._file = None
+        return self
+
+    def release(self):
+        """
+        Release the lock (no-op if it is not held)
+        """
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
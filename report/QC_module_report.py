@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC Module Report
+Runs the module QC of a GE2/1 module (QC3 gas leak, QC4 HV divider, QC5 effective
+gain) concurrently and writes one combined PDF report
+
+Each stage stages its input files, reads them once and draws its plots. The
+three stages run concurrently in a pool of worker processes: the fits, the
+bootstrap and the plotting hold the GIL, so threads would not overlap them. The
+workers are forked from the driver, so they start with the libraries already
+imported, and send back picklable results (plot paths, arrays, floats and the
+QC3 table). The pool has one process per stage, at most one per CPU (on a
+single CPU the stages run one after another in the driver). The time of every
+stage is printed together with their sum and the elapsed time; --sequential
+runs the same stages one after another in the driver for comparison. A failed
+stage is reported and left out of the PDF, the other stages are still reported.
+"""
+'''
+python3 QC_module_report.py -mt M2 -mn 0003 -d3 20230908 -d4 20230908 -d5 20230910
+'''
+
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fpdf.enums import XPos, YPos
+from QC_io import atomic_path
+from QC_resources import new_report_pdf
+from QC_parsers import load_file
+from QC_bootstrap import CONFIDENCE_LEVEL, add_bootstrap_arguments
+from QC_staging import add_staging_arguments, data_root, staging_from_args
+from QC34_report import (QC34_FONTS, TAU_STEP, TAU_WINDOW, add_qc34_pages, qc3_file, qc3_plot, qc3_tau_plot,
+                         qc4_file, qc4_plot, read_qc3, read_qc4)
+from QC5_report import qc5_current_file, qc5_eff_gain, qc5_eff_plot, qc5_eff_rate, qc5_gain_bootstrap, qc5_rate_file
+
+def qc3_stage(staging, mt, mn, d3, path, n_resamples=0, seed=None, tau_window=TAU_WINDOW, tau_step=TAU_STEP):
+    """
+    Read the QC3 file, fit the time constant and draw the QC3 and sliding time constant plots
+
+    Returns:
+        dict: data (DataFrame), b (inverse time constant [1/h]), tau_interval, tau_plot
+    """
+    data = read_qc3(staging.stage(path))
+    b, tau_interval = qc3_plot(mt, mn, d3, data, n_resamples, seed)
+    tau_plot = qc3_tau_plot(mt, mn, d3, data, 1/b, tau_interval, tau_window, tau_step)
+    return {'data': data, 'b': b, 'tau_interval': tau_interval, 'tau_plot': tau_plot}
+
+def qc4_stage(staging, mt, mn, d4, path):
+    """
+    Read the QC4 file and fit the divider resistance
+
+    Returns:
+        dict: r_m (measured resistance [MOhm])
+    """
+    return {'r_m': qc4_plot(mt, mn, d4, read_qc4(staging.stage(path)))}
+
+def qc5_stage(staging, mt, mn, d5, rate_path, current_path, n_resamples=0, seed=None):
+    """
+    Read the QC5 files, compute the rates and effective gains and draw the QC5 plot
+
+    Returns:
+        dict: imon, rates, gains, intervals (None without bootstrap), popt (gain fit parameters), plot
+    """
+    staged = staging.prefetch([rate_path, current_path])
+    rate_columns = load_file(staged[rate_path], 'qc5_rate')
+    current_columns = load_file(staged[current_path], 'qc5_currents')
+    imon, rates = qc5_eff_rate(rate_columns)
+    gains = qc5_eff_gain(current_columns, (imon, rates))
+    intervals = None
+    if n_resamples > 0:
+        intervals = qc5_gain_bootstrap(rate_columns, current_columns, gains, n_resamples, seed)
+    plot, popt = qc5_eff_plot(mt, mn, d5, (imon, rates), gains, intervals)
+    return {'imon': imon, 'rates': rates, 'gains': gains, 'intervals': intervals, 'popt': popt, 'plot': plot}
+
+def timed(func, *args):
+    """
+    Run a stage and measure its time
+
+    Returns:
+        tuple: (result or None, seconds, exception or None)
+    """
+    start = time.perf_counter()
+    try:
+        result, error = func(*args), None
+    except Exception as e:
+        result, error = None, e
+    return result, time.perf_counter() - start, error
+
+def default_workers(stages):
+    """
+    One worker process per stage, at most one per CPU available to this process
+
+    The stages are CPU bound once their inputs are staged, so more processes than
+    CPUs only add the start-up of the extra workers.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+    return max(1, min(len(stages), cpus))
+
+def run_stages(stages, workers=None):
+    """
+    Run the stages concurrently in a pool of worker processes
+
+    Args:
+        stages (dict): Stage name -> (function, arguments), functions and arguments picklable
+        workers (int): Number of worker processes (default: default_workers), 1 to run the
+            stages one after another in this process
+
+    Returns:
+        dict: Stage name -> (result or None, seconds, exception or None), in the order of stages
+    """
+    workers = default_workers(stages) if workers is None else workers
+    if workers <= 1:
+        return {name: timed(func, *args) for name, (func, args) in stages.items()}
+    # Forked workers inherit the imported NumPy/pandas/matplotlib modules instead of importing them again
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {name: executor.submit(timed, func, *args) for name, (func, args) in stages.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:  # The worker died or the result could not be pickled
+                results[name] = (None, 0.0, e)
+    return results
+
+def format_interval(interval, fmt):
+    return ' - '.join(fmt % value for value in interval) if interval is not None else ''
+
+def summary_rows(results):
+    """
+    Main result of every stage
+
+    Args:
+        results (dict): Output of run_stages
+
+    Returns:
+        list: (stage, quantity, value, confidence interval) rows of strings
+    """
+    rows = []
+    qc3, _, error = results['QC3']
+    if error is None:
+        rows.append(('QC3', 'Time constant (hr)', '%.2f' % (1/qc3['b']), format_interval(qc3['tau_interval'], '%.2f')))
+    qc4, _, error = results['QC4']
+    if error is None:
+        rows.append(('QC4', 'Measured resistance (MOhm)', '%.3f' % qc4['r_m'], ''))
+        rows.append(('QC4', 'Resistance deviation (%)', '%.2f' % (100*(5.0-qc4['r_m'])/5.0), ''))
+    qc5, _, error = results['QC5']
+    if error is None:
+        im = qc5['imon'].index(720)
+        intervals = qc5['intervals']
+        rows.append(('QC5', 'Effective gain at 720 uA', '%.4g' % qc5['gains'][im],
+                     format_interval(intervals['gain'][:, im] if intervals else None, '%.4g')))
+        rows.append(('QC5', 'Gain slope (1/uA)', '%.5f' % qc5['popt'][1],
+                     format_interval(qc5['popt'][1] + intervals['slope'] if intervals else None, '%.5f')))
+    return rows
+
+def add_summary_page(pdf, mt, mn, dates, results, elapsed, concurrent):
+    """
+    Draw the module summary: main results, stage status and timings
+
+    Args:
+        pdf (FPDF): Report created with new_report_pdf and the QC34_FONTS
+        mt (str): Module type
+        mn (str): Module number
+        dates (dict): Stage name -> test date (YYYYMMDD)
+        results (dict): Output of run_stages
+        elapsed (float): Elapsed time [s] of all stages
+        concurrent (bool): Whether the stages ran concurrently
+    """
+    pdf.set_font('FreeSansB', '', 22)
+    pdf.cell(0, 10, 'Module QC Report on GE21-MODULE-{}-{}'.format(mt, mn), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+    pdf.ln(10)
+    pdf.set_font('FreeSansB', '', 15)
+    pdf.cell(100, 20, 'Results', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font('FreeSansB', '', 10)
+    for width, title in zip((20, 70, 40, 50), ('Test', '', 'Value', '{}% CI'.format(round(100*CONFIDENCE_LEVEL)))):
+        pdf.cell(width, 10, title)
+    pdf.ln(10)
+    pdf.set_font('FreeSans', '', 10)
+    for row in summary_rows(results):
+        for width, value in zip((20, 70, 40, 50), row):
+            pdf.cell(width, 8, value)
+        pdf.ln(8)
+
+    pdf.ln(10)
+    pdf.set_font('FreeSansB', '', 15)
+    pdf.cell(100, 20, 'Stages', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font('FreeSansB', '', 10)
+    for width, title in zip((20, 30, 25, 105), ('Test', 'Test Date', 'Time (s)', 'Status')):
+        pdf.cell(width, 10, title)
+    pdf.ln(10)
+    pdf.set_font('FreeSans', '', 10)
+    for name, (_, seconds, error) in results.items():
+        date = dates[name]
+        status = 'OK' if error is None else 'Failed: {}'.format(error)[:80]
+        for width, value in zip((20, 30, 25, 105), (name, '{}-{}-{}'.format(date[:4], date[4:6], date[6:8]),
+                                                  '%.2f' % seconds, status)):
+            pdf.cell(width, 8, value)
+        pdf.ln(8)
+    pdf.ln(4)
+    total = sum(seconds for _, seconds, _ in results.values())
+    pdf.multi_cell(0, 6, 'Stages run {}: {:.2f} s elapsed, {:.2f} s stage time in total.'.format(
+        'concurrently' if concurrent else 'one after another', elapsed, total))
+
+def add_qc5_page(pdf, mt, mn, d5, qc5):
+    """
+    Draw the QC5 results, starting on the current (empty) page of a report
+
+    Args:
+        pdf (FPDF): Report created with new_report_pdf and the QC34_FONTS
+        mt (str): Module type
+        mn (str): Module number
+        d5 (str): QC5 test date (YYYYMMDD)
+        qc5 (dict): Result of qc5_stage
+    """
+    intervals = qc5['intervals']
+    pdf.set_font('FreeSansB', '', 15)
+    pdf.cell(100, 20, 'QC5 Result', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.image(qc5['plot'], x=0, y=35, w=100)
+    pdf.set_font('FreeSansB', '', 10)
+    pdf.ln(2)
+    pdf.cell(95)
+    pdf.cell(60, 12, 'Test Date')
+    pdf.set_font('FreeSans', '', 10)
+    pdf.cell(30, 12, '{}-{}-{}'.format(d5[:4], d5[4:6], d5[6:8]), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R')
+    im = qc5['imon'].index(720)
+    rows = [('Effective gain at 720 uA', '%.4g' % qc5['gains'][im]),
+            ('Gain slope (1/uA)', '%.5f' % qc5['popt'][1])]
+    if intervals is not None:
+        rows.insert(1, ('Gain {}% CI'.format(round(100*CONFIDENCE_LEVEL)), '%.4g - %.4g' % tuple(intervals['gain'][:, im])))
+        rows.append(('Slope {}% CI'.format(round(100*CONFIDENCE_LEVEL)),
+                     '%.5f - %.5f' % tuple(qc5['popt'][1] + intervals['slope'])))
+    for title, value in rows:
+        pdf.set_font('FreeSansB', '', 10)
+        pdf.cell(95)
+        pdf.cell(60, 12, title)
+        pdf.set_font('FreeSans', '', 10)
+        pdf.cell(30, 12, value, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R')
+
+    # Table of all Imon settings below the plot
+    pdf.set_y(140)
+    columns = ['Imon (uA)', 'Rate (Hz)', 'Effective Gain']
+    if intervals is not None:
+        columns += ['Rate CI (Hz)', 'Gain CI']
+    pdf.set_font('FreeSansB', '', 10)
+    for title in columns:
+        pdf.cell(36, 8, title, align='C')
+    pdf.ln(8)
+    pdf.set_font('FreeSans', '', 10)
+    for k, imon in enumerate(qc5['imon']):
+        values = ['%g' % imon, '%.1f' % qc5['rates'][k], '%.4g' % qc5['gains'][k]]
+        if intervals is not None:
+            values += ['%.1f - %.1f' % tuple(intervals['rate'][:, k]), '%.4g - %.4g' % tuple(intervals['gain'][:, k])]
+        for value in values:
+            pdf.cell(36, 7, value, align='C')
+        pdf.ln(7)
+
+def module_report(mt, mn, dates, results, elapsed, concurrent, font_dirs=None, tau_window=TAU_WINDOW, tau_step=TAU_STEP):
+    """
+    Write the combined module report: summary, QC3 & QC4 and QC5 pages
+
+    Args:
+        mt (str): Module type
+        mn (str): Module number
+        dates (dict): Stage name -> test date (YYYYMMDD)
+        results (dict): Output of run_stages
+        elapsed (float): Elapsed time [s] of all stages
+        concurrent (bool): Whether the stages ran concurrently
+        font_dirs (list): Extra font directories
+        tau_window (float): Sliding window length [h] of the QC3 time constant
+        tau_step (float): Distance between the sliding windows [h]
+
+    Returns:
+        str: Path to the PDF report
+    """
+    pdf = new_report_pdf(QC34_FONTS, font_dirs)
+    add_summary_page(pdf, mt, mn, dates, results, elapsed, concurrent)
+    qc3, _, qc3_error = results['QC3']
+    qc4, _, qc4_error = results['QC4']
+    # The QC3 & QC4 page layout needs both results
+    if qc3_error is None and qc4_error is None:
+        pdf.add_page()
+        add_qc34_pages(pdf, mt, mn, dates['QC3'], dates['QC4'], qc3['data'], qc3['b'], qc4['r_m'],
+                       qc3['tau_interval'], qc3['tau_plot'], tau_window, tau_step)
+    qc5, _, qc5_error = results['QC5']
+    if qc5_error is None:
+        pdf.add_page()
+        add_qc5_page(pdf, mt, mn, dates['QC5'], qc5)
+    os.makedirs('./pdf', exist_ok=True)
+    path = './pdf/QC_module_report_GE21-MODULE-{}-{}.pdf'.format(mt, mn)
+    with atomic_path(path) as tmp_path:
+        pdf.output(tmp_path)
+    return path
+
+def print_timings(results, elapsed, concurrent):
+    """
+    Print the time of every stage, their sum and the elapsed time
+    """
+    print('\nStage timings:')
+    for name, (_, seconds, error) in results.items():
+        print(f'  {name}      {seconds:6.2f} s' + ('' if error is None else '  (failed)'))
+    print(f'  Sum      {sum(seconds for _, seconds, _ in results.values()):6.2f} s')
+    print(f'  Elapsed  {elapsed:6.2f} s (' + ('stages run concurrently, compare with --sequential)'
+                                             if concurrent else 'stages run one after another)'))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Run QC3, QC4 and QC5 of a module and write one combined report')
+    parser.add_argument("-mt", "--module_type", dest="module_type", required=True, help="module type")
+    parser.add_argument("-mn", "--module_number", dest="module_number", required=True, help="module number")
+    parser.add_argument("-d3", "--qc3_date", dest="qc3_date", required=True, help="qc3 test date (YYYYMMDD)")
+    parser.add_argument("-d4", "--qc4_date", dest="qc4_date", required=True, help="qc4 test date (YYYYMMDD)")
+    parser.add_argument("-d5", "--qc5_date", dest="qc5_date", required=True, help="qc5 test date (YYYYMMDD)")
+    parser.add_argument("--font-dir", dest="font_dirs", action="append", help="directory with the FreeSans/FreeSerif fonts (can be repeated)")
+    parser.add_argument("--sequential", action="store_true", help="run the stages one after another in this process instead of concurrently")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: one per stage, at most one per CPU)")
+    add_staging_arguments(parser, data_root_option=True)
+    parser.add_argument("--tau-window", dest="tau_window", type=float, default=TAU_WINDOW*60, help="length of the sliding time constant windows in minutes (default: %(default)g)")
+    parser.add_argument("--tau-step", dest="tau_step", type=float, default=TAU_STEP*60, help="distance between the sliding windows in minutes (default: %(default)g)")
+    add_bootstrap_arguments(parser)
+    args = parser.parse_args()
+    mt, mn = args.module_type, args.module_number
+    dates = {'QC3': args.qc3_date, 'QC4': args.qc4_date, 'QC5': args.qc5_date}
+
+    root = data_root(args.data_root)
+    staging = staging_from_args(args)
+    qc3_path = os.path.join(root, qc3_file(mt, mn, args.qc3_date))
+    qc4_path = os.path.join(root, qc4_file(mt, mn, args.qc4_date))
+    rate_path = os.path.join(root, qc5_rate_file(mt, mn, args.qc5_date))
+    current_path = os.path.join(root, qc5_current_file(mt, mn, args.qc5_date))
+
+    os.makedirs('./plot', exist_ok=True)
+    tau_window, tau_step = args.tau_window/60, args.tau_step/60
+    stages = {
+        'QC3': (qc3_stage, (staging, mt, mn, args.qc3_date, qc3_path, args.resamples, args.seed, tau_window, tau_step)),
+        'QC4': (qc4_stage, (staging, mt, mn, args.qc4_date, qc4_path)),
+        'QC5': (qc5_stage, (staging, mt, mn, args.qc5_date, rate_path, current_path, args.resamples, args.seed)),
+    }
+    start = time.perf_counter()
+    workers = 1 if args.sequential else (args.workers or default_workers(stages))
+    results = run_stages(stages, workers)
+    elapsed = time.perf_counter() - start
+    for name, (_, _, error) in results.items():
+        if error is not None:
+            print(f'Error in {name}: {error}')
+    path = module_report(mt, mn, dates, results, elapsed, workers > 1, args.font_dirs, tau_window, tau_step)
+    print_timings(results, elapsed, workers > 1)
+    print(f'Created {path}')
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+QC Parser Benchmark
+Times the QC_parsers backends on synthetic QC files of increasing size
+
+For every file type and size, a file is written to a temporary directory and
+parsed with every available backend. The outputs are checked to be identical,
+and the best time of each backend is printed with the fastest backend per size,
+which shows the crossover points used by QC_parsers.select_backend.
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from QC_parsers import FILE_TYPES, HEADER_LINES, available_backends, load_file, select_backend
+
+DEFAULT_ROWS = [10, 100, 1000, 10000, 100000, 1000000]
+# Number of data columns written for the file types that read all columns
+ALL_COLUMNS = {'qc5_currents': 20}
+
+def write_synthetic(path, file_type, n_rows, rng):
+    """
+    Write a synthetic file of a QC file type
+
+    Args:
+        path (str): Path of the file
+        file_type (str): Key of QC_parsers.FILE_TYPES
+        n_rows (int): Number of data rows
+        rng (np.random.Generator): Random number generator
+    """
+    skiprows, usecols = FILE_TYPES[file_type]
+    if usecols is None:
+        n_columns = ALL_COLUMNS[file_type]
+    elif file_type in HEADER_LINES:
+        n_columns = len(usecols)
+    else:
+        n_columns = max(usecols) + 1
+    header = [f'header line {k}' for k in range(skiprows)]
+    if file_type in HEADER_LINES:
+        header[HEADER_LINES[file_type]] = '\t'.join(usecols)
+    table = np.column_stack([np.arange(n_rows, dtype=np.float64)] +
+                            [rng.normal(500, 100, n_rows) for _ in range(n_columns - 1)])
+    with open(path, 'w') as f:
+        for line in header:
+            f.write(line + '\n')
+        np.savetxt(f, table, delimiter='\t', fmt='%.6g')
+
+def best_time(path, file_type, backend, repeat):
+    """
+    Best parsing time of repeat runs
+
+    Returns:
+        tuple: (time in seconds, parsed columns)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        columns = load_file(path, file_type, backend=backend)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, columns
+
+def benchmark(file_types, rows, repeat, max_seconds):
+    """
+    Print the benchmark table
+
+    Args:
+        file_types (list): File types to benchmark
+        rows (list): Numbers of data rows
+        repeat (int): Runs per backend, the best time is reported
+        max_seconds (float): Backends slower than this are skipped for the larger sizes
+    """
+    backends = available_backends()
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_type in file_types:
+            print(f'\n{file_type}')
+            print(f'{"rows":>9} {"size":>10} ' + ' '.join(f'{name:>9}' for name in backends) + f' {"fastest":>9} {"auto":>9}')
+            too_slow = set()
+            for n_rows in rows:
+                path = os.path.join(tmp_dir, f'{file_type}_{n_rows}.txt')
+                write_synthetic(path, file_type, n_rows, rng)
+                times = {}
+                reference = None
+                for backend in backends:
+                    if backend in too_slow:
+                        continue
+                    times[backend], columns = best_time(path, file_type, backend, repeat)
+                    if times[backend] > max_seconds:
+                        too_slow.add(backend)
+                    if reference is None:
+                        reference = columns
+                    elif not all(np.array_equal(a, b) for a, b in zip(reference, columns)):
+                        print(f'  WARNING: {backend} output differs from {backends[0]}')
+                size = os.path.getsize(path)
+                cells = ' '.join(f'{times[name]*1000:8.2f}m' if name in times else f'{"-":>9}' for name in backends)
+                print(f'{n_rows:>9} {size/1024:>8.0f}kB {cells} {min(times, key=times.get):>9} {select_backend(path):>9}')
+                os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the QC file parser backends (times in ms)')
+    parser.add_argument('--file-type', dest='file_types', action='append', choices=sorted(FILE_TYPES),
+                        help='File type to benchmark (can be repeated, default: all)')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help=f'Numbers of data rows (default: {" ".join(map(str, DEFAULT_ROWS))})')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per backend (default: 3)')
+    parser.add_argument('--max-seconds', type=float, default=5.0,
+                        help='Skip a backend for larger files once it takes longer than this (default: 5)')
+
+    args = parser.parse_args()
+    benchmark(args.file_types or list(FILE_TYPES), args.rows, args.repeat, args.max_seconds)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+QC Parsers
+Numeric column parsing of the tab separated QC input files with selectable backends
+
+Backends:
+    csv      Python csv module (no setup cost, best for a few dozen rows)
+    numpy    numpy.loadtxt with usecols
+    pandas   pandas C engine
+    pyarrow  pandas with the multi-threaded pyarrow engine (optional dependency)
+
+All backends parse the values as float64 and return the same arrays, converted
+to the requested dtype afterwards, so the choice of backend never changes a
+result. With backend=None the backend is picked by file size
+(see select_backend), and the QC_PARSER environment variable forces one backend
+for all files. Data rows must be purely numeric; blank lines are skipped.
+"""
+import os
+import csv
+import warnings
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import pyarrow
+except ImportError:  # Large files are then parsed with numpy.loadtxt
+    pyarrow = None
+
+PARSER_ENV = 'QC_PARSER'
+
+# File size thresholds of the automatic selection, measured with QC_parser_benchmark.py
+CSV_MAX_BYTES = 2 * 1024
+PYARROW_MIN_BYTES = 1024 * 1024
+
+# Layout of the QC file types: (header lines before the data, columns to read)
+FILE_TYPES = {
+    'qc2_part1': (6, (0, 1, 2)),           # voltage, current, time
+    'qc2_iv': (1, (0, 1, 2)),              # voltage, current, current error
+    'qc2_megger': (1, (0, 1, 2)),          # time, impedance, sparks
+    'qc2_monitor': (2, tuple(range(17))),  # time, 8 voltages, 8 currents
+    'qc4': (8, ('Vmon', 'Imon')),          # column names on line 7
+    'qc5_rate': (3, (1, 5, 7)),            # Imon, counts source off, counts source on
+    'qc5_currents': (0, None),             # all columns
+}
+# Line holding the column names of the file types that select columns by name
+HEADER_LINES = {'qc4': 6}
+
+def _parse_csv(path, skiprows, usecols):
+    with open(path, newline='') as f:
+        for _ in range(skiprows):
+            f.readline()
+        rows = [row for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE) if row]
+    if usecols is not None:
+        try:
+            rows = [[row[k] for k in usecols] for row in rows]
+        except IndexError:
+            raise ValueError(f'{path}: row with fewer than {max(usecols) + 1} columns')
+    return np.array(rows, dtype=np.float64)
+
+def _parse_numpy(path, skiprows, usecols):
+    with warnings.catch_warnings():
+        # Files with only a header (e.g. an IVplot file without points) are valid
+        warnings.simplefilter('ignore', UserWarning)
+        return np.loadtxt(path, delimiter='\t', skiprows=skiprows, usecols=usecols, dtype=np.float64,
+                          comments=None, ndmin=2)
+
+def _parse_pandas(path, skiprows, usecols, engine='c'):
+    options = {'float_precision': 'round_trip', 'quoting': csv.QUOTE_NONE} if engine == 'c' else {}
+    try:
+        table = pd.read_csv(path, sep='\t', header=None, skiprows=skiprows, usecols=usecols,
+                            dtype=np.float64, engine=engine, **options)
+    except pd.errors.EmptyDataError:
+        return np.empty((0, 0))
+    if usecols is not None:
+        # pandas returns the columns in file order, and the pyarrow engine renumbers
+        # them from 0, so they are selected by position rather than by label
+        file_order = sorted(set(usecols))
+        table = table.iloc[:, [file_order.index(k) for k in usecols]]
+    return table.to_numpy(dtype=np.float64)
+
+def _parse_pyarrow(path, skiprows, usecols):
+    return _parse_pandas(path, skiprows, usecols, engine='pyarrow')
+
+BACKENDS = {
+    'csv': _parse_csv,
+    'numpy': _parse_numpy,
+    'pandas': _parse_pandas,
+    'pyarrow': _parse_pyarrow,
+}
+
+def available_backends():
+    """
+    Names of the backends usable in this environment
+
+    Returns:
+        list: Backend names
+    """
+    names = ['csv', 'numpy']
+    if pd is not None:
+        names.append('pandas')
+        if pyarrow is not None:
+            names.append('pyarrow')
+    return names
+
+def select_backend(path):
+    """
+    Pick the fastest available backend for a file
+
+    Small files (a few dozen rows) are parsed with the csv module, which has no
+    setup cost, and files of a megabyte or more with the multi-threaded pyarrow
+    engine if it is installed. numpy.loadtxt is used otherwise: it is faster
+    than the pandas C engine at every size when values must be parsed exactly.
+    QC_PARSER overrides the selection.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: Backend name
+    """
+    forced = os.environ.get(PARSER_ENV)
+    if forced:
+        return forced
+    size = os.path.getsize(path)
+    if size < CSV_MAX_BYTES:
+        return 'csv'
+    if size >= PYARROW_MIN_BYTES and 'pyarrow' in available_backends():
+        return 'pyarrow'
+    return 'numpy'
+
+def column_indices(path, header_line, names):
+    """
+    Indices of named columns
+
+    Args:
+        path (str): Path to the file
+        header_line (int): Index of the line holding the tab separated column names
+        names (tuple): Column names
+
+    Returns:
+        tuple: Column indices, in the order of names
+
+    Raises:
+        ValueError: If a column is missing
+    """
+    with open(path) as f:
+        for _ in range(header_line):
+            f.readline()
+        header = [name.strip() for name in f.readline().rstrip('\r\n').split('\t')]
+    try:
+        return tuple(header.index(name) for name in names)
+    except ValueError:
+        raise ValueError(f'{path}: columns {", ".join(names)} expected on line {header_line + 1}, found {header}')
+
+def load_columns(path, skiprows, usecols, dtype=np.float64, backend=None):
+    """
+    Load numeric columns of a tab separated QC file
+
+    Args:
+        path (str): Path to the file
+        skiprows (int): Number of header lines to skip
+        usecols (tuple): Indices of the columns to load, None for all columns
+        dtype: NumPy dtype of the returned arrays
+        backend (str): Parser backend, None to select it by file size
+
+    Returns:
+        tuple: One 1-D array per column (empty arrays if the file has no data rows)
+
+    Raises:
+        ValueError: If a data row is not numeric or has too few columns, or the backend is unknown
+    """
+    backend = backend or select_backend(path)
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown parser backend {backend!r}, expected one of {", ".join(BACKENDS)}')
+    if backend not in available_backends():
+        backend = 'numpy'
+    table = BACKENDS[backend](path, skiprows, usecols)
+    n_columns = len(usecols) if usecols is not None else (table.shape[1] if table.ndim == 2 else 0)
+    if table.size == 0:
+        table = np.empty((0, n_columns))
+    return tuple(np.ascontiguousarray(table[:, k], dtype=dtype) for k in range(n_columns))
+
+def load_file(path, file_type, dtype=np.float64, backend=None):
+    """
+    Load the numeric columns of a QC file type listed in FILE_TYPES
+
+    Args:
+        path (str): Path to the file
+        file_type (str): Key of FILE_TYPES
+        dtype: NumPy dtype of the returned arrays
+        backend (str): Parser backend, None to select it by file size
+
+    Returns:
+        tuple: One 1-D array per column of the file type
+    """
+    skiprows, usecols = FILE_TYPES[file_type]
+    if file_type in HEADER_LINES:
+        usecols = column_indices(path, HEADER_LINES[file_type], usecols)
+    return load_columns(path, skiprows, usecols, dtype, backend)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+QC Plotting
+Helpers for rendering figures without the pyplot state machine
+
+Figures are created as plain matplotlib Figure objects on their own Agg canvas,
+so they never become pyplot's "current figure", need no plt.close() and can be
+rendered concurrently from several threads.
+"""
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+def new_figure(figwidth=10, figheight=9, subplot=True):
+    """
+    Create a figure with a single axes on an Agg canvas
+
+    Args:
+        figwidth (float): Figure width in inches
+        figheight (float): Figure height in inches
+        subplot (bool): Add the axes, False for an empty figure laid out by the caller
+
+    Returns:
+        tuple: (Figure, Axes), the Axes being None if subplot is False
+    """
+    fig = Figure(figsize=(figwidth, figheight))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot() if subplot else None
+    return fig, ax
+
+def decimate_indices(values, max_points):
+    """
+    Indices of a min/max decimation of a long series
+
+    The series is cut into max_points/2 buckets and the minimum and maximum of each
+    bucket are kept, so spikes and drops stay visible while the number of plotted
+    points is bounded.
+
+    Args:
+        values (array): Series to decimate
+        max_points (int): Maximum number of returned indices
+
+    Returns:
+        array: Sorted indices of the kept samples (all indices if the series is short enough)
+    """
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    n_buckets = max(1, max_points // 2)
+    bucket = n // n_buckets
+    trimmed = np.asarray(values[:bucket*n_buckets]).reshape(n_buckets, bucket)
+    offsets = np.arange(n_buckets) * bucket
+    kept = np.concatenate((offsets + trimmed.argmin(axis=1), offsets + trimmed.argmax(axis=1), [n - 1]))
+    return np.unique(kept)
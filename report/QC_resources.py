@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+QC Resources
+Static resources shared by the PDF report builders (QC2, QC3/QC4): font lookup
+in configurable local directories and a per-process cache of parsed fonts
+
+Font files are looked up in the directories of the QC_FONT_PATH environment
+variable (separated by os.pathsep), then in the directories passed by the caller
+(e.g. a --font-dir option), then in DEFAULT_FONT_DIRS. Each directory is searched
+directly and one level of sub-directories deep (e.g. font/freesans/FreeSans.ttf).
+"""
+import os
+import copy
+import glob
+import threading
+from io import BytesIO
+from fontTools import ttLib
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.enums import TextEmphasis
+from fpdf.fonts import SubsetMap, TTFFont
+
+FONT_PATH_ENV = 'QC_FONT_PATH'
+DEFAULT_FONT_DIRS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts'),
+    '/usr/share/fonts/truetype/freefont',
+    '/afs/cern.ch/user/s/seulgi/private/Work/GEM/QC/report_qc3qc4/font',
+]
+
+def font_dirs(extra_dirs=None):
+    """
+    Directories searched for font files, in order of priority
+
+    Args:
+        extra_dirs (list): Additional directories, searched after QC_FONT_PATH
+
+    Returns:
+        list: Font directories
+    """
+    env_dirs = [path for path in os.environ.get(FONT_PATH_ENV, '').split(os.pathsep) if path]
+    return env_dirs + list(extra_dirs or []) + DEFAULT_FONT_DIRS
+
+def find_font(filename, dirs=None):
+    """
+    Find a font file in the font directories
+
+    Args:
+        filename (str): Font file name, e.g. FreeSans.ttf
+        dirs (list): Directories to search (default: font_dirs())
+
+    Returns:
+        str: Path to the font file
+
+    Raises:
+        FileNotFoundError: If the font is in none of the directories
+    """
+    dirs = font_dirs() if dirs is None else dirs
+    for directory in dirs:
+        candidates = [os.path.join(directory, filename)] + sorted(glob.glob(os.path.join(directory, '*', filename)))
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+    raise FileNotFoundError(f'Font {filename} not found in {", ".join(dirs)} '
+                            f'(add its directory to {FONT_PATH_ENV})')
+
+# fpdf2 releases whose TTFFont layout the shared fonts were checked against (the
+# per-document state reset in FontCache._document_font); other releases parse the
+# font for every document with FPDF.add_font
+SHARED_FONT_FPDF_VERSIONS = ('2.8.',)
+
+class FontCache:
+    """
+    Fonts read and parsed once per process and reused by every report
+
+    FPDF.add_font reads and parses a TrueType file (character widths, glyph ids,
+    descriptor) for every document. The cache keeps each file's bytes and one
+    parsed font, and gives every document a copy that shares the parsed metrics
+    but has its own glyph subset and its own fontTools object opened from the
+    cached bytes, because FPDF subsets that object in place when the document is
+    written. With fpdf2 releases other than SHARED_FONT_FPDF_VERSIONS, and for
+    color or CID-keyed fonts, the font is added with FPDF.add_font instead.
+    """
+
+    def __init__(self):
+        self._paths = {}
+        self._fonts = {}
+        self._scratch = FPDF()
+        self._lock = threading.Lock()
+
+    def resolve(self, filename, dirs=None):
+        """
+        Path of a font file, looked up once per file name and directory list
+
+        Args:
+            filename (str): Font file name
+            dirs (list): Extra font directories
+
+        Returns:
+            str: Path to the font file
+        """
+        key = (filename, tuple(dirs or ()))
+        with self._lock:
+            if key not in self._paths:
+                self._paths[key] = find_font(filename, font_dirs(dirs))
+            return self._paths[key]
+
+    def parsed(self, path):
+        """
+        Bytes and parsed font of a font file, read and parsed once per process
+
+        Args:
+            path (str): Path to the font file
+
+        Returns:
+            tuple: (bytes, TTFFont) or None if the font cannot be shared between documents
+        """
+        with self._lock:
+            if path not in self._fonts:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                font = TTFFont(self._scratch, BytesIO(data), f'font{len(self._fonts)}', '')
+                font.ttffile = path
+                shareable = font.color_font is None and not font.is_cid_keyed
+                self._fonts[path] = (data, font) if shareable else None
+            return self._fonts[path]
+
+    @staticmethod
+    def _document_font(pdf, fontkey, style, data, template):
+        """Copy of a parsed font sharing its metrics, with the per-document state of FPDF.add_font"""
+        font = copy.copy(template)
+        font.i = len(pdf.fonts) + 1
+        font.fontkey = fontkey
+        font.emphasis = TextEmphasis.coerce(style)
+        font.ttfont = ttLib.TTFont(BytesIO(data), recalcTimestamp=False, lazy=True)
+        font.subset = SubsetMap(font)
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font._hbfont = None
+        return font
+
+    def add_font(self, pdf, family, filename, style='', dirs=None):
+        """
+        Make a font available in a document, like FPDF.add_font
+
+        Args:
+            pdf (FPDF): Document
+            family (str): Font family name used with set_font
+            filename (str): Font file name, looked up in the font directories
+            style (str): '' or a combination of 'B' and 'I'
+            dirs (list): Extra font directories
+        """
+        path = self.resolve(filename, dirs)
+        fontkey = family.lower() + ''.join(sorted(style.upper()))
+        shared = self.parsed(path) if FPDF_VERSION.startswith(SHARED_FONT_FPDF_VERSIONS) else None
+        if shared is None or fontkey in pdf.fonts:
+            pdf.add_font(family, style, path)
+            return
+        pdf.fonts[fontkey] = self._document_font(pdf, fontkey, style, *shared)
+
+FONTS = FontCache()
+
+def new_report_pdf(fonts=(), dirs=None):
+    """
+    Create a report document with the layout shared by the QC reports
+
+    Args:
+        fonts (list): (family, font file name) pairs to add from the font cache
+        dirs (list): Extra font directories
+
+    Returns:
+        FPDF: Document with one page, automatic page breaks and the fonts added
+    """
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(True, margin=1.0)
+    for family, filename in fonts:
+        FONTS.add_font(pdf, family, filename, dirs=dirs)
+    return pdf
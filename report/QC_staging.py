@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+QC Staging
+Local staging cache for input files on network filesystems (AFS/EOS)
+
+Input files are copied in parallel into a local cache directory and the scripts
+read the local copies. A cached copy is reused as long as its size and
+modification time match the source file (copies keep the source mtime), so each
+run costs one stat per file on the network filesystem, and files are only copied
+again after they changed. Any directory can be used as the source, e.g. a local
+directory standing in for AFS in tests.
+"""
+import os
+import shutil
+import getpass
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from QC_io import atomic_path
+
+DATA_ROOT_ENV = 'QC_DATA_ROOT'
+DEFAULT_DATA_ROOT = '/afs/cern.ch/user/s/seulgi/private/Work/GEM/CMS_GE21_QC/report/data'
+STAGING_DIR_ENV = 'QC_STAGING_DIR'
+STAGING_WORKERS = 8
+
+def data_root(root=None):
+    """
+    Directory holding the QC3/QC4/QC5 input files
+
+    Args:
+        root (str): Explicit root (e.g. from a --data-root option)
+
+    Returns:
+        str: root, else the QC_DATA_ROOT environment variable, else DEFAULT_DATA_ROOT
+    """
+    return root or os.environ.get(DATA_ROOT_ENV) or DEFAULT_DATA_ROOT
+
+def default_staging_dir():
+    """
+    Local staging directory: QC_STAGING_DIR, else a per-user directory in the system temp directory
+    """
+    return os.environ.get(STAGING_DIR_ENV) or os.path.join(tempfile.gettempdir(), f'qc_staging_{getpass.getuser()}')
+
+def add_staging_arguments(parser, data_root_option=False, default=True):
+    """
+    Add the staging options to an argument parser
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of the script
+        data_root_option (bool): Also add --data-root (scripts reading from the data root)
+        default (bool): Whether staging is on by default (--no-staging) or opt-in (--stage)
+    """
+    if data_root_option:
+        parser.add_argument('--data-root', dest='data_root',
+                            help=f'directory with the input files (default: ${DATA_ROOT_ENV} or {DEFAULT_DATA_ROOT})')
+    parser.add_argument('--staging-dir', dest='staging_dir',
+                        help=f'local directory the inputs are staged into (default: ${STAGING_DIR_ENV} or a directory in {tempfile.gettempdir()})')
+    if default:
+        parser.add_argument('--no-staging', dest='staging', action='store_false',
+                            help='read the inputs directly from their directory')
+    else:
+        parser.add_argument('--stage', dest='staging', action='store_true',
+                            help='copy the inputs to the local staging directory and read them from there')
+
+def staging_from_args(args):
+    """
+    Staging cache configured by the options of add_staging_arguments
+
+    Args:
+        args (argparse.Namespace): Parsed arguments
+
+    Returns:
+        StagingCache: Cache (disabled unless staging is on)
+    """
+    if not args.staging:
+        return StagingCache(None)
+    return StagingCache(args.staging_dir or default_staging_dir())
+
+class StagingCache:
+    """
+    Local copies of remote input files, validated by size and modification time
+
+    Files of one source directory are staged into one mirror directory
+    (<cache_dir>/<hash of the source directory>/<file name>), so a staged data
+    directory can be read like the original. With cache_dir=None staging is
+    disabled and the source paths are returned unchanged.
+    """
+
+    def __init__(self, cache_dir=None, workers=STAGING_WORKERS):
+        """
+        Args:
+            cache_dir (str): Local cache directory, None to read the sources directly
+            workers (int): Number of parallel copies
+        """
+        self.cache_dir = cache_dir
+        self.workers = workers
+
+    def mirror_dir(self, source_dir):
+        """
+        Local mirror directory of a source directory
+
+        Args:
+            source_dir (str): Source directory
+
+        Returns:
+            str: Mirror directory in the cache
+        """
+        source_dir = os.path.abspath(source_dir)
+        digest = hashlib.sha256(source_dir.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{os.path.basename(source_dir)}-{digest}')
+
+    def stage(self, path):
+        """
+        Local copy of a file, copied only if missing or outdated
+
+        Args:
+            path (str): Source file
+
+        Returns:
+            str: Path to read the file from
+
+        Raises:
+            FileNotFoundError: If the source file does not exist
+        """
+        if self.cache_dir is None:
+            return path
+        source = os.stat(path)
+        directory = self.mirror_dir(os.path.dirname(path))
+        local_path = os.path.join(directory, os.path.basename(path))
+        try:
+            cached = os.stat(local_path)
+            if cached.st_size == source.st_size and cached.st_mtime_ns == source.st_mtime_ns:
+                return local_path
+        except FileNotFoundError:
+            pass
+        os.makedirs(directory, exist_ok=True)
+        with atomic_path(local_path) as tmp_path:
+            shutil.copy2(path, tmp_path)  # Keeps the modification time used for validation
+        return local_path
+
+    def prefetch(self, paths):
+        """
+        Stage several files in parallel
+
+        Args:
+            paths (list): Source files
+
+        Returns:
+            dict: Source path -> local path
+
+        Raises:
+            FileNotFoundError: If a source file does not exist
+        """
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            return dict(zip(paths, executor.map(self.stage, paths)))
+
+    def stage_directory(self, source_dir, select=None):
+        """
+        Stage the files of a directory into its mirror directory
+
+        The source directory is listed once. Files of the mirror that are no
+        longer selected in the source are removed, so the mirror can be listed
+        and read like the source.
+
+        Args:
+            source_dir (str): Source directory
+            select (callable): Called with each file name, only files for which
+                it returns True are staged (default: all regular files)
+
+        Returns:
+            str: Directory to read the files from (source_dir if staging is disabled)
+        """
+        if self.cache_dir is None:
+            return source_dir
+        with os.scandir(source_dir) as it:
+            names = [entry.name for entry in it
+                     if entry.is_file() and (select is None or select(entry.name))]
+        mirror = self.mirror_dir(source_dir)
+        os.makedirs(mirror, exist_ok=True)
+        self.prefetch([os.path.join(source_dir, name) for name in names])
+        keep = set(names)
+        with os.scandir(mirror) as it:
+            for entry in it:
+                if entry.is_file() and entry.name not in keep and not entry.name.startswith('.'):
+                    os.remove(entry.path)
+        return mirror
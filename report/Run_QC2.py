@@ -12,55 +12,212 @@ import os
 import sys
 import subprocess
 from datetime import datetime
+import time
 import readline
-import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from QC2_dataset import extract_foil_name
+
+# Seconds a cached directory listing is reused, so Tab presses and the path
+# validation share one scan of each directory
+LISTING_TTL = 10.0
+# Seconds the match list waits for foil counts that are still being scanned
+HINT_WAIT = 0.2
+# Candidate directories scanned for foil counts per Tab press
+MAX_HINT_SCANS = 64
+SCAN_WORKERS = 8
+
+DATA_PATH_PROMPT = "Please enter the data path: "
+
+def count_foils(names):
+    """
+    Count the foils with a QC2LONG_PART1 file among file names
+    
+    Args:
+        names (iterable): File names of a directory
+    
+    Returns:
+        int: Number of distinct foils
+    """
+    foils = set()
+    for name in names:
+        if name.startswith('QC2LONG_PART1_') and name.endswith('.txt') and 'IVplot' not in name:
+            foils.add(extract_foil_name(name))
+    return len(foils)
+
+class DirectoryCache:
+    """
+    Directory listings cached for a short time
+    
+    Directories are listed with os.scandir, whose entries already know their
+    type, so no extra stat call is needed per entry. Listings older than ttl
+    seconds are scanned again. Directories can be scanned ahead in background
+    threads (prefetch), so slow AFS/EOS directories do not block the prompt.
+    """
+    def __init__(self, ttl=LISTING_TTL, workers=SCAN_WORKERS):
+        self.ttl = ttl
+        self.workers = workers
+        self._listings = {}  # Absolute path -> (scan time, {name: is_dir} or None)
+        self._pending = {}  # Absolute path -> Future of a background scan
+        self._lock = threading.Lock()
+        self._executor = None
+    
+    def _scan(self, path):
+        try:
+            with os.scandir(path) as it:
+                entries = {}
+                for entry in it:
+                    try:
+                        entries[entry.name] = entry.is_dir()
+                    except OSError:  # E.g. a broken link
+                        entries[entry.name] = False
+        except OSError:  # Missing or unreadable directory
+            entries = None
+        with self._lock:
+            self._listings[path] = (time.monotonic(), entries)
+            self._pending.pop(path, None)
+        return entries
+    
+    def cached(self, path):
+        """
+        Listing of a directory if a fresh one is cached, without scanning
+        
+        Returns:
+            tuple: (found, {name: is_dir} or None if the directory cannot be listed)
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return True, cached[1]
+        return False, None
+    
+    def listing(self, path):
+        """
+        Listing of a directory, scanned unless a fresh one is cached
+        
+        Args:
+            path (str): Directory path
+        
+        Returns:
+            dict: Entry name -> True for directories, None if the directory cannot be listed
+        """
+        found, entries = self.cached(path)
+        if found:
+            return entries
+        path = os.path.abspath(path)
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None:
+            return future.result()
+        return self._scan(path)
+    
+    def prefetch(self, paths):
+        """
+        Start background scans of directories that have no fresh listing
+        
+        Args:
+            paths (list): Directory paths
+        
+        Returns:
+            list: Futures of the scans in progress
+        """
+        futures = []
+        for path in paths:
+            if self.cached(path)[0]:
+                continue
+            path = os.path.abspath(path)
+            with self._lock:
+                if path not in self._pending:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                    self._pending[path] = self._executor.submit(self._scan, path)
+                futures.append(self._pending[path])
+        return futures
+    
+    def foil_count(self, path):
+        """
+        Number of foils in a directory, from its cached listing only
+        
+        Returns:
+            int: Number of foils, None if the directory has not been scanned yet
+        """
+        found, entries = self.cached(path)
+        if not found:
+            return None
+        return count_foils(entries) if entries else 0
 
 class TabCompleter:
     """
     Tab completion class for directory paths
+    
+    Matches come from cached directory listings. When several matches are
+    listed, every candidate directory is shown with the number of foils it
+    contains (display_matches).
     """
-    def __init__(self):
+    def __init__(self, cache, prompt=DATA_PATH_PROMPT):
+        self.cache = cache
+        self.prompt = prompt
         self.matches = []
     
+    def find_matches(self, text):
+        """
+        Paths starting with text, directories with a trailing separator
+        """
+        dirname, basename = os.path.split(text)
+        entries = self.cache.listing(os.path.expanduser(dirname) or os.curdir) or {}
+        matches = []
+        for name, is_dir in sorted(entries.items()):
+            # Hidden entries are only completed when asked for, as with glob
+            if not name.startswith(basename) or (name.startswith('.') and not basename.startswith('.')):
+                continue
+            matches.append(os.path.join(dirname, name) + (os.sep if is_dir else ''))
+        # Count the foils of the candidate directories in the background
+        self.cache.prefetch([os.path.expanduser(match) for match in matches if match.endswith(os.sep)][:MAX_HINT_SCANS])
+        return matches
+    
     def complete(self, text, state):
         if state == 0:
-            # If text is empty, show all files/dirs in current directory
-            if not text:
-                self.matches = glob.glob('*')
-            else:
-                # If text ends with path separator, look inside that directory
-                dirname = os.path.dirname(text)
-                if dirname:
-                    dirname = os.path.expanduser(dirname)
-                    if not dirname.endswith(os.sep):
-                        dirname += os.sep
-                else:
-                    dirname = ''
-                
-                # Get the basename (part we're completing)
-                basename = os.path.basename(text)
-                
-                # If text ends with path separator, show everything in that directory
-                if text.endswith(os.sep):
-                    self.matches = glob.glob(text + '*')
-                else:
-                    # Otherwise, show matches for current input
-                    self.matches = glob.glob(dirname + basename + '*')
-                
-                # Add trailing slash to directories
-                self.matches = [f"{m}{os.sep if os.path.isdir(m) else ''}" for m in self.matches]
+            self.matches = self.find_matches(text)
         
         # Return the state-th match or None if no more matches
         try:
             return self.matches[state]
         except IndexError:
             return None
+    
+    def display_matches(self, substitution, matches, longest_match_length):
+        """
+        Readline display hook: list the matches with the foil count of each directory
+        """
+        directories = [os.path.expanduser(match) for match in matches if match.endswith(os.sep)]
+        wait(self.cache.prefetch(directories[:MAX_HINT_SCANS]), timeout=HINT_WAIT)
+        names = [os.path.basename(match.rstrip(os.sep)) + (os.sep if match.endswith(os.sep) else '') for match in matches]
+        width = max(len(name) for name in names)
+        print()
+        for match, name in zip(matches, names):
+            hint = ''
+            if match.endswith(os.sep):
+                n_foils = self.cache.foil_count(os.path.expanduser(match))
+                if n_foils is None:
+                    hint = '(scanning...)'
+                elif n_foils:
+                    hint = f"({n_foils} foil{'s' if n_foils > 1 else ''})"
+            print(f"  {name.ljust(width)}  {hint}".rstrip())
+        print(self.prompt + readline.get_line_buffer(), end='', flush=True)
 
-def setup_tab_completion():
+def setup_tab_completion(cache):
     """
     Set up tab completion for input
+    
+    Args:
+        cache (DirectoryCache): Listings shared with the path validation
     """
-    readline.set_completer(TabCompleter().complete)
+    completer = TabCompleter(cache)
+    readline.set_completer(completer.complete)
+    # Not available with libedit (macOS), the matches are then listed without foil counts
+    if hasattr(readline, 'set_completion_display_matches_hook'):
+        readline.set_completion_display_matches_hook(completer.display_matches)
     readline.parse_and_bind('tab: complete')
     # Set word delimiters to only include space
     readline.set_completer_delims(' ')
@@ -81,34 +238,34 @@ def validate_date(date_str):
     except ValueError:
         return False
 
-def check_existing_files(path):
+def check_existing_files(path, cache=None):
     """
     Check for existing QC2 files in the directory
     
     Args:
         path (str): Path to check
+        cache (DirectoryCache): Cached listings, the directories are listed again if None
     
     Returns:
         tuple: (has_megger, has_iv, has_pdf) indicating presence of existing files
     """
+    cache = cache or DirectoryCache()
     has_megger = False
     has_iv = False
     has_pdf = False
     
     # Check main directory for megger and IV files
-    for file in os.listdir(path):
+    for file in cache.listing(path) or {}:
         if file.startswith('QC2FAST_') and file.endswith('.txt'):
             has_megger = True
         if file.endswith('_IVplot.txt') or file.endswith('_IVplot.png'):
             has_iv = True
     
     # Check pdf_reports directory for PDF files
-    pdf_dir = os.path.join(path, 'pdf_reports')
-    if os.path.exists(pdf_dir):
-        for file in os.listdir(pdf_dir):
-            if file.startswith('QC2REPORT_') and file.endswith('.pdf'):
-                has_pdf = True
-                break
+    for file in cache.listing(os.path.join(path, 'pdf_reports')) or {}:
+        if file.startswith('QC2REPORT_') and file.endswith('.pdf'):
+            has_pdf = True
+            break
     
     return has_megger, has_iv, has_pdf
 
@@ -130,32 +287,33 @@ def get_user_confirmation(prompt):
             return False
         print("Please enter 'y' or 'n'")
 
-def validate_path(path):
+def validate_path(path, cache=None):
     """
     Validate if the input path exists and contains required files
     
     Args:
         path (str): Path to validate
+        cache (DirectoryCache): Cached listings, e.g. from the tab completion; the
+            directory is listed again if None
     
     Returns:
         bool: True if valid, False otherwise
     """
-    if not os.path.exists(path):
-        print(f"Error: Path '{path}' does not exist")
+    entries = (cache or DirectoryCache()).listing(path)
+    if entries is None:
+        if os.path.exists(path):
+            print(f"Error: Path '{path}' is not a readable directory")
+        else:
+            print(f"Error: Path '{path}' does not exist")
         return False
     
     # Check for QC2LONG_PART1 files
-    has_part1_files = False
-    for file in os.listdir(path):
-        if file.startswith('QC2LONG_PART1_') and file.endswith('.txt'):
-            if 'IVplot' not in file:
-                has_part1_files = True
-                break
-    
-    if not has_part1_files:
+    n_foils = count_foils(entries)
+    if not n_foils:
         print(f"Error: No QC2LONG_PART1 files found in '{path}'")
         return False
     
+    print(f"Found {n_foils} foil{'s' if n_foils > 1 else ''}")
     return True
 
 def run_script(script_name, *args):
@@ -183,19 +341,20 @@ def main():
     print("------------------------")
     
     # Set up tab completion
-    setup_tab_completion()
+    cache = DirectoryCache()
+    setup_tab_completion(cache)
     
     # Get data path
     while True:
-        data_path = input("\nPlease enter the data path: ").strip()
+        data_path = input(f"\n{DATA_PATH_PROMPT}").strip()
         # Convert relative path to absolute path
         data_path = os.path.abspath(os.path.expanduser(data_path))
-        if validate_path(data_path):
+        if validate_path(data_path, cache):
             break
         print("Please enter a valid path containing QC2LONG_PART1 files")
     
     # Check existing files
-    has_megger, has_iv, has_pdf = check_existing_files(data_path)
+    has_megger, has_iv, has_pdf = check_existing_files(data_path, cache)
     
     # Initialize step flags
     run_step1 = True
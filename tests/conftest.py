@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Make the modules of report/ importable by the tests (the scripts are not a package)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'report'))
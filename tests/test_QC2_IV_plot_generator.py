@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the I-V point selection: plateau_segments and
+select_iv_points give the points of the original per-sample loop
+"""
+import importlib.util
+import math
+import os
+import statistics
+import numpy as np
+import pytest
+
+# The script name is not a valid module name
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'report', 'QC2_IV-plot-generator.py')
+_spec = importlib.util.spec_from_file_location('QC2_IV_plot_generator', _path)
+iv_generator = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(iv_generator)
+
+def baseline_iv_points(voltage_list, current_list, threshold, merge_distance):
+    """The loop of the original QC2_IV-plot-generator.py, with the merge distance (5 V) as a parameter"""
+    voltage_list_to_plot = []
+    current_list_to_plot = []
+    err_current_list_to_plot = []
+    start = False
+    ramp_up = False
+    store = False
+    update_list = False
+    voltage_list_to_average = []
+    current_list_to_average = []
+
+    for j in range(800):
+        if(voltage_list[j+2]-voltage_list[j]>2):
+            ramp_up = True
+            start = False
+            store = False
+        else:
+            ramp_up = False
+
+        if(start==False and ramp_up==False and current_list[j]==0 and voltage_list[j]!=0):
+            start = True
+            voltage_list_to_average = []
+            current_list_to_average = []
+        elif(start==True and current_list[j]!=0):
+            store = True
+            voltage_list_to_average.append(voltage_list[j])
+            current_list_to_average.append(current_list[j]*1000.0)
+            update_list = True
+        elif(start==True and store==True and current_list[j]==0):
+            if(len(voltage_list_to_average)>0 and update_list==True):
+                update_list = False
+                try:
+                    if(statistics.mean(current_list_to_average)<threshold):
+                        voltage_list_to_plot.append(statistics.mean(voltage_list_to_average))
+                        current_list_to_plot.append(statistics.mean(current_list_to_average))
+                        err_current_list_to_plot.append(statistics.stdev(current_list_to_average)/math.sqrt(len(current_list_to_average)))
+                except ValueError:
+                    if voltage_list_to_plot:
+                        voltage_list_to_plot.pop(-1)
+                        current_list_to_plot.pop(-1)
+                voltage_list_to_average = []
+                current_list_to_average = []
+
+    list_idx = []
+    for i in range(0, len(voltage_list_to_plot)-1):
+        if abs(voltage_list_to_plot[i] - voltage_list_to_plot[i+1]) < merge_distance:
+            list_idx.append(i+1)
+    for idx in sorted(list_idx, reverse=True):
+        del voltage_list_to_plot[idx]
+        del current_list_to_plot[idx]
+        del err_current_list_to_plot[idx]
+    return [voltage_list_to_plot, current_list_to_plot, err_current_list_to_plot]
+
+def ramp(plateaus, rng=None, n_total=820):
+    """
+    PART1 voltage and current of a ramp over the given plateaus
+
+    Args:
+        plateaus (list): (voltage, number of samples with current, closed) per plateau;
+            an unclosed plateau has no zero-current samples at its end
+        rng (np.random.Generator): Noise of the voltage and current, None for none
+        n_total (int): Number of samples, padded with the last voltage at zero current
+    """
+    voltage, current = [0.0, 0.0], [0.0, 0.0]
+    for level, n_samples, closed in plateaus:
+        # Ramp of more than 2 V over two samples, then the zero-current start sample
+        for step in np.linspace(voltage[-1], level, 4)[1:]:
+            voltage.append(float(step))
+            current.append(0.0)
+        voltage.append(level)
+        current.append(0.0)
+        for _ in range(n_samples):
+            noise = rng.normal(0, 0.2) if rng else 0.0
+            voltage.append(round(level + noise, 2))
+            current.append(round(0.001*(1 + level/200) + (abs(rng.normal(0, 0.0003)) if rng else 0.0), 5))
+        if closed:
+            # As in the PART1 files: zero current for a few samples before the next ramp
+            voltage += [level] * 3
+            current += [0.0] * 3
+    voltage += [voltage[-1]] * (n_total - len(voltage))
+    current += [0.0] * (n_total - len(current))
+    return np.array(voltage[:n_total]), np.array(current[:n_total])
+
+def vectorised_iv_points(voltage, current, threshold, merge_distance):
+    segments = iv_generator.plateau_segments(voltage, current)
+    points = iv_generator.select_iv_points(segments, threshold, merge_distance)
+    return [segments[key][points].tolist() for key in ('voltage', 'current', 'error')]
+
+@pytest.mark.parametrize('merge_distance', [0, 5, 50])
+@pytest.mark.parametrize('threshold', [2, 7])
+def test_random_ramps_match_the_baseline(threshold, merge_distance):
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        levels = np.cumsum(rng.choice([2.0, 5.0, 50.0, 100.0], size=10))
+        plateaus = [(float(level), int(rng.choice([0, 1, 2, 5, 30])), bool(rng.random() > 0.1)) for level in levels]
+        voltage, current = ramp(plateaus, rng)
+        assert vectorised_iv_points(voltage, current, threshold, merge_distance) == \
+            baseline_iv_points(voltage.tolist(), current.tolist(), threshold, merge_distance)
+
+@pytest.mark.parametrize('plateaus, expected_voltages', [
+    # An empty plateau (no sample with current) gives no point
+    ([(100.0, 0, True), (200.0, 5, True)], [200.0]),
+    # A plateau of a single sample has no error and is dropped
+    ([(100.0, 1, True), (200.0, 5, True)], [200.0]),
+    # A plateau still running at sample 800 is never closed and dropped
+    ([(100.0, 5, True), (200.0, 900, False)], [100.0]),
+    # Points exactly merge_distance apart are kept, closer ones merged into the first
+    ([(100.0, 5, True), (105.0, 5, True), (109.0, 5, True), (112.0, 5, True)], [100.0, 105.0]),
+    # Distances are taken before dropping: 100 -> 104 -> 108 keeps only 100
+    ([(100.0, 5, True), (104.0, 5, True), (108.0, 5, True)], [100.0]),
+], ids=['empty plateau', 'single sample', 'trailing plateau', 'merge distance', 'merge chain'])
+def test_edge_cases(plateaus, expected_voltages):
+    voltage, current = ramp(plateaus)
+    points = vectorised_iv_points(voltage, current, 7, 5)
+    assert points == baseline_iv_points(voltage.tolist(), current.tolist(), 7, 5)
+    assert points[0] == expected_voltages
+
+def test_no_plateaus():
+    voltage, current = np.zeros(820), np.zeros(820)
+    segments = iv_generator.plateau_segments(voltage, current)
+    assert len(segments['voltage']) == 0
+    assert len(iv_generator.select_iv_points(segments)) == 0
+    assert vectorised_iv_points(voltage, current, 7, 5) == [[], [], []]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the QC2 long-term analysis on synthetic traces
+"""
+import numpy as np
+from QC2_analysis import analyse_discharges, hv_step_statistics, hv_steps, segment_reduce
+
+def discharge_trace():
+    """
+    One sample per second: ramp up with charging current, 850 s at 500 V with
+    three single-sample sparks and one three-sample spark, a slow ramp-down,
+    a second ramp up and a sudden trip to 0 V at sample 1250
+    """
+    rng = np.random.default_rng(0)
+    voltage = np.concatenate((np.linspace(0, 500, 51)[:-1], np.full(850, 500.0), np.linspace(500, 0, 50),
+                              np.zeros(50), np.linspace(0, 500, 51)[:-1], np.full(200, 500.0), np.zeros(50)))
+    current = 0.005 + 0.0005*rng.standard_normal(len(voltage))
+    current[:50] += 0.2
+    for k in (200, 400, 600):
+        current[k] += 0.1
+    current[800:803] += 0.1
+    return np.arange(len(voltage), dtype=np.float64), voltage, current
+
+def test_spark_and_trip_counts():
+    time, voltage, current = discharge_trace()
+    result = analyse_discharges(time, voltage, current, bin_width=300)
+    # The charging current of the ramps is no spark and the slow ramp-down no trip
+    assert result['n_sparks'] == 4
+    assert result['spark_idx'].tolist() == [200, 400, 600, 800]
+    assert result['n_trips'] == 1
+    assert result['trip_idx'].tolist() == [1250]
+    assert result['sparks_per_window'].tolist() == [1, 1, 2, 0, 0]
+    assert result['max_sparks_per_window'] == 2
+
+def test_no_events_on_flat_trace():
+    time = np.arange(500, dtype=np.float64)
+    result = analyse_discharges(time, np.full(500, 500.0), np.full(500, 0.005))
+    assert result['n_sparks'] == 0
+    assert result['n_trips'] == 0
+
+def test_segment_reduce_up_to_the_end():
+    x = np.array([3.0, -1.0, 4.0, 1.0, -5.0, 9.0])
+    starts = np.array([0, 2, 5, 1])
+    ends = np.array([2, 6, 6, 4])
+    # Ranges ending at len(x) use the padding element as their reduceat bound only
+    expected_sum = [x[s:e].sum() for s, e in zip(starts, ends)]
+    expected_max = [x[s:e].max() for s, e in zip(starts, ends)]
+    assert segment_reduce(np.add, x, starts, ends).tolist() == expected_sum
+    assert segment_reduce(np.maximum, x, starts, ends).tolist() == expected_max
+
+def test_hv_step_statistics():
+    # 2 s per sample: 50 samples at 100 V, a 4 sample ramp with charging current,
+    # 50 samples at 200 V (half of them leaking 10 nA) and an HV-off tail up to the end
+    voltage = np.concatenate((np.full(50, 100.0), np.linspace(100, 200, 6)[1:-1], np.full(50, 200.0), np.zeros(30)))
+    current = np.concatenate((np.full(50, 0.002), np.full(4, 0.5), np.full(25, 0.004), np.full(25, 0.010), np.zeros(30)))
+    time = 2.0*np.arange(len(voltage))
+    starts, ends = hv_steps(voltage)
+    assert starts.tolist() == [0, 54, 104]
+    assert ends.tolist() == [50, 104, 134]
+    steps = hv_step_statistics(time, voltage, current)
+    assert steps['start'].tolist() == [0.0, 108.0]
+    assert steps['n_samples'].tolist() == [50, 50]
+    assert steps['duration'].tolist() == [100.0, 100.0]
+    assert np.allclose(steps['voltage'], [100.0, 200.0])
+    assert np.allclose(steps['mean'], [0.002, 0.007])
+    assert np.allclose(steps['stdev'], [0.0, np.std(current[54:104], ddof=1)])
+    assert steps['max'].tolist() == [0.002, 0.010]
+    assert steps['time_above'].tolist() == [0.0, 50.0]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the campaign work queue: leases keep other workers off a
+running job, expired leases are reclaimed and only the lease holder finishes a job
+"""
+import types
+import threading
+import pytest
+import QC2_campaign
+from QC2_campaign import claim_job, connect_queue, enqueue_campaign, finish_job, renew_lease
+
+LEASE = 10.0
+MAX_ATTEMPTS = 3
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() of the queue functions"""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(QC2_campaign, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+@pytest.fixture
+def queue_path(tmp_path):
+    path = str(tmp_path / QC2_campaign.QUEUE_FILENAME)
+    conn = connect_queue(path)
+    conn.executemany('INSERT INTO jobs (data_folder, foil_name, part1_file) VALUES (?, ?, ?)',
+                     [('/data/20241204', foil, f'QC2LONG_PART1_{foil}_20241204_10-00.txt') for foil in ('A', 'B')])
+    conn.close()
+    return path
+
+def job_state(queue_path, job_id):
+    conn = connect_queue(queue_path)
+    try:
+        return conn.execute('SELECT status, attempts, worker, lease_expires, message FROM jobs WHERE id=?',
+                            (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+def test_leased_jobs_are_not_claimed_twice(queue_path, clock):
+    # Separate connections, as separate worker processes use
+    first, second, third = (connect_queue(queue_path) for _ in range(3))
+    assert claim_job(first, 'host:1', LEASE, MAX_ATTEMPTS)[:3] == (1, '/data/20241204', 'A')
+    assert claim_job(second, 'host:2', LEASE, MAX_ATTEMPTS)[2] == 'B'
+    clock.now += LEASE - 1
+    assert claim_job(third, 'host:3', LEASE, MAX_ATTEMPTS) is None
+    assert job_state(queue_path, 1) == ('running', 1, 'host:1', 1000.0 + LEASE, None)
+
+def test_expired_lease_is_reclaimed(queue_path, clock):
+    conn = connect_queue(queue_path)
+    claim_job(conn, 'host:1', LEASE, MAX_ATTEMPTS)
+    claim_job(conn, 'host:2', LEASE, MAX_ATTEMPTS)
+    finish_job(conn, 2, 'host:2', True, 'ok', MAX_ATTEMPTS)
+    clock.now += LEASE + 1
+    assert claim_job(conn, 'host:3', LEASE, MAX_ATTEMPTS)[0] == 1
+    assert job_state(queue_path, 1) == ('running', 2, 'host:3', clock.now + LEASE, None)
+    # The worker that lost the lease cannot finish the job any more
+    finish_job(conn, 1, 'host:1', False, 'late', MAX_ATTEMPTS)
+    assert job_state(queue_path, 1)[:3] == ('running', 2, 'host:3')
+    finish_job(conn, 1, 'host:3', True, 'ok', MAX_ATTEMPTS)
+    assert job_state(queue_path, 1) == ('done', 2, 'host:3', None, 'ok')
+
+def test_lease_expiring_too_often_fails_the_job(queue_path, clock):
+    conn = connect_queue(queue_path)
+    for attempt in range(MAX_ATTEMPTS):
+        assert claim_job(conn, f'host:{attempt}', LEASE, MAX_ATTEMPTS)[0] == 1
+        clock.now += LEASE + 1
+    # The expired job is given up and the next one claimed instead
+    assert claim_job(conn, 'host:9', LEASE, MAX_ATTEMPTS)[0] == 2
+    assert job_state(queue_path, 1)[:2] == ('failed', MAX_ATTEMPTS)
+    assert job_state(queue_path, 1)[4] == 'lease expired too often'
+
+def test_finish_job(queue_path, clock):
+    conn = connect_queue(queue_path)
+    assert claim_job(conn, 'host:1', LEASE, 2)[0] == 1
+    finish_job(conn, 1, 'host:1', True, 'ok', 2)
+    assert job_state(queue_path, 1) == ('done', 1, 'host:1', None, 'ok')
+    # Failed jobs are retried until max_attempts
+    assert claim_job(conn, 'host:1', LEASE, 2)[0] == 2
+    finish_job(conn, 2, 'host:1', False, 'missing input files', 2)
+    assert job_state(queue_path, 2)[:2] == ('pending', 1)
+    assert claim_job(conn, 'host:2', LEASE, 2)[0] == 2
+    finish_job(conn, 2, 'host:2', False, 'missing input files', 2)
+    assert job_state(queue_path, 2) == ('failed', 2, 'host:2', None, 'missing input files')
+    assert claim_job(conn, 'host:2', LEASE, 2) is None
+
+def test_renew_lease(queue_path, capsys):
+    conn = connect_queue(queue_path)
+    job_id = claim_job(conn, 'host:1', 0.3, MAX_ATTEMPTS)[0]
+    claimed_until = job_state(queue_path, job_id)[3]
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=renew_lease, args=(queue_path, job_id, 'host:1', 0.3, stop))
+    heartbeat.start()
+    stop.wait(0.5)
+    renewed_until = job_state(queue_path, job_id)[3]
+    assert renewed_until > claimed_until
+    # Another worker took the job over: the heartbeat stops
+    conn.execute("UPDATE jobs SET worker='host:2' WHERE id=?", (job_id,))
+    heartbeat.join(5)
+    assert not heartbeat.is_alive()
+    assert f'[host:1] Lost the lease of job {job_id}' in capsys.readouterr().out
+
+def test_enqueue_is_idempotent(tmp_path):
+    for folder in ('2024/20241204', '2024/20241205', '2024/20241205/plots'):
+        (tmp_path / folder).mkdir(parents=True)
+    for folder, foil in (('2024/20241204', 'A'), ('2024/20241204', 'B'), ('2024/20241205', 'A'),
+                         ('2024/20241205/plots', 'C')):
+        (tmp_path / folder / f'QC2LONG_PART1_{foil}_20241204_10-00.txt').write_text('')
+        (tmp_path / folder / f'QC2LONG_PART1_{foil}_20241204_10-00_IVplot.txt').write_text('')
+    conn = connect_queue(str(tmp_path / QC2_campaign.QUEUE_FILENAME))
+    assert enqueue_campaign(conn, str(tmp_path)) == (2, 3)
+    assert enqueue_campaign(conn, str(tmp_path)) == (2, 0)
+    assert [row[0] for row in conn.execute('SELECT foil_name FROM jobs ORDER BY id')] == ['A', 'B', 'A']
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the QC2 data model: monitor time windows, the Part 2
+windows derived from the PART1 time stamps and the megger table
+"""
+import pytest
+from QC2_dataset import FoilDataset, MonitorIndex, assign_part2_windows
+
+MONITOR_FILE = 'QC2_all_channels_monitor_20241204_09-30'
+
+def write_monitor(folder, times):
+    lines = ['HV monitor', 'Time\t' + '\t'.join(f'V{k}' for k in range(8)) + '\t' + '\t'.join(f'I{k}' for k in range(8))]
+    for row, time in enumerate(times):
+        # Channel k reads 100*k + row volts, so every sample can be traced back to its file row
+        lines.append('\t'.join([str(time)] + [str(100*k + row) for k in range(8)] + ['0.002'] * 8))
+    path = folder / (MONITOR_FILE + '.txt')
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+def write_part1(folder, foil, channel, stamp, duration):
+    part1_file = f'QC2LONG_PART1_{foil}_{stamp}'
+    rows = ''.join(f'500\t0.001\t{t}\n' for t in range(0, duration + 1, 10))
+    (folder / (part1_file + '.txt')).write_text(f'Channel:\tCH{channel}\nFoil:\t{foil}\nOperator:\tQC\n'
+                                                f'Date:\t20241204\nRH:\t30\nVoltage (V)\tCurrent (uA)\tTime (s)\n'
+                                                + rows)
+    return part1_file
+
+@pytest.mark.parametrize('t_start, t_end, expected', [
+    (None, None, [0, 10, 10, 20, 30]),
+    (10, 20, [10, 10, 20]),        # Both ends are included, with all samples at equal times
+    (5, 25, [10, 10, 20]),
+    (None, 10, [0, 10, 10]),
+    (20, None, [20, 30]),
+    (11, 19, []),                  # Between two samples
+    (40, 50, []),                  # After the last sample
+    (-10, -1, []),                 # Before the first sample
+    (30, 10, []),                  # Reversed
+])
+def test_monitor_window(tmp_path, t_start, t_end, expected):
+    monitor = MonitorIndex(write_monitor(tmp_path, [0, 10, 10, 20, 30]))
+    window = monitor.window(t_start, t_end)
+    assert window.start <= window.stop
+    assert monitor.time[window].tolist() == expected
+    voltage, current, time = monitor.channel(3, t_start, t_end)
+    assert time.tolist() == expected and len(voltage) == len(current) == len(expected)
+    # Views into the shared arrays, not copies
+    assert voltage.base is not None and current.base is not None
+
+def test_unsorted_monitor_file(tmp_path):
+    monitor = MonitorIndex(write_monitor(tmp_path, [20, 0, 30, 10, 10]))
+    assert monitor.time.tolist() == [0, 10, 10, 20, 30]
+    # The samples move with their times; equal times keep the file order
+    assert monitor.rows.tolist() == [1, 3, 4, 0, 2]
+    assert monitor.voltage[2].tolist() == [201, 203, 204, 200, 202]
+    assert monitor.file_rows(10, 20).tolist() == [3, 4, 0]
+    assert monitor.channel(2, 10, 20)[0].tolist() == [203, 204, 200]
+
+def test_sorted_monitor_file_rows(tmp_path):
+    monitor = MonitorIndex(write_monitor(tmp_path, [0, 10, 20]))
+    assert monitor.rows is None
+    assert monitor.file_rows(5, None) == slice(1, 3)
+
+def test_part2_windows_are_derived_lazily(tmp_path):
+    monitor = MonitorIndex(write_monitor(tmp_path, range(0, 4*3600, 60)))
+    foils = [FoilDataset(str(tmp_path), write_part1(tmp_path, foil, channel, stamp, 600),
+                         all_channels_file=MONITOR_FILE, monitor=monitor)
+             for foil, channel, stamp in [('A', 1, '20241204_11-30'), ('B', 1, '20241204_10-30'),
+                                          ('C', 2, '20241204_10-00')]]
+    assign_part2_windows(foils)
+    # Only the file names and headers are read up front
+    assert all(foil._part1 is None and foil.part2_window is None for foil in foils)
+    a, b, c = foils
+    assert b.part2[2][0] == 3600 + 600 and b.part2[2][-1] == 7200
+    assert b.part2_window == (3600 + 600, 7200)
+    assert a.part2_window is None and a._part1 is None
+    assert a.part2[2][0] == 7200 + 600 and a.part2_window == (7200 + 600, None)
+    assert c.part2[2][0] == 1800 + 600 and c.part2_window == (1800 + 600, None)
+
+def test_empty_part2_window_uses_the_whole_monitor_file(tmp_path, capsys):
+    monitor = MonitorIndex(write_monitor(tmp_path, range(0, 3600, 60)))
+    foil = FoilDataset(str(tmp_path), write_part1(tmp_path, 'A', 1, '20241204_10-30', 3600),
+                       all_channels_file=MONITOR_FILE, monitor=monitor)
+    assign_part2_windows([foil])
+    assert len(foil.part2[2]) == len(monitor)
+    assert foil.part2_window is None
+    assert 'no monitor data' in capsys.readouterr().out
+
+def test_megger_rows(tmp_path):
+    (tmp_path / 'QC2FAST_A_20241204.txt').write_text('Time (minutes)\tImpedance (GOhm)\tSparks\n'
+                                                     '0.5\t35\t0\n1\t34.5\t3\n2\t20.25\t2.9999999\n')
+    foil = FoilDataset(str(tmp_path), 'QC2LONG_PART1_A_20241204_10-00', megger_file='QC2FAST_A_20241204')
+    assert foil.megger_rows() == [['Time (minutes)', 'Impedance (GOhm)', 'Sparks'],
+                                  ['0.5', '35.0', '0'], ['1', '34.5', '3'], ['2', '20.25', '3']]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the merged campaign report: one entry per test (retests
+included) and foil pages with the sections of the single-foil report
+"""
+from QC2_dataset import FoilDataset
+from QC2_merged_report import campaign_entries, entry_label, foil_page
+from QC2_report import analyse_foil, report_sections
+
+MONITOR_FILE = 'QC2_all_channels_monitor_20241204_09-30'
+
+def write_foil(folder, foil, stamps, megger=True):
+    for stamp in stamps:
+        part1_file = f'QC2LONG_PART1_{foil}_{stamp}'
+        rows = ''.join(f'{50*(t//60)}\t0.001\t{t}\n' for t in range(0, 600, 10))
+        (folder / f'{part1_file}.txt').write_text(f'Channel:\tCH1\nFoil:\t{foil}\nOperator:\tQC\nDate:\t20241204\n'
+                                                  f'RH:\t30\nVoltage (V)\tCurrent (uA)\tTime (s)\n' + rows)
+        (folder / f'{part1_file}_IVplot.txt').write_text('Voltage (V)\tCurrent (nA)\tError_current (nA)\n'
+                                                         '100.0\t1.5\t0.1\n200.0\t2.5\t0.2\n')
+    if megger:
+        (folder / f'QC2FAST_{foil}_20241204.txt').write_text('Time (minutes)\tImpedance (GOhm)\tSparks\n0.5\t35.0\t0\n')
+    (folder / f'QC2NOTES_{foil}.txt').write_text('Notes\nAll good\n')
+
+def write_monitor(folder):
+    rows = ''.join(f'{t}\t' + '\t'.join(['500'] * 8 + ['0.002'] * 8) + '\n' for t in range(0, 7200, 60))
+    (folder / f'{MONITOR_FILE}.txt').write_text('HV monitor\nTime\n' + rows)
+
+def test_one_entry_per_test(tmp_path):
+    write_foil(tmp_path, 'B-0001', ['20241204_11-00'])
+    write_foil(tmp_path, 'A-0000', ['20241204_13-00', '20241204_10-00'])
+    write_foil(tmp_path, 'C-0002', ['20241204_12-00'], megger=False)
+    write_monitor(tmp_path)
+    entries = campaign_entries([str(tmp_path)])
+    assert [part1_file for _, part1_file in entries] == [
+        'QC2LONG_PART1_A-0000_20241204_10-00.txt',
+        'QC2LONG_PART1_A-0000_20241204_13-00.txt',
+        'QC2LONG_PART1_B-0001_20241204_11-00.txt',
+    ]
+    assert entry_label(entries[1][1]) == 'A-0000 20241204_13-00'
+    assert entry_label('QC2LONG_PART1_A-0000_20241204_13-00') == 'A-0000 20241204_13-00'
+
+def test_foil_page_has_the_report_sections(tmp_path):
+    write_foil(tmp_path, 'A-0000', ['20241204_10-00'])
+    write_monitor(tmp_path)
+    foil = FoilDataset.from_part1_file(str(tmp_path), 'QC2LONG_PART1_A-0000_20241204_10-00.txt').load()
+    analysis = analyse_foil(foil)
+    texts = [text.get_text() for text in foil_page(foil, analysis, 2, 'campaign').texts]
+    titles = [title for title, _, _ in report_sections(foil, analysis)]
+    assert [text for text in texts if text in titles] == titles
+    assert texts[0] == 'GE21 QC2 Report: A-0000 20241204_10-00'
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the plot cache: keys follow the plotted data and style,
+the directory stays within its size limit and corrupt images are rendered again
+"""
+import os
+import numpy as np
+import pytest
+from QC2_plot_cache import PNG_END, PNG_SIGNATURE, PlotCache, render_cached
+
+def png(size):
+    """Bytes passing the PNG check, of the given total size"""
+    return PNG_SIGNATURE + b'\0' * (size - len(PNG_SIGNATURE) - len(PNG_END)) + PNG_END
+
+def render_to(path, data, calls):
+    def render():
+        calls.append(path)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return render
+
+def test_key_follows_the_inputs():
+    voltage, time = np.arange(5.0), np.arange(5.0) * 10
+    key = PlotCache.key('VI-t', [voltage, time], style=1)
+    assert key == PlotCache.key('VI-t', [voltage.copy(), time.copy()], style=1)
+    # Non-contiguous views hash their values
+    assert key == PlotCache.key('VI-t', [np.arange(0, 5, 0.5)[::2], time], style=1)
+    changed = voltage.copy()
+    changed[3] += 1e-9
+    assert len({key,
+                PlotCache.key('I-V', [voltage, time], style=1),
+                PlotCache.key('VI-t', [changed, time], style=1),
+                PlotCache.key('VI-t', [voltage.astype(np.float32), time], style=1),
+                PlotCache.key('VI-t', [voltage.reshape(1, 5), time], style=1),
+                PlotCache.key('VI-t', [voltage[:4], time], style=1),
+                PlotCache.key('VI-t', [time, voltage], style=1),
+                PlotCache.key('VI-t', [voltage, time], style=2),
+                PlotCache.key('VI-t', [voltage, time], style=1, threshold=7),
+                PlotCache.key('VI-t', [voltage, time])}) == 10
+    # Parameter order does not matter
+    assert PlotCache.key('I-V', [], style=1, threshold=7) == PlotCache.key('I-V', [], threshold=7, style=1)
+
+def test_render_cached(tmp_path):
+    cache = PlotCache(str(tmp_path / 'cache'))
+    calls = []
+    path = str(tmp_path / 'plot.png')
+    arrays = [np.arange(3.0)]
+    assert not render_cached(cache, 'VI-t', arrays, {'style': 1}, path, render_to(path, png(100), calls))
+    os.remove(path)
+    assert render_cached(cache, 'VI-t', arrays, {'style': 1}, path, render_to(path, png(100), calls))
+    assert len(calls) == 1 and open(path, 'rb').read() == png(100)
+    assert not render_cached(cache, 'VI-t', arrays, {'style': 2}, path, render_to(path, png(100), calls))
+    assert len(calls) == 2
+    assert not render_cached(None, 'VI-t', arrays, {'style': 1}, path, render_to(path, png(100), calls))
+    assert len(calls) == 3
+
+def cache_files(cache):
+    return sorted(name for name in os.listdir(cache.cache_dir) if name.endswith('.png'))
+
+def test_lru_eviction_keeps_the_size_limit(tmp_path):
+    cache = PlotCache(str(tmp_path / 'cache'), max_bytes=2500)
+    source = tmp_path / 'plot.png'
+    source.write_bytes(png(1000))
+    for age, key in enumerate(['a', 'b']):
+        cache.store(key, str(source))
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+    # A hit marks 'a' as recently used, so 'b' is the oldest entry
+    assert cache.fetch('a', str(tmp_path / 'copy.png'))
+    cache.store('c', str(source))
+    assert cache_files(cache) == ['a.png', 'c.png']
+    total = sum(os.path.getsize(os.path.join(cache.cache_dir, name)) for name in cache_files(cache))
+    assert total <= cache.max_bytes
+    # A smaller limit applies when the cache is opened
+    cache = PlotCache(cache.cache_dir, max_bytes=1000)
+    assert len(cache_files(cache)) == 1
+
+def test_oversized_image_is_not_kept(tmp_path):
+    cache = PlotCache(str(tmp_path / 'cache'), max_bytes=500)
+    source = tmp_path / 'plot.png'
+    source.write_bytes(png(1000))
+    cache.store('a', str(source))
+    assert cache_files(cache) == []
+    assert not cache.fetch('a', str(tmp_path / 'copy.png'))
+
+@pytest.mark.parametrize('cached', [b'', b'not a png', png(100)[:60], png(100)[8:]],
+                         ids=['empty', 'garbage', 'truncated', 'no signature'])
+def test_corrupt_image_is_rendered_again(tmp_path, capsys, cached):
+    cache = PlotCache(str(tmp_path / 'cache'))
+    arrays = [np.arange(3.0)]
+    key = cache.key('I-V', arrays, style=1)
+    with open(cache._path(key), 'wb') as f:
+        f.write(cached)
+    path = str(tmp_path / 'plot.png')
+    calls = []
+    assert not render_cached(cache, 'I-V', arrays, {'style': 1}, path, render_to(path, png(100), calls))
+    assert calls == [path]
+    assert 'corrupt cached image' in capsys.readouterr().out
+    # The fresh image replaced the corrupt one
+    assert open(cache._path(key), 'rb').read() == png(100)
+    assert render_cached(cache, 'I-V', arrays, {'style': 1}, path, render_to(path, png(100), calls))
+    assert len(calls) == 1
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the QC2 preflight: valid directories pass, malformed rows,
+wrong column counts and broken or missing headers are reported with their lines
+"""
+import pytest
+import QC2_preflight
+from QC2_preflight import check_directory, check_table, preflight
+
+MONITOR_FILE = 'QC2_all_channels_monitor_20241204_09-30.txt'
+PART1_FILE = 'QC2LONG_PART1_A-0000_20241204_10-00.txt'
+PART1_HEADER = 'Channel:\tCH1\nFoil:\tA-0000\nOperator:\tQC\nDate:\t20241204\nRH:\t30\nVoltage (V)\tCurrent (uA)\tTime (s)\n'
+
+def write_directory(folder):
+    (folder / PART1_FILE).write_text(PART1_HEADER + ''.join(f'500\t0.001\t{t}\n' for t in range(0, 600, 10)))
+    (folder / PART1_FILE.replace('.txt', '_IVplot.txt')).write_text('Voltage (V)\tCurrent (nA)\tError_current (nA)\n'
+                                                                    '100.0\t1.5\t0.1\n')
+    (folder / 'QC2FAST_A-0000_20241204.txt').write_text('Time (minutes)\tImpedance (GOhm)\tSparks\n0.5\t35.0\t0\n')
+    (folder / 'QC2NOTES_A-0000.txt').write_text('Notes\nAll good\n')
+    rows = ''.join(f'{t}\t' + '\t'.join(['500'] * 8 + ['0.002'] * 8) + '\n' for t in range(0, 7200, 60))
+    (folder / MONITOR_FILE).write_text('HV monitor\nTime\n' + rows)
+    return str(folder)
+
+def messages(report):
+    return [f'{level}: {message}' for problems in report.problems.values() for level, message in problems]
+
+def test_valid_directory_passes(tmp_path, capsys):
+    report, n_foils = check_directory(write_directory(tmp_path))
+    assert n_foils == 1 and report.n_errors == report.n_warnings == 0 and report.problems == {}
+    assert preflight(str(tmp_path)) == 0
+    assert 'Checked 1 foils: 0 errors, 0 warnings' in capsys.readouterr().out
+
+def test_blank_lines_and_crlf_pass(tmp_path):
+    write_directory(tmp_path)
+    (tmp_path / PART1_FILE).write_bytes((PART1_HEADER + '500\t0.001\t0\n\n500\t0.001\t10\n').replace('\n', '\r\n').encode())
+    assert check_directory(str(tmp_path))[0].problems == {}
+
+def test_bad_rows_are_reported_with_their_lines(tmp_path, capsys):
+    write_directory(tmp_path)
+    with open(tmp_path / PART1_FILE, 'a') as f:
+        f.write('500\t0.001\n')              # Line 67
+        f.write('500\tn/a\t610\n')           # Line 68
+        f.write('500\t0.001\t620\t1\n')      # Line 69
+    with open(tmp_path / MONITOR_FILE, 'a') as f:
+        f.write('7200\t500\n')
+    report, _ = check_directory(str(tmp_path))
+    assert messages(report) == [
+        f'ERROR: {MONITOR_FILE} line 123: 2 columns instead of 17',
+        f'ERROR: {PART1_FILE} line 67: 2 columns instead of 3',
+        f"ERROR: {PART1_FILE} line 68: non-numeric value 'n/a'",
+        f'ERROR: {PART1_FILE} line 69: 4 columns instead of 3',
+    ]
+    assert preflight(str(tmp_path)) == 1
+    assert 'Checked 1 foils: 4 errors, 0 warnings' in capsys.readouterr().out
+
+def test_wrong_column_count_of_a_whole_file(tmp_path):
+    write_directory(tmp_path)
+    (tmp_path / 'QC2FAST_A-0000_20241204.txt').write_text('Time (minutes)\tImpedance (GOhm)\n0.5\t35.0\n1\t34.0\n')
+    assert messages(check_directory(str(tmp_path))[0]) == [
+        'ERROR: QC2FAST_A-0000_20241204.txt line 2: 2 columns instead of 3',
+        'ERROR: QC2FAST_A-0000_20241204.txt line 3: 2 columns instead of 3',
+    ]
+
+@pytest.mark.parametrize('chunk_lines', [1, 4, 65536])
+def test_line_numbers_across_chunks(tmp_path, monkeypatch, chunk_lines):
+    monkeypatch.setattr(QC2_preflight, 'CHUNK_LINES', chunk_lines)
+    path = tmp_path / 'table.txt'
+    path.write_text('header\n1\t2\n\n3\t4\n5\n6\t7\n8\tx\n9\t10\n')
+    assert check_table(str(path), 1, 2) == (6, [(5, '1 columns instead of 2'), (7, "non-numeric value 'x'")])
+
+def test_bad_rows_beyond_the_limit_are_counted(tmp_path):
+    write_directory(tmp_path)
+    with open(tmp_path / PART1_FILE, 'a') as f:
+        f.write('500\n' * 8)
+    assert messages(check_directory(str(tmp_path))[0])[-2:] == [
+        f'ERROR: {PART1_FILE} line 71: 1 columns instead of 3',
+        f'ERROR: {PART1_FILE}: 3 more bad rows',
+    ]
+
+def test_broken_header(tmp_path):
+    write_directory(tmp_path)
+    # No channel value, a key without value and no column names line
+    (tmp_path / PART1_FILE).write_text('Channel:\nFoil:\tA-0000\nOperator:\tQC\nDate\nRH:\t30\n\n500\t0.001\t0\n')
+    assert messages(check_directory(str(tmp_path))[0]) == [
+        f"ERROR: {PART1_FILE} line 1: expected at least 2 tab separated fields, found 'Channel:'",
+        f"ERROR: {PART1_FILE} line 4: expected at least 2 tab separated fields, found 'Date'",
+        f'ERROR: {PART1_FILE} line 6: column names line missing',
+        f"ERROR: {PART1_FILE}: channel '' is not CH0 to CH7",
+    ]
+
+def test_channel_out_of_range(tmp_path):
+    write_directory(tmp_path)
+    (tmp_path / PART1_FILE).write_text(PART1_HEADER.replace('CH1', 'CH9') + '500\t0.001\t0\n')
+    assert messages(check_directory(str(tmp_path))[0]) == [f"ERROR: {PART1_FILE}: channel 'CH9' is not CH0 to CH7"]
+
+def test_missing_data_rows_and_files(tmp_path):
+    write_directory(tmp_path)
+    (tmp_path / PART1_FILE).write_text(PART1_HEADER)
+    (tmp_path / 'QC2NOTES_A-0000.txt').unlink()
+    (tmp_path / PART1_FILE.replace('.txt', '_IVplot.txt')).unlink()
+    assert messages(check_directory(str(tmp_path))[0]) == [
+        f'ERROR: {PART1_FILE}: no data rows',
+        'ERROR: QC2NOTES_A-0000.txt is missing',
+        'ERROR: no IVplot file, run QC2_IV-plot-generator.py',
+    ]
+
+def test_missing_megger_and_monitor_files(tmp_path):
+    write_directory(tmp_path)
+    (tmp_path / 'QC2FAST_A-0000_20241204.txt').unlink()
+    (tmp_path / MONITOR_FILE).unlink()
+    report, _ = check_directory(str(tmp_path))
+    assert report.problems == {
+        str(tmp_path): [('ERROR', 'no QC2_all_channels_monitor file')],
+        'A-0000': [('ERROR', 'no QC2FAST (megger) file, run QC2_megger_generator.py')],
+    }
+
+def test_not_a_directory(tmp_path):
+    report, n_foils = check_directory(str(tmp_path / 'missing'))
+    assert n_foils == 0 and messages(report) == ['ERROR: not a directory']
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the QC2 output writers: the QC2LONG_PART2 file is byte for
+byte the file the original report script wrote
+"""
+import csv
+import numpy as np
+from QC2_dataset import FoilDataset
+from QC2_writers import sidecar_path, write_part2
+
+PART1_FILE = 'QC2LONG_PART1_TEST-01_20241204_12-00'
+MONITOR_FILE = 'QC2_all_channels_monitor_20241204_11-30'
+PART1 = ('Channel:\tCH3\nFoil:\tTEST-01\nOperator:\tQC\nDate:\t2024-12-04\nRH:\t35\n'
+         'Voltage (V)\tCurrent (uA)\tTime (s)\n0\t0\t0.5\n')
+# Values float32 cannot hold, integers without a decimal point and exponents
+TOKENS = ['0', '1500', '499.87654321', '0.123456789012345', '1e-05', '-0.0', '3.0E+2']
+
+def monitor_text(times):
+    lines = ['Time\t' + '\t'.join(f'V{k}' for k in range(8)) + '\t' + '\t'.join(f'I{k}' for k in range(8)),
+             's' + '\tV'*8 + '\tuA'*8]
+    for row, time in enumerate(times):
+        values = [TOKENS[(row + k) % len(TOKENS)] for k in range(16)]
+        lines.append('\t'.join([time] + values))
+    return '\r\n'.join(lines) + '\r\n'
+
+def baseline_part2(data_folder, path):
+    """The writer of the original QC2_report.py, which copied the monitor text"""
+    with open(data_folder / (PART1_FILE + '.txt')) as f:
+        description_list = list(csv.reader(f, delimiter='\t'))[:5]
+    CH_number = int(description_list[0][1][2])
+    with open(data_folder / (MONITOR_FILE + '.txt')) as f:
+        data_list_allCH = list(csv.reader(f, delimiter='\t'))
+    del data_list_allCH[0:2]
+    QC2_part2_list_to_save = []
+    for i in range(len(description_list)-1):
+        QC2_part2_list_to_save.append([description_list[i][0], description_list[i][1], '\t'])
+    QC2_part2_list_to_save.append(['Time_stamp:', MONITOR_FILE[25:39], '\t'])
+    QC2_part2_list_to_save.append(['Voltage (V)', 'Current (uA)', 'Time (s)'])
+    for row in data_list_allCH:
+        QC2_part2_list_to_save.append([row[CH_number+1], row[CH_number+9], row[0]])
+    np.savetxt(path, QC2_part2_list_to_save, delimiter='\t', fmt='%s')
+
+def write_foil_part2(data_folder, path, part2_window=None, sidecar=False):
+    """Write the file as QC2_report.write_foil_outputs does"""
+    foil = FoilDataset(str(data_folder), PART1_FILE, all_channels_file=MONITOR_FILE, part2_window=part2_window)
+    rows = foil.part2_rows
+    write_part2(str(path), foil.header, MONITOR_FILE[25:39], foil.monitor.path, foil.channel, rows, foil.part2,
+                sidecar=sidecar)
+    return foil
+
+def make_folder(tmp_path, times):
+    (tmp_path / (PART1_FILE + '.txt')).write_text(PART1)
+    (tmp_path / (MONITOR_FILE + '.txt')).write_bytes(monitor_text(times).encode())
+    return tmp_path
+
+def test_part2_matches_the_baseline_writer(tmp_path):
+    data_folder = make_folder(tmp_path, [str(t) for t in (0, 1.5, 2, 3600.25, 7200.000001, 86400)])
+    baseline, written = tmp_path / 'baseline.txt', tmp_path / 'written.txt'
+    baseline_part2(data_folder, baseline)
+    write_foil_part2(data_folder, written, sidecar=True)
+    assert written.read_bytes() == baseline.read_bytes()
+    # The sidecar holds the parsed values of the same rows
+    binary = np.load(sidecar_path(str(written)))
+    assert binary['time'].tolist() == [0, 1.5, 2, 3600.25, 7200.000001, 86400]
+    assert binary['voltage'][0] == np.float32(float(TOKENS[3]))
+
+def test_part2_window_keeps_the_monitor_text(tmp_path):
+    # Out of time order: the window is taken in time order, the values as written
+    times = ['10', '0', '30', '20', '40']
+    data_folder = make_folder(tmp_path, times)
+    baseline, written = tmp_path / 'baseline.txt', tmp_path / 'written.txt'
+    baseline_part2(data_folder, baseline)
+    write_foil_part2(data_folder, written, part2_window=(10, 30))
+    header = baseline.read_text().splitlines()[:6]
+    rows = {line.split('\t')[2]: line for line in baseline.read_text().splitlines()[6:]}
+    assert written.read_text().splitlines() == header + [rows['10'], rows['20'], rows['30']]
+
+def test_empty_part2_window(tmp_path):
+    data_folder = make_folder(tmp_path, ['0', '1', '2'])
+    written = tmp_path / 'written.txt'
+    write_foil_part2(data_folder, written, part2_window=(5, 10))
+    assert len(written.read_text().splitlines()) == 6
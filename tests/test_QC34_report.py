@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the QC3 time constant windows: the cumulative sum fits of
+sliding_log_fits match np.polyfit on each window, and qc3_window finds the
+samples the original exact lookups found
+"""
+import warnings
+import numpy as np
+import pytest
+from QC34_report import QC3_END, QC3_START, qc3_window, sliding_log_fits
+
+def polyfit_slopes(time, values, window, step, min_samples):
+    """Slope of np.polyfit(time, log(values)) per window, NaN below min_samples or 2 distinct times"""
+    starts = time[0] + step*np.arange(int((time[-1] - time[0] - window) // step) + 1)
+    slopes, counts = [], []
+    for start in starts:
+        selected = (time >= start) & (time <= start + window) & (values > 0)
+        counts.append(int(selected.sum()))
+        if selected.sum() < max(min_samples, 2) or len(np.unique(time[selected])) < 2:
+            slopes.append(np.nan)
+            continue
+        slopes.append(np.polyfit(time[selected], np.log(values[selected]), 1)[0])
+    return starts + window/2, np.array(slopes), np.array(counts)
+
+def irregular_series(rng, n):
+    """Decaying pressure with irregular sampling, gaps, repeated times and non-positive values"""
+    time = np.sort(np.concatenate([rng.uniform(0, 2, n), rng.uniform(3.5, 4, 5), np.full(4, 1.5)]))
+    time = time[(time < 2.5) | (time > 3.5)]  # A gap longer than the window
+    values = 26*np.exp(-time/5) + rng.normal(0, 0.05, len(time))
+    values[rng.choice(len(time), 10, replace=False)] = rng.choice([0.0, -1.0], 10)
+    return time, values
+
+@pytest.mark.parametrize('window, step, min_samples', [
+    (0.25, 1/60, 10),
+    (0.25, 1/60, 1),      # Windows of a single sample give NaN
+    (0.05, 0.01, 2),      # Windows of 0 and 1 samples in the sparse parts
+    (1.0, 0.3, 3),
+])
+def test_sliding_fits_match_polyfit(window, step, min_samples):
+    rng = np.random.default_rng(7)
+    time, values = irregular_series(rng, 400)
+    centres, slopes, n = sliding_log_fits(time, values, window, step, min_samples)
+    expected_centres, expected_slopes, expected_n = polyfit_slopes(time, values, window, step, min_samples)
+    assert np.allclose(centres, expected_centres, rtol=0, atol=1e-12)
+    assert n.tolist() == expected_n.tolist()
+    assert np.array_equal(np.isnan(slopes), np.isnan(expected_slopes))
+    assert np.allclose(slopes, expected_slopes, rtol=1e-6, atol=1e-9, equal_nan=True)
+    # The series has windows with fewer than 2 points, all NaN
+    assert (n < 2).any() and np.isnan(slopes[n < 2]).all()
+
+def test_sliding_fits_without_distinct_times():
+    time = np.array([0.0, 1.0, 1.0, 1.0, 3.0])
+    centres, slopes, n = sliding_log_fits(time, np.full(5, 20.0), 0.5, 0.5, min_samples=2)
+    # The windows [0.5, 1] and [1, 1.5] hold three samples at the same time: no slope
+    assert n.tolist() == [1, 3, 3, 0, 0, 1] and np.isnan(slopes).all()
+
+def test_sliding_fits_of_an_exact_exponential():
+    time = np.linspace(0, 2, 121)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        _, slopes, n = sliding_log_fits(time, 26*np.exp(-time/4), 0.25, 1/60)
+    assert np.allclose(slopes, -1/4, rtol=1e-9) and (n >= 15).all()
+
+@pytest.mark.parametrize('time', [np.empty(0), np.array([0.0, 0.1, 0.2])])
+def test_sliding_fits_of_short_series(time):
+    centres, slopes, n = sliding_log_fits(time, np.ones(len(time)), 0.25, 1/60)
+    assert len(centres) == len(slopes) == len(n) == 0
+
+def test_qc3_window():
+    time = np.arange(0.0, 3700.0, 0.5)
+    # The indices the original np.where(time == 1.00) and np.where(time == 3600.00) lookups gave
+    assert qc3_window(time) == (np.where(time == QC3_START)[0][0], np.where(time == QC3_END)[0][0])
+    # Without exact samples the closest ones are used, the earlier one on a tie
+    time = np.array([0.0, 0.5, 1.5, 1800.0, 3599.0, 3601.0, 3700.0])
+    assert qc3_window(time) == (1, 4)
+    assert qc3_window(np.array([10.0, 20.0])) == (0, 1)
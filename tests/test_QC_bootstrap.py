@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the bootstrap intervals: seeded resamples on synthetic QC3
+and QC5 data, every interval contains its point estimate
+"""
+import numpy as np
+from QC_bootstrap import interval, linear_fits, residual_resamples
+from QC34_report import qc3_tau_bootstrap
+from QC5_report import qc5_eff_gain, qc5_eff_rate, qc5_gain_bootstrap
+
+def contains(bounds, estimate):
+    lower, upper = bounds
+    return np.all(lower <= estimate) and np.all(estimate <= upper)
+
+def test_interval_is_the_percentile_interval_of_the_deviations():
+    replicates = np.arange(101, dtype=np.float64)
+    assert np.allclose(interval(50.0, replicates, confidence=0.9), [5.0, 95.0])
+    assert np.allclose(interval(10.0, replicates, reference=50.0, confidence=0.9), [-35.0, 55.0])
+
+def test_linear_fits_match_polyfit():
+    rng = np.random.default_rng(1)
+    x = np.linspace(0, 1, 8)
+    y = rng.normal(size=(5, 8))
+    y[2, 3] = np.nan
+    slopes, intercepts = linear_fits(x, y)
+    assert np.isnan(slopes[2]) and np.isnan(intercepts[2])
+    for k in (0, 1, 3, 4):
+        assert np.allclose((slopes[k], intercepts[k]), np.polyfit(x, y[k], 1))
+
+def test_residual_resamples_of_an_exact_line():
+    x = np.arange(10, dtype=np.float64)
+    (slope, intercept), slopes, intercepts = residual_resamples(x, 2*x + 1, 50, np.random.default_rng(0))
+    assert np.isclose(slope, 2) and np.isclose(intercept, 1)
+    assert np.allclose(slopes, 2) and np.allclose(intercepts, 1)
+
+def test_qc3_tau_interval_contains_tau():
+    rng = np.random.default_rng(2)
+    time_hr = np.linspace(0, 2, 200)
+    pressure = 20*np.exp(-time_hr/5)*(1 + 0.002*rng.standard_normal(len(time_hr)))
+    tau = -1/np.polyfit(time_hr, np.log(pressure), 1)[0]
+    bounds = qc3_tau_bootstrap(time_hr, pressure, tau, 500, seed=0)
+    assert contains(bounds, tau)
+    assert bounds[1] - bounds[0] < 0.1*tau
+    # Seeded: a regenerated report shows the same interval
+    assert np.array_equal(bounds, qc3_tau_bootstrap(time_hr, pressure, tau, 500, seed=0))
+
+def test_qc5_intervals_contain_estimates():
+    rng = np.random.default_rng(3)
+    imon = np.array([600.0, 640.0, 680.0, 720.0, 760.0])
+    count_off = np.full(5, 200.0)
+    count_on = count_off + 1000*np.exp(0.01*(imon - 600))
+    rate_columns = (imon, count_off, count_on)
+    source_on = [-1e-9*np.exp(0.02*(i - 600)) + 1e-12*rng.standard_normal(20) for i in imon]
+    source_off = [1e-12*rng.standard_normal(20) for _ in imon]
+    current_columns = tuple(source_on + source_off)
+    rate_measurement = qc5_eff_rate(rate_columns)
+    gains = qc5_eff_gain(current_columns, rate_measurement)
+    intervals = qc5_gain_bootstrap(rate_columns, current_columns, gains, 500, seed=0)
+    assert contains(intervals['rate'], rate_measurement[1])
+    assert contains(intervals['gain'], gains)
+    assert contains(intervals['slope'], 0.0)
+    assert contains(intervals['log_fit'], np.zeros(len(imon)))
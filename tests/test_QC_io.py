@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the safe output helpers: atomic writes leave either the
+complete file or nothing, and foil locks serialize the runs of one foil
+"""
+import os
+import threading
+import pytest
+import QC_io
+from QC_io import FoilLock, atomic_open, atomic_path
+
+needs_flock = pytest.mark.skipif(QC_io.fcntl is None, reason='flock is not available')
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'QC2FAST_A_20241204.txt'
+    with atomic_open(str(path)) as f:
+        f.write('complete\n')
+        # Nothing is visible at the destination until the block completes
+        assert not path.exists()
+    assert path.read_text() == 'complete\n'
+    assert os.listdir(tmp_path) == [path.name]
+    assert path.stat().st_mode & 0o777 == 0o666 & ~QC_io._UMASK
+
+def test_failed_write_leaves_no_partial_file(tmp_path):
+    path = tmp_path / 'plot.png'
+    with pytest.raises(ValueError):
+        with atomic_open(str(path), 'wb') as f:
+            f.write(b'partial')
+            raise ValueError('render failed')
+    assert os.listdir(tmp_path) == []
+
+def test_failed_write_keeps_the_previous_file(tmp_path):
+    path = tmp_path / 'plot.png'
+    path.write_bytes(b'previous')
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_path(str(path)) as tmp:
+            # The temporary file keeps the extension, next to the destination
+            assert os.path.dirname(tmp) == str(tmp_path) and tmp.endswith('.png')
+            with open(tmp, 'wb') as f:
+                f.write(b'partial')
+            raise KeyboardInterrupt
+    assert path.read_bytes() == b'previous'
+    assert os.listdir(tmp_path) == [path.name]
+
+def test_temporary_file_removed_by_the_writer(tmp_path):
+    path = tmp_path / 'out.txt'
+    with pytest.raises(OSError):
+        with atomic_path(str(path)) as tmp:
+            os.remove(tmp)
+            raise OSError('disk full')
+    assert os.listdir(tmp_path) == []
+
+@needs_flock
+def test_second_lock_waits(tmp_path, capsys):
+    events = []
+    first = FoilLock(str(tmp_path), 'A').acquire()
+
+    def second():
+        with FoilLock(str(tmp_path), 'A'):
+            events.append('second')
+
+    thread = threading.Thread(target=second, daemon=True)
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive() and events == []
+    events.append('first released')
+    first.release()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert events == ['first released', 'second']
+    assert 'Waiting for another process working on foil A' in capsys.readouterr().out
+
+@needs_flock
+def test_locks_of_other_foils_are_independent(tmp_path):
+    with FoilLock(str(tmp_path), 'A'), FoilLock(str(tmp_path), 'B') as lock:
+        assert os.path.exists(lock.path)
+
+def test_lock_is_not_reentrant(tmp_path):
+    with FoilLock(str(tmp_path), 'A') as lock:
+        if QC_io.fcntl is not None:
+            with pytest.raises(RuntimeError, match='not reentrant'):
+                lock.acquire()
+    # Released: the same object can be acquired again
+    lock.acquire().release()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the module report driver: the process pool returns the
+same results as a sequential run and reports failed stages
+"""
+import pickle
+from QC_module_report import default_workers, run_stages
+
+STAGES = {
+    'QC3': (pow, (2, 10)),
+    'QC4': (int, ('not a number',)),
+    'QC5': (sorted, ([3.5, 1.25, 2.0],)),
+}
+
+def test_pool_matches_sequential_run():
+    pooled = run_stages(STAGES, workers=3)
+    sequential = run_stages(STAGES, workers=1)
+    assert list(pooled) == list(STAGES)
+    for name in STAGES:
+        (result, seconds, error), (expected, _, expected_error) = pooled[name], sequential[name]
+        assert result == expected
+        assert seconds >= 0
+        assert type(error) is type(expected_error)
+
+def test_failed_stage_is_reported():
+    result, _, error = run_stages(STAGES, workers=3)['QC4']
+    assert result is None
+    assert isinstance(error, ValueError)
+    # Stage errors travel back from the worker processes
+    assert isinstance(pickle.loads(pickle.dumps(error)), ValueError)
+
+def test_default_workers():
+    assert 1 <= default_workers(STAGES) <= len(STAGES)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the parser backends: every backend returns the same arrays
+"""
+import numpy as np
+import pytest
+from QC_parsers import BACKENDS, available_backends, load_file
+
+PART1 = ('Channel:\tCH3\nFoil:\tTEST\nOperator:\tQC\nDate:\t2024-12-04\nRH:\t35\n'
+         'Voltage (V)\tCurrent (uA)\tTime (s)\n'
+         '0\t0.0001\t0.5\n'
+         '10.25\t-2.5e-05\t1.5\n'
+         '\n'
+         '600.125\t0.123456789012345\t12345.678901234\n'
+         '-0.0\t1E+3\t1e-300\n')
+
+QC4 = ('QC4\nModule:\tM2-0003\nDate:\t20230908\nOperator:\tQC\nDivider:\t5 MOhm\nNotes:\t-\n'
+       'Time\tVmon\tImon\tVset\n'
+       'Time\tV\tuA\tV\n'
+       '1\t100.5\t20.1\t100\n'
+       '2\t200.25\t40.0625\t200\n'
+       '3\t4900.875\t980.175\t4900\n')
+
+def test_all_backends_are_registered():
+    assert set(available_backends()) <= set(BACKENDS)
+    assert {'csv', 'numpy'} <= set(available_backends())
+
+@pytest.mark.parametrize('file_type, content', [('qc2_part1', PART1), ('qc4', QC4)], ids=['qc2_part1', 'qc4'])
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_backends_return_identical_arrays(tmp_path, file_type, content, backend):
+    if backend not in available_backends():
+        pytest.skip(f'{backend} is not installed')
+    path = tmp_path / f'{file_type}.txt'
+    path.write_text(content)
+    reference = load_file(str(path), file_type, backend='csv')
+    columns = load_file(str(path), file_type, backend=backend)
+    assert len(columns) == len(reference)
+    for column, expected in zip(columns, reference):
+        assert column.dtype == np.float64
+        # Bit for bit, not approximately: the backend must never change a result
+        assert column.tobytes() == expected.tobytes()
+
+def test_part1_values(tmp_path):
+    path = tmp_path / 'part1.txt'
+    path.write_text(PART1)
+    voltage, current, time = load_file(str(path), 'qc2_part1', backend='csv')
+    assert voltage.tolist() == [0.0, 10.25, 600.125, -0.0]
+    assert current.tolist() == [0.0001, -2.5e-05, 0.123456789012345, 1000.0]
+    assert time.tolist() == [0.5, 1.5, 12345.678901234, 1e-300]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the per-process font cache: documents built from the shared
+parsed fonts are identical to documents built with FPDF.add_font
+"""
+from datetime import datetime, timezone
+import pytest
+import QC_resources
+from QC_resources import FontCache, find_font
+
+FONTS = [('FreeSans', 'FreeSans.ttf'), ('FreeSansB', 'FreeSansBold.ttf')]
+TEXT = 'QC3 time constant 12.34 h, 95% CI 11.9 - 12.8 h, Imon 720 µA'
+
+@pytest.fixture
+def font_cache():
+    try:
+        for _, filename in FONTS:
+            find_font(filename)
+    except FileNotFoundError as e:
+        pytest.skip(str(e))
+    return FontCache()
+
+def document(cache):
+    pdf = QC_resources.FPDF()
+    pdf.set_creation_date(datetime(2024, 12, 4, tzinfo=timezone.utc))
+    pdf.add_page()
+    for family, filename in FONTS:
+        cache.add_font(pdf, family, filename)
+        pdf.set_font(family, '', 12)
+        pdf.cell(0, 8, TEXT, new_x='LMARGIN', new_y='NEXT')
+    return bytes(pdf.output())
+
+def test_shared_fonts_give_the_add_font_document(font_cache, monkeypatch):
+    shared = document(font_cache)
+    monkeypatch.setattr(QC_resources, 'SHARED_FONT_FPDF_VERSIONS', ())
+    assert shared == document(FontCache())
+
+def test_fonts_are_parsed_once(font_cache):
+    first, second = document(font_cache), document(font_cache)
+    assert first == second
+    path = font_cache.resolve('FreeSans.ttf')
+    assert font_cache.parsed(path) is font_cache.parsed(path)
+
+def test_documents_get_their_own_subset(font_cache):
+    pdfs = []
+    for _ in range(2):
+        pdf = QC_resources.FPDF()
+        font_cache.add_font(pdf, 'FreeSans', 'FreeSans.ttf')
+        pdfs.append(pdf)
+    first, second = (pdf.fonts['freesans'] for pdf in pdfs)
+    assert first.cw is second.cw
+    assert first.subset is not second.subset
+    assert first.ttfont is not second.ttfont
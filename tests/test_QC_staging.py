@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the staging cache: copies are revalidated by size and
+modification time, staged in parallel, and skipped with --no-staging
+"""
+import os
+import shutil
+import argparse
+import threading
+import pytest
+import QC_staging
+from QC_staging import StagingCache, add_staging_arguments, staging_from_args
+
+@pytest.fixture
+def copies(monkeypatch):
+    """Source paths copied by shutil.copy2, in call order"""
+    calls = []
+    copy2 = shutil.copy2
+    def record(source, destination):
+        calls.append(source)
+        return copy2(source, destination)
+    monkeypatch.setattr(QC_staging.shutil, 'copy2', record)
+    return calls
+
+def write(path, text, mtime):
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+def test_stage_revalidates_size_and_mtime(tmp_path, copies):
+    source = tmp_path / 'source'
+    source.mkdir()
+    cache = StagingCache(str(tmp_path / 'cache'))
+    path = write(source / 'QC3_A.txt', 'abc', 1000)
+    local = cache.stage(path)
+    assert local != path and open(local).read() == 'abc'
+    assert os.stat(local).st_mtime_ns == os.stat(path).st_mtime_ns
+    assert cache.stage(path) == local and copies == [path]
+    # Same mtime, other size
+    write(source / 'QC3_A.txt', 'abcd', 1000)
+    assert open(cache.stage(path)).read() == 'abcd' and len(copies) == 2
+    # Same size, other mtime
+    write(source / 'QC3_A.txt', 'wxyz', 2000)
+    assert open(cache.stage(path)).read() == 'wxyz' and len(copies) == 3
+    assert cache.stage(path) == local and len(copies) == 3
+    # A removed local copy is staged again
+    os.remove(local)
+    assert open(cache.stage(path)).read() == 'wxyz' and len(copies) == 4
+
+def test_missing_source(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        StagingCache(str(tmp_path / 'cache')).stage(str(tmp_path / 'missing.txt'))
+
+def test_sources_of_other_directories_do_not_collide(tmp_path):
+    cache = StagingCache(str(tmp_path / 'cache'))
+    paths = []
+    for folder in ('a/data', 'b/data'):
+        (tmp_path / folder).mkdir(parents=True)
+        paths.append(write(tmp_path / folder / 'QC3_A.txt', folder, 1000))
+    staged = [cache.stage(path) for path in paths]
+    assert staged[0] != staged[1]
+    assert [open(path).read() for path in staged] == ['a/data', 'b/data']
+
+def test_prefetch_copies_in_parallel(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.mkdir()
+    paths = [write(source / f'QC5_{k}.txt', str(k), 1000) for k in range(4)]
+    # Every copy waits for the others: a serial prefetch breaks the barrier
+    barrier = threading.Barrier(len(paths), timeout=10)
+    copy2 = shutil.copy2
+    def copy_together(source, destination):
+        barrier.wait()
+        return copy2(source, destination)
+    monkeypatch.setattr(QC_staging.shutil, 'copy2', copy_together)
+    staged = StagingCache(str(tmp_path / 'cache'), workers=len(paths)).prefetch(paths)
+    assert list(staged) == paths
+    assert [open(staged[path]).read() for path in paths] == ['0', '1', '2', '3']
+
+def test_stage_directory(tmp_path, copies):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for name in ('QC3_A.txt', 'QC3_B.txt', 'notes.pdf'):
+        write(source / name, name, 1000)
+    (source / 'subdir').mkdir()
+    cache = StagingCache(str(tmp_path / 'cache'))
+    select = lambda name: name.endswith('.txt')
+    mirror = cache.stage_directory(str(source), select)
+    assert sorted(os.listdir(mirror)) == ['QC3_A.txt', 'QC3_B.txt']
+    assert cache.stage_directory(str(source), select) == mirror and len(copies) == 2
+    # Files removed from the source leave the mirror
+    os.remove(source / 'QC3_B.txt')
+    cache.stage_directory(str(source), select)
+    assert os.listdir(mirror) == ['QC3_A.txt'] and len(copies) == 2
+
+def parse(args, **options):
+    parser = argparse.ArgumentParser()
+    add_staging_arguments(parser, **options)
+    return parser.parse_args(args)
+
+def test_no_staging(tmp_path, copies):
+    path = write(tmp_path / 'QC3_A.txt', 'abc', 1000)
+    cache = staging_from_args(parse(['--no-staging', '--staging-dir', str(tmp_path / 'cache')]))
+    assert cache.cache_dir is None
+    assert cache.stage(path) == path
+    assert cache.prefetch([path]) == {path: path}
+    assert cache.stage_directory(str(tmp_path)) == str(tmp_path)
+    assert copies == [] and not (tmp_path / 'cache').exists()
+
+def test_staging_options(tmp_path, monkeypatch):
+    monkeypatch.setenv(QC_staging.STAGING_DIR_ENV, str(tmp_path / 'env'))
+    assert staging_from_args(parse([])).cache_dir == str(tmp_path / 'env')
+    assert staging_from_args(parse(['--staging-dir', str(tmp_path / 'cli')])).cache_dir == str(tmp_path / 'cli')
+    # Opt-in scripts stage only with --stage
+    assert staging_from_args(parse([], default=False)).cache_dir is None
+    assert staging_from_args(parse(['--stage'], default=False)).cache_dir == str(tmp_path / 'env')
+    args = parse(['--data-root', str(tmp_path)], data_root_option=True)
+    assert QC_staging.data_root(args.data_root) == str(tmp_path)